@@ -0,0 +1,152 @@
+# admission.py
+import log
+import utime
+import uasyncio
+
+_log = log.Logger("admission")
+
+class Admission_control:
+    """
+    Load shedding for the web server. Limits open connections (each holds
+    a socket/PCB and a request buffer) and requests being answered at once
+    (response generation is where heap goes). Requests beyond max_active
+    wait in a small queue, served alternately from the API and page
+    classes so neither starves the other; when the queue is full or a
+    wait times out the caller answers 503. Requests are counted per client
+    IP; with rate_per_s set, a token bucket per client marks requests over
+    the client's rate, which then wait behind everyone else's (and give
+    their queue place up to them) instead of being refused.
+    """
+    CLASS_API = 0
+    CLASS_PAGE = 1
+    CLASS_OVER_RATE = 2 # Queue of requests from clients over their rate, served when the other two are empty
+
+    def __init__(self, max_connections=6, max_active=2, max_waiting=4, max_wait_ms=2000,
+                 rate_per_s=0, burst=20, max_clients=8, forget_ms=60000):
+        self.max_connections = max_connections
+        self.max_active = max_active
+        self.max_waiting = max_waiting
+        self.max_wait_ms = max_wait_ms
+        self.rate_per_ms = rate_per_s / 1000
+        self.burst = burst
+        self.max_clients = max_clients
+        # A client is only forgotten once idle this long (and its bucket full again)
+        self.forget_ms = max(forget_ms, int(burst / self.rate_per_ms)) if rate_per_s else forget_ms
+        self.connections = 0 # Open connections admitted
+        self.active = 0 # Requests holding a slot
+        self._waiters = ([], [], []) # Per class FIFO of [Event, slot handed over] waiting for a slot
+        self._next_class = self.CLASS_API # Class offered the next freed slot (API and page alternate)
+        self._clients = {} # Client key -> [tokens, ticks_ms of last request, requests, requests over rate]
+        self._other = [burst, utime.ticks_ms(), 0, 0] # Shared by new clients while the table is full of active ones
+        # Counters (shed load, for diagnostics)
+        self.refused_connections = 0
+        self.refused_requests = 0
+        self.over_rate = 0
+        self.queued = 0
+
+    # --- Connections ---
+    def open_connection(self):
+        """ Sync: Admits a new connection (True) or refuses it when max_connections are open. """
+        if self.connections >= self.max_connections:
+            self.refused_connections += 1
+            return False
+        self.connections += 1
+        return True
+
+    def close_connection(self):
+        self.connections -= 1
+
+    # --- Per client rate ---
+    def note_client(self, key):
+        """ Sync: Counts one request from client key. True if the client is over its rate (queue it as CLASS_OVER_RATE). """
+        now = utime.ticks_ms()
+        entry = self._clients.get(key)
+        if entry is None: entry = self._track(key, now)
+        if self.rate_per_ms:
+            entry[0] = min(self.burst, entry[0] + utime.ticks_diff(now, entry[1]) * self.rate_per_ms)
+        entry[1] = now
+        entry[2] += 1
+        if not self.rate_per_ms: return False
+        if entry[0] < 1:
+            entry[3] += 1
+            self.over_rate += 1
+            return True
+        entry[0] -= 1
+        return False
+
+    def _track(self, key, now):
+        """ Table entry for a new client: replaces the client idle longest if it has been idle forget_ms, else the shared entry. """
+        clients = self._clients
+        if len(clients) >= self.max_clients:
+            oldest = None
+            for k, entry in clients.items():
+                if oldest is None or utime.ticks_diff(entry[1], clients[oldest][1]) < 0: oldest = k
+            if utime.ticks_diff(now, clients[oldest][1]) < self.forget_ms:
+                return self._other # A scan of many IPs shares one bucket instead of resetting everyone's
+            del clients[oldest]
+        entry = [self.burst, now, 0, 0]
+        clients[key] = entry
+        return entry
+
+    def clients(self):
+        """ (key, [tokens, last request ticks_ms, requests, requests over rate]) per tracked client, plus ("other", ...) if used. """
+        items = list(self._clients.items())
+        if self._other[2]: items.append(("other", self._other))
+        return items
+
+    # --- Request slots ---
+    def waiting(self):
+        return len(self._waiters[0]) + len(self._waiters[1]) + len(self._waiters[2])
+
+    async def acquire(self, request_class, over_rate=False):
+        """
+        Waits for a request slot (over_rate: queued as CLASS_OVER_RATE instead of
+        request_class). Returns False (caller answers 503) if the queue is full, the
+        wait times out, or an over-rate wait gave its place to another client's request.
+        """
+        if self.active < self.max_active and not self.waiting():
+            self.active += 1
+            return True
+        if self.waiting() >= self.max_waiting:
+            low = self._waiters[self.CLASS_OVER_RATE]
+            if over_rate or not low:
+                self.refused_requests += 1
+                return False
+            bumped = low.pop() # Newest over-rate waiter gives its place up (acquire() returns False there)
+            bumped[0].set()
+        if over_rate: request_class = self.CLASS_OVER_RATE
+        waiter = [uasyncio.Event(), False]
+        queue = self._waiters[request_class]
+        queue.append(waiter)
+        self.queued += 1
+        event = waiter[0]
+        try:
+            await uasyncio.wait_for_ms(event.wait(), self.max_wait_ms)
+        except uasyncio.TimeoutError:
+            if not event.is_set(): # Not handed over or bumped just as the wait timed out
+                queue.remove(waiter)
+                self.refused_requests += 1
+                _log.warning("Admission: Queued request timed out.")
+                return False
+        except uasyncio.CancelledError: # Connection task cancelled while queued, don't leak the slot
+            if not event.is_set(): queue.remove(waiter)
+            elif waiter[1]: self.release()
+            raise
+        if not waiter[1]: self.refused_requests += 1
+        return waiter[1] # True: slot handed over by release()
+
+    def release(self):
+        """ Sync: Frees a slot, handing it straight to the next waiter (API and page alternate, over-rate last). """
+        waiters = self._waiters
+        for _ in range(2):
+            queue = waiters[self._next_class]
+            self._next_class ^= 1
+            if queue: break
+        else:
+            queue = waiters[self.CLASS_OVER_RATE]
+            if not queue:
+                self.active -= 1
+                return
+        waiter = queue.pop(0)
+        waiter[1] = True # Slot stays taken, now by the waiter
+        waiter[0].set()
@@ -4,6 +4,12 @@ let boardState = null; // Holds the last received state from /api/board_state
 let isUpdating = false; // Flag to prevent rapid updates/API calls
 const UPDATE_INTERVAL = 2500; // Poll slightly faster (milliseconds)
 let pollIntervalId = null; // To store interval ID for stopping/starting polling
+const EVENTS_MIN_INTERVAL = 250; // Minimum gap between pushed deltas (milliseconds)
+let eventSource = null; // Server-Sent Events stream from /api/events (replaces polling when open)
+const CONSOLE_MAX_LINES = 20; // Server log lines kept on screen
+let consoleLines = []; // Server log lines shown, oldest first
+let consoleSeq = 0; // Sequence number of the newest server log line fetched from /api/log
+let consoleFetching = false;
 
 // --- Utility Functions ---
 
@@ -187,12 +193,40 @@ function updateConsoleLog(logLines) {
     const consoleEl = document.getElementById('console-log'); // Correct ID
     if (consoleEl && Array.isArray(logLines)) {
         // Join lines, ensure it doesn't grow indefinitely if server doesn't limit
-        const limitedLines = logLines.slice(-20); // Show last 20 lines from state
+        const limitedLines = logLines.slice(-CONSOLE_MAX_LINES);
         consoleEl.textContent = limitedLines.join('\n').trim();
         consoleEl.scrollTop = consoleEl.scrollHeight; // Scroll to bottom
     }
 }
 
+// Fetches server log lines newer than consoleSeq when the state reports a different log_seq.
+// /api/log answers 'seq text' lines; a lower log_seq means the board rebooted, so start over.
+async function refreshConsoleLog(logSeq) {
+    if (logSeq === undefined || logSeq === consoleSeq || consoleFetching) return;
+    if (logSeq < consoleSeq) { consoleLines = []; consoleSeq = 0; }
+    consoleFetching = true;
+    try {
+        const response = await fetch(`/api/log?since=${consoleSeq}`);
+        if (response.ok) {
+            const text = await response.text();
+            text.split('\n').forEach(line => {
+                const space = line.indexOf(' ');
+                if (space <= 0) return;
+                const seq = parseInt(line.substring(0, space), 10);
+                if (seq <= consoleSeq) return;
+                consoleSeq = seq;
+                consoleLines.push(line.substring(space + 1));
+            });
+            consoleLines = consoleLines.slice(-CONSOLE_MAX_LINES);
+            updateConsoleLog(consoleLines);
+        }
+    } catch (error) {
+        console.warn("Server log fetch failed:", error);
+    }
+    consoleFetching = false;
+    if (boardState && boardState.log_seq !== consoleSeq) refreshConsoleLog(boardState.log_seq); // More arrived meanwhile
+}
+
 // Update a generic status item span by ID
 function setStatusItem(id, value, type = 'normal') {
      const el = document.getElementById(`status-${id}`);
@@ -327,10 +361,13 @@ function updatePwmControls(pins) {
 // --- Main Update Function ---
 // Fetches state from API and updates all relevant UI elements
 async function refreshBoardState() {
+    if (eventSource && eventSource.readyState === EventSource.OPEN) return; // Pushed deltas keep state current
     if (isUpdating) return; // Prevent overlapping updates
     isUpdating = true;
     // console.log("Refreshing board state..."); // Reduce noise in console
-    const newState = await apiCall('/api/board_state'); // Ensure leading slash is present
+    // After the first full state, ask only for what changed since the last revision seen
+    const since = boardState ? `?since=${boardState.rev}&epoch=${boardState.epoch}` : '';
+    const newState = await apiCall(`/api/board_state${since}`); // Ensure leading slash is present
     isUpdating = false;
 
     // Check if the API call failed or returned invalid data
@@ -343,6 +380,15 @@ async function refreshBoardState() {
         return;
     }
 
+    if (newState.full) {
+        applyBoardState(newState);
+    } else {
+        applyBoardDelta(newState);
+    }
+}
+
+// Stores a full state object and updates every UI section from it
+function applyBoardState(newState) {
     boardState = newState; // Store the latest valid state globally
 
     // --- Update UI Sections ---
@@ -388,23 +434,77 @@ async function refreshBoardState() {
          console.warn("Board state missing 'pins' array or is not an array.");
     }
 
-    // Update server log display using state data
-    if (boardState.server_log && Array.isArray(boardState.server_log)) {
-         updateConsoleLog(boardState.server_log);
-    }
+    // Fetch new server log lines if there are any
+    refreshConsoleLog(boardState.log_seq);
 
     // console.log("State refresh complete."); // Reduce noise
 }
 
+// Merges a pushed delta (only changed fields) into boardState and updates the affected UI
+function applyBoardDelta(delta) {
+    if (!boardState) return; // Wait for the initial 'state' event
+    boardState.rev = delta.rev;
+    if (delta.status) {
+        Object.assign(boardState.status, delta.status);
+        setStatusItem('time', boardState.status.time);
+        if (delta.status.temp_c !== undefined) {
+            setStatusItem('temp', boardState.status.temp_c + ' °C');
+            setStatusItem('ip', boardState.status.ip);
+            setStatusItem('ble-status', boardState.status.ble_status);
+            setStatusItem('ble-name', boardState.status.ble_name);
+        }
+    }
+    if (delta.adc_volts) {
+        Object.assign(boardState.adc_volts, delta.adc_volts);
+        for (const ch in delta.adc_volts) setStatusItem(ch, delta.adc_volts[ch] + ' V');
+    }
+    if (delta.pins) {
+        delta.pins.forEach(pinData => {
+            const idx = boardState.pins.findIndex(p => p.id === pinData.id);
+            if (idx >= 0) boardState.pins[idx] = pinData; else boardState.pins.push(pinData);
+            updatePinElement(pinData);
+        });
+        updatePwmControls(boardState.pins);
+    }
+    if (delta.log_seq !== undefined) {
+        boardState.log_seq = delta.log_seq;
+        refreshConsoleLog(delta.log_seq);
+    }
+}
+
+// Opens the push stream; falls back to polling if the browser or board can't keep it open
+function startEventStream() {
+    if (!window.EventSource) { startPolling(); return; }
+    eventSource = new EventSource(`/api/events?min_interval_ms=${EVENTS_MIN_INTERVAL}`);
+    eventSource.addEventListener('state', e => {
+        stopPolling();
+        applyBoardState(JSON.parse(e.data));
+    });
+    eventSource.addEventListener('delta', e => applyBoardDelta(JSON.parse(e.data)));
+    eventSource.onerror = () => {
+        // EventSource reconnects by itself; poll meanwhile so the UI doesn't go stale
+        console.warn("Event stream error, polling until it reconnects.");
+        startPolling();
+    };
+}
+
+function startPolling() {
+    if (!pollIntervalId) {
+        pollIntervalId = setInterval(refreshBoardState, UPDATE_INTERVAL);
+    }
+}
+
+function stopPolling() {
+    if (pollIntervalId) { clearInterval(pollIntervalId); pollIntervalId = null; }
+}
+
 // --- Initialization ---
 // Runs once the initial HTML page's DOM is fully loaded
 document.addEventListener('DOMContentLoaded', () => {
     console.log("DOM Loaded. Starting JS app.");
     refreshBoardState(); // Fetch the initial state immediately
-    // Start the periodic polling only if not already started
-    if (!pollIntervalId) {
-        pollIntervalId = setInterval(refreshBoardState, UPDATE_INTERVAL);
-    }
+    // Prefer pushed updates; polling is only the fallback
+    startEventStream();
 
 
     // Add event listeners to forms to prevent default submission and call JS functions
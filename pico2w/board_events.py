@@ -0,0 +1,99 @@
+# board_events.py
+import log
+import uasyncio
+import ujson
+import utime
+
+_log = log.Logger("board_events")
+
+class Board_event_stream:
+    """
+    One Server-Sent Events subscriber (GET /api/events).
+    Sends a full 'state' event first, then 'delta' events containing only
+    the pins, ADC channels and status fields changed since the last event
+    (tracked by board revision, as for /api/board_state?since=), plus
+    log_seq when the web console has new lines (fetched from /api/log).
+    Deltas are sent no more often than min_interval_ms.
+    """
+    ADC_POLL_MS = 1000       # How often ADC/temperature are sampled while otherwise idle
+    TEMP_DELTA_C = 0.5       # Temperature change that counts as a change
+    HEARTBEAT_MS = 10000     # Send status (time) at least this often; also detects dead clients
+    STATUS_KEYS = ("ip", "ble_status", "ble_name", "wifi_ssid")
+
+    def __init__(self, ctrl, min_interval_ms):
+        self.ctrl = ctrl
+        self.board = ctrl.board
+        self.min_interval_ms = min_interval_ms
+        self._rev = 0 # Board revision covered by the last event sent
+        self._temp_c = 0.0
+        self._status = None
+        self._log_seq = -1 # Console sequence number last sent
+
+    def _collect_delta(self, full):
+        """ Returns a dict of fields changed since the last event (everything if full). """
+        board = self.board
+        if full:
+            delta = board.export_state_dict()
+        else:
+            delta = board.export_state_since(self._rev)
+            if not delta["pins"]: del delta["pins"]
+            if not delta["adc_volts"]: del delta["adc_volts"]
+        log_seq = self.ctrl.console.seq
+        if log_seq != self._log_seq:
+            self._log_seq = log_seq
+            delta["log_seq"] = log_seq
+        self._rev = delta["rev"] # rev/epoch stay in the event so a client can fall back to ?since= polling
+
+        status = delta.pop("status")
+        temp_c = board.get_internal_temp()
+        status_changed = full or abs(temp_c - self._temp_c) >= self.TEMP_DELTA_C
+        if not status_changed:
+            for key in self.STATUS_KEYS:
+                if status[key] != self._status[key]:
+                    status_changed = True
+                    break
+        if status_changed:
+            self._temp_c = temp_c
+            self._status = status
+            delta["status"] = status
+        return delta
+
+    async def _send(self, writer, event, obj):
+        writer.write(b"event: ")
+        writer.write(event)
+        writer.write(b"\ndata: ")
+        writer.write(ujson.dumps(obj).encode('utf-8'))
+        writer.write(b"\n\n")
+        await writer.drain()
+
+    async def run(self, writer):
+        """ Streams events until the client disconnects (OSError propagates to handle_client). """
+        board = self.board
+        __debug__ and _log.debug("Events: Subscriber started (min interval %s ms).", self.min_interval_ms)
+        changed_event = board.subscribe_state() # Set by changes from here on, including while sending
+        try:
+            await self._send(writer, b"state", self._collect_delta(True))
+            last_send = utime.ticks_ms()
+            while True:
+                # Wait for a change notification (returns at once if one came in since the last pass), or time out to sample ADC/temperature
+                try:
+                    await uasyncio.wait_for_ms(changed_event.wait(), self.ADC_POLL_MS)
+                except uasyncio.TimeoutError:
+                    pass
+                # Rate-limit: never send deltas closer together than min_interval_ms
+                wait_ms = self.min_interval_ms - utime.ticks_diff(utime.ticks_ms(), last_send)
+                if wait_ms > 0:
+                    await uasyncio.sleep_ms(wait_ms)
+                changed_event.clear() # Changes after this point wake the next pass
+
+                last_rev = self._rev
+                delta = self._collect_delta(False)
+                changed = delta["rev"] != last_rev or "status" in delta # Pins, ADC and log all stamp a new rev
+                if not changed and utime.ticks_diff(utime.ticks_ms(), last_send) < self.HEARTBEAT_MS:
+                    continue
+                if "status" not in delta:
+                    delta["status"] = {"time": board.get_time_str()} # Keeps the dashboard clock moving
+                await self._send(writer, b"delta", delta)
+                last_send = utime.ticks_ms()
+        finally:
+            board.unsubscribe_state(changed_event)
@@ -16,38 +16,18 @@ def DPRINT(s):
 
 DPRINT("--- boot.py: START ---")
 
-# enable station interface and connect to WiFi access point
+# enable station interface and start joining the WiFi access point.
+# Don't wait here: association and DHCP carry on in the radio while the
+# app loads, and html_server's Wifi_manager picks the join up from there
+# (waiting for the IP, retrying and rejoining after drops).
 DPRINT("Boot: Initializing WLAN...")
-nic = network.WLAN(network.STA_IF)
-nic.active(True)
-DPRINT("Boot: Connecting to ANTEATER2...")
-nic.connect('ANTEATER2', 'Juliaz13') # Use your credentials
+try:
+    import config
+    nic = network.WLAN(network.STA_IF)
+    nic.active(True)
+    DPRINT(f"Boot: Connecting to {config.WIFI_SSID}...")
+    nic.connect(config.WIFI_SSID, config.WIFI_PASSWORD)
+except Exception as e:
+    DPRINT(f"Boot: Error starting Wi-Fi: {e}") # Wifi_manager retries
 
-# now use sockets as usual
-connect_start_time = utime.ticks_ms()
-connect_timeout_ms = 20000 # 20 seconds
-connected = False
-while utime.ticks_diff(utime.ticks_ms(), connect_start_time) < connect_timeout_ms:
-    if nic.isconnected():
-        connected = True
-        break
-    DPRINT(f'Boot: waiting for connection... status={nic.status()}')
-    time.sleep(1)
-
-if connected:
-    DPRINT("Boot: Wi-Fi connected. IP Config:")
-    DPRINT(nic.ifconfig())
-    # Make wlan object globally accessible for html_server.py
-    # Use globals() dictionary for explicit global assignment
-    globals()['wlan'] = nic
-    DPRINT("Boot: 'wlan' object set globally.")
-    DPRINT('Boot: Wi-Fi connection confirmed.')
-    ip=nic.ifconfig()[0]
-    DPRINT(f'Boot: Device IP: http://{ip}/')
-else:
-    DPRINT('Boot: FATAL: wifi connection failed or timed out')
-    # Maybe try resetting or entering a safe mode? For now, just print.
-    # Optionally deactivate WLAN to save power if connect fails?
-    # nic.active(False)
-
-DPRINT("--- boot.py: END ---")
\ No newline at end of file
+DPRINT("--- boot.py: END ---")
@@ -0,0 +1,25 @@
+# chunked_writer.py
+
+class Chunked_writer:
+    """
+    Wraps a StreamWriter so each write() goes out as one HTTP/1.1 chunk
+    (Transfer-Encoding: chunked). Used for streamed bodies whose length is
+    not known up front on keep-alive connections. Call finish() at the end.
+    """
+    def __init__(self, writer):
+        self._writer = writer
+
+    def write(self, buf):
+        n = len(buf)
+        if not n: return # A zero-length chunk would end the body
+        self._writer.write(b"%x\r\n" % n)
+        self._writer.write(buf)
+        self._writer.write(b"\r\n")
+
+    async def drain(self):
+        await self._writer.drain()
+
+    async def finish(self):
+        """ Writes the terminating zero-length chunk. """
+        self._writer.write(b"0\r\n\r\n")
+        await self._writer.drain()
@@ -4,10 +4,16 @@ Global configuration file for the Pico W Digital Twin project.
 """
 
 # Set to True for verbose console output across all modules
-# Set to False for production (silent) operation
+# Set to False for production (silent) operation: debug log calls are then
+# compiled out of the app (see log.py)
 DEBUG = True
 
-def DPRINT(s):
-    """Debug print helper function. Prints if config.DEBUG is True."""
-    if config.DEBUG:
-        print(s)
\ No newline at end of file
+# Logging (log.py). Read once at import.
+# LOG_LEVEL = 30 # Minimum level kept: 10 debug, 20 info, 30 warning, 40 error (default: 10 if DEBUG else 30)
+# LOG_LEVELS = {"pico_board": 10, "html_controler": 20} # Per-module overrides, by module name
+# LOG_ECHO = True # Also print records on the console (default: DEBUG)
+
+# Wi-Fi station credentials (boot.py starts the join, wifi_manager.py keeps the link up).
+# POST /wifi/connect switches networks until the next reset.
+WIFI_SSID = 'ANTEATER2'
+WIFI_PASSWORD = 'Juliaz13'
@@ -0,0 +1,5 @@
+include("$(PORT_DIR)/boards/RPI_PICO2_W/manifest.py")
+
+# The app normally goes in the ROMFS image (tools/build_romfs.py). To freeze
+# it into the firmware instead, uncomment:
+# include("$(BOARD_DIR)/../manifest.py")
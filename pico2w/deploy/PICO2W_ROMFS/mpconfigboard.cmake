@@ -0,0 +1,10 @@
+# cmake file for Raspberry Pi Pico 2 W with a ROMFS partition for the pico2w app
+# Build from micropython/ports/rp2:
+#   make BOARD_DIR=../../../pico2w/deploy/PICO2W_ROMFS
+
+set(PICO2W_BASE_BOARD_DIR ${MICROPY_PORT_DIR}/boards/RPI_PICO2_W)
+include(${PICO2W_BASE_BOARD_DIR}/mpconfigboard.cmake)
+include(${PICO2W_BASE_BOARD_DIR}/mpconfigvariant.cmake)
+
+# This board's manifest (the stock Pico 2 W one, app modules optional)
+set(MICROPY_FROZEN_MANIFEST ${MICROPY_BOARD_DIR}/manifest.py)
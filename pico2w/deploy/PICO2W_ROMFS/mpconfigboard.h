@@ -0,0 +1,12 @@
+// Raspberry Pi Pico 2 W with a ROMFS partition for the pico2w app (modules as .mpy + web assets).
+// Everything else is the stock RPI_PICO2_W configuration.
+#include "boards/RPI_PICO2_W/mpconfigboard.h"
+
+#undef MICROPY_HW_BOARD_NAME
+#define MICROPY_HW_BOARD_NAME                   "Raspberry Pi Pico 2 W (pico2w ROMFS)"
+
+// ROMFS sits just below the filesystem, at the top of the code space. Take its
+// 256K from the filesystem so the firmware keeps the stock 1.5M.
+#define MICROPY_HW_ROMFS_BYTES                  (256 * 1024)
+#undef MICROPY_HW_FLASH_STORAGE_BYTES
+#define MICROPY_HW_FLASH_STORAGE_BYTES          (PICO_FLASH_SIZE_BYTES - 1536 * 1024 - MICROPY_HW_ROMFS_BYTES)
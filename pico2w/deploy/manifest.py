@@ -0,0 +1,42 @@
+# manifest.py
+# pico2w application modules, in MicroPython manifest format (tools/manifestfile.py).
+#
+# tools/build_romfs.py reads this list, compiles each module to .mpy and
+# packs them with the web assets into a ROMFS image. The same list can
+# instead be frozen into the firmware by including this file from a board
+# manifest (see PICO2W_ROMFS/manifest.py).
+#
+# Not listed, they stay on the board's filesystem so they can be edited
+# without a rebuild: boot.py (Wi-Fi), config.py, main.py.
+
+metadata(description="pico2w Pico 2 W digital twin web app")
+options.defaults(opt=1) # -O1: "__debug__ and _log.debug(...)" calls are compiled out (see log.py)
+
+for name in (
+    "log.py",
+    "metrics.py",
+    "input_edges.py",
+    "rp_sio.py",
+    "pin_action_queue.py",
+    "pico_pwm.py",
+    "pwm_effects.py",
+    "rules.py",
+    "history.py",
+    "pico_pin.py",
+    "pico_adc.py",
+    "pico_board.py",
+    "request_handler.py",
+    "html_template.py",
+    "static_asset.py",
+    "chunked_writer.py",
+    "json_stream.py",
+    "state_bin.py",
+    "board_events.py",
+    "http_router.py",
+    "http_request.py",
+    "admission.py",
+    "wifi_manager.py",
+    "html_controler.py",
+    "html_server.py",
+):
+    module(name, base_path="..", opt=options.opt)
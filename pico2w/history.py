@@ -0,0 +1,179 @@
+# history.py
+import array
+import struct
+import utime
+import uasyncio
+import log
+from micropython import const
+
+_log = log.Logger("history")
+
+# Resolutions (index into History_channel.rings)
+RES_RAW = const(0)
+RES_SEC = const(1)
+RES_MIN = const(2)
+RES_NAMES = ("raw", "1s", "1m")
+
+# Binary form (/api/history/<channel>?format=bin): this header, then the
+# columns one after another (raw: value; 1s/1m: min, max, avg), each
+# 'count' little-endian items of 'typecode', oldest first.
+# Value in units = item * scale + offset. Entry k (seq first + k) was
+# recorded (count - 1 - k) * period_ms + age_ms before the response.
+BIN_MAGIC = b'PH'
+BIN_VERSION = 1
+BIN_HEADER = "<2sBBBBHIIIff" # magic, version, typecode (ord), res, columns, count, first seq, period_ms, age_ms, scale, offset
+
+class History_ring:
+    """ Preallocated ring of 1 (raw) or 3 (min, max, avg) columns. seq counts entries ever appended. """
+    def __init__(self, typecode, size, columns):
+        self.size = size
+        self.cols = [array.array(typecode, bytes(size * (1 if typecode == 'B' else 2))) for _ in range(columns)]
+        self.seq = 0
+        self.t_ms = 0 # ticks_ms of the newest entry
+
+    def oldest(self):
+        return self.seq - self.size if self.seq > self.size else 0
+
+    def append1(self, value, now):
+        self.cols[0][self.seq % self.size] = value
+        self.seq += 1
+        self.t_ms = now
+
+    def append3(self, lo, hi, avg, now):
+        i = self.seq % self.size
+        cols = self.cols
+        cols[0][i] = lo; cols[1][i] = hi; cols[2][i] = avg
+        self.seq += 1
+        self.t_ms = now
+
+class History_channel:
+    """
+    One recorded source: raw samples at the history rate, plus 1 s and
+    1 min min/max/avg rings fed from buckets closed by sample count.
+    read() returns an int that fits typecode ('H' for ADC, 'B' for pins);
+    scale/offset convert stored items to units.
+    """
+    def __init__(self, name, typecode, read, scale, offset, lengths):
+        self.name = name
+        self.typecode = typecode
+        self.read = read
+        self.scale = scale
+        self.offset = offset
+        self.rings = (History_ring(typecode, lengths[0], 1), History_ring(typecode, lengths[1], 3), History_ring(typecode, lengths[2], 3))
+        self._sec = [0, 0, 0, 0] # Open 1 s bucket: lo, hi, sum, n
+        self._min = [0, 0, 0, 0] # Open 1 min bucket (of 1 s averages)
+
+    def sample(self, now, per_sec):
+        value = self.read()
+        self.rings[RES_RAW].append1(value, now)
+        if self._add(self._sec, value, value, value) == per_sec:
+            b = self._sec
+            avg = b[2] // b[3]
+            self.rings[RES_SEC].append3(b[0], b[1], avg, now)
+            b[3] = 0
+            if self._add(self._min, b[0], b[1], avg) == 60:
+                m = self._min
+                self.rings[RES_MIN].append3(m[0], m[1], m[2] // m[3], now)
+                m[3] = 0
+
+    @staticmethod
+    def _add(bucket, lo, hi, value):
+        """ Folds one entry into an open bucket; returns its entry count. """
+        if bucket[3]:
+            if lo < bucket[0]: bucket[0] = lo
+            if hi > bucket[1]: bucket[1] = hi
+            bucket[2] += value
+        else:
+            bucket[0] = lo; bucket[1] = hi; bucket[2] = value
+        bucket[3] += 1
+        return bucket[3]
+
+class History:
+    """
+    Records selected board channels into preallocated rings at HZ samples
+    per second, downsampled to 1 s and 1 min min/max/avg so hours of trend
+    fit in a few KB per channel (no allocation per sample beyond the reads).
+    Served by /api/history as streaming CSV or a packed binary form.
+    """
+    HZ = 10 # Raw samples per second (1000 must divide evenly)
+    RAW_LEN = 200 # 20 s of raw samples at 10 Hz
+    SEC_LEN = 180 # 3 min of 1 s buckets
+    MIN_LEN = 240 # 4 h of 1 min buckets
+
+    def __init__(self, metrics=None):
+        self.channels = {}
+        self.periods = (1000 // self.HZ, 1000, 60000) # ms per entry, by resolution
+        self.late = 0 # Samples taken more than one period late (schedule restarted)
+        if metrics:
+            metrics.gauge(b'pico_history_samples_late_total', b'History samples that missed their slot', lambda: self.late, kind=b'counter')
+
+    def add(self, name, typecode, read, scale=1.0, offset=0.0):
+        self.channels[name] = History_channel(name, typecode, read, scale, offset, (self.RAW_LEN, self.SEC_LEN, self.MIN_LEN))
+
+    async def run(self):
+        """ Background task: samples every channel each 1/HZ s on a fixed schedule. """
+        __debug__ and _log.debug("History: Recording %s at %s Hz.", list(self.channels), self.HZ)
+        period = self.periods[RES_RAW]
+        channels = list(self.channels.values())
+        deadline = utime.ticks_ms()
+        while True:
+            now = utime.ticks_ms()
+            for ch in channels:
+                try: ch.sample(now, self.HZ)
+                except Exception as e: _log.error("History: Error sampling %s: %s", ch.name, e)
+            deadline = utime.ticks_add(deadline, period)
+            wait = utime.ticks_diff(deadline, utime.ticks_ms())
+            if wait < -period: # Overran a whole slot: restart the schedule rather than burst
+                self.late += 1
+                deadline = utime.ticks_ms()
+                wait = 0
+            await uasyncio.sleep_ms(wait if wait > 0 else 0)
+
+    def info_dict(self):
+        """ Channels and per-resolution rings (GET /api/history). """
+        return {
+            "hz": self.HZ,
+            "resolutions": {RES_NAMES[r]: {"period_ms": self.periods[r]} for r in range(3)},
+            "channels": {name: {RES_NAMES[r]: {"seq": ring.seq, "oldest": ring.oldest(), "size": ring.size} for r, ring in enumerate(ch.rings)}
+                         for name, ch in self.channels.items()}
+        }
+
+    def _span(self, ring, start):
+        """ First seq and count of the entries held from 'start' on (all held if start is from a previous boot). """
+        if start > ring.seq: start = 0
+        first = max(start, ring.oldest())
+        return first, ring.seq - first
+
+    async def write_csv(self, out, ch, res, start):
+        """ Streams 'seq,ms_ago,value' (raw) or 'seq,ms_ago,min,max,avg' lines, oldest first, in units. """
+        ring = ch.rings[res]
+        first, count = self._span(ring, start)
+        period = self.periods[res]
+        age = utime.ticks_diff(utime.ticks_ms(), ring.t_ms)
+        newest = ring.seq - 1 # Ages are relative to the newest entry at the start
+        scale, offset = ch.scale, ch.offset
+        out.write(b'seq,ms_ago,value\n' if res == RES_RAW else b'seq,ms_ago,min,max,avg\n')
+        for seq in range(first, first + count):
+            if seq < ring.oldest(): continue # Overwritten by the sampler while streaming
+            i = seq % ring.size
+            out.write(b'%d,%d' % (seq, age + (newest - seq) * period))
+            for col in ring.cols:
+                out.write(b',%.4f' % (col[i] * scale + offset))
+            out.write(b'\n')
+            if out.pending: await out.drain()
+        await out.finish()
+
+    async def write_bin(self, out, ch, res, start):
+        """ Streams BIN_HEADER then each column straight from the ring arrays (two slices when wrapped). """
+        ring = ch.rings[res]
+        first, count = self._span(ring, start)
+        age = utime.ticks_diff(utime.ticks_ms(), ring.t_ms)
+        out.write(struct.pack(BIN_HEADER, BIN_MAGIC, BIN_VERSION, ord(ch.typecode), res, len(ring.cols), count, first, self.periods[res], age, ch.scale, ch.offset))
+        i = first % ring.size
+        tail = min(count, ring.size - i) # Entries before the ring wraps
+        for col in ring.cols:
+            mv = memoryview(col)
+            out.write(mv[i:i + tail])
+            if count > tail: out.write(mv[:count - tail])
+            if out.pending: await out.drain()
+        await out.finish()
@@ -2,10 +2,9 @@
 import machine
 import socket
 import utime
-import network
 import time
 from micropython import const
-import config
+import log
 import uasyncio
 import ujson
 import gc # Import garbage collector
@@ -16,20 +15,44 @@ try:
     from pico_board import Pico_board
     from pico_pin import Pico_pin
     from request_handler import Request_handler
+    from html_template import Html_template
+    from static_asset import Static_asset, read_asset
+    from chunked_writer import Chunked_writer
+    from board_events import Board_event_stream
+    from json_stream import Json_stream, Board_state_json
+    from state_bin import Board_state_bin
+    from http_router import Http_router, Http_exchange
+    from http_request import Http_request, REQ_OK, REQ_CLOSED
+    from admission import Admission_control
+    from wifi_manager import WIFI_UP
+    from history import RES_NAMES
 except ImportError as e:
     # Use local print because config might not be loaded yet if this fails early
     print(f"Html_controler: FATAL Import Error: {e}")
     # Define dummy classes to prevent crashes later if imports fail
     class Pico_board: pass
     class Pico_pin: pass
+    class Html_template: pass
+    class Static_asset: pass
+    def read_asset(filename): raise OSError(2, filename)
+    class Chunked_writer: pass
+    class Board_event_stream: pass
+    class Json_stream: pass
+    class Board_state_json: pass
+    class Board_state_bin: pass
+    class Http_router: pass
+    class Http_exchange: pass
+    class Http_request: pass
+    REQ_OK, REQ_CLOSED = 0, 1
+    class Admission_control: pass
+    WIFI_UP = 2
+    RES_NAMES = ()
     class Request_handler: # Dummy
         async def handle_request(self, path):
              return {"status":"error", "message":"Handler missing"}
 
 
-def DPRINT(s):
-    if config.DEBUG:
-        print(s)
+_log = log.Logger("html_controler")
 
 # url_decode (unchanged)
 def url_decode(s):
@@ -49,7 +72,7 @@ def url_decode(s):
                     result.append(char)
                     result.append(part[2:])
                 except ValueError:
-                    DPRINT(f"url_decode: Invalid hex '%{part[:2]}'")
+                    __debug__ and _log.debug("url_decode: Invalid hex '%%%s'", part[:2])
                     result.append('%')
                     result.append(part)
             else:
@@ -57,154 +80,178 @@ def url_decode(s):
                 result.append(part)
         return "".join(result)
     except Exception as e:
-        DPRINT(f"url_decode: Error '{s}': {e}")
+        _log.error("url_decode: Error '%s': %s", s, e)
         return s
 
 class Html_controler:
     """ Async Controller & View. Loads templates, runs server, serves API/HTML/CSS/JS. """
-    WEB_DISPLAY_CONTENT = ["Web Console Log Initializing..."]
+    # --- Web console log (fixed ring of byte slots, see html_out) ---
     CONSOLE_MAX_LINES = 20
+    CONSOLE_LINE_BYTES = 112 # Slot size; longer lines are truncated (12 bytes go to the record header)
+
+    # --- Input scan period (one bulk GPIO_IN sample per scan, see Pico_board.update_inputs) ---
+    INPUT_SCAN_MS = 50
+    INPUT_RESYNC_MS = 1000 # Used instead when edge IRQs track inputs (scan only catches pins without an IRQ and missed edges)
+
+    # --- Server-Sent Events (/api/events) ---
+    EVENTS_MIN_INTERVAL_MS = 250 # Default minimum gap between delta events (?min_interval_ms= overrides)
+    EVENTS_MIN_INTERVAL_LIMITS = (50, 60000)
 
     # --- Template cache variables ---
-    template_parts = None
-    template_vars = None
-    css_content = None
-    js_content = None # Cache for app.js
+    template = None # Html_template (compiled byte slices + slots)
+    assets = None # Path -> Static_asset (style.css, app.js as immutable bytes + ETag)
     templates_loaded = False
     # ---
 
-    def __init__(self, wlan, ssid, password):
-        DPRINT("Ctrl: Initializing Html_controler...")
+    # --- Pinout fragment cache (bytes, keyed on Pico_board.pin_layout_version) ---
+    _pinout_cache = None
+    _pinout_cache_version = -1
+
+    # --- Keep-alive (HTTP/1.1 persistent connections) ---
+    KEEPALIVE_IDLE_S = 10       # Close an idle connection after this many seconds (> app.js poll interval)
+    KEEPALIVE_MAX_REQUESTS = 100 # Close after this many requests on one connection
+    KEEPALIVE_HEADER = f"timeout={KEEPALIVE_IDLE_S}, max={KEEPALIVE_MAX_REQUESTS}"
+    MAX_BODY_BYTES = 2048       # Largest request body accepted (larger Content-Length gets 413)
+    REQUEST_TIMEOUT_MS = 5000   # Deadline for the whole first request on a connection (head and body)
+    SMALL_BODY_BYTES = 1024     # Bodies up to this size are sent in one write with the headers
+    HTTP_PORT = 80
+    STATE_BIN_PORT = 8081       # Raw TCP port for binary board state frames (see state_bin.py; 0 = off)
+
+    # --- Admission control (load shedding, see admission.py) ---
+    MAX_CONNECTIONS = 6         # Open connections; more are answered BUSY_RESPONSE and closed
+    MAX_ACTIVE_REQUESTS = 2     # Requests answered at once, others wait (API and page classes alternate)
+    MAX_WAITING_REQUESTS = 4    # Queue length for a slot; beyond it (or after MAX_WAIT_MS) -> BUSY_RESPONSE
+    MAX_WAIT_MS = 2000
+    CLIENT_RATE_PER_S = 0       # Sustained requests per second per client IP (0: off, requests are only counted) ...
+    CLIENT_BURST = 20           # ... with bursts up to this many; requests over it wait behind other clients', never refused for rate alone
+    RETRY_AFTER_S = 1
+    PAGE_PATHS = ('/', '/style.css', '/app.js', '/favicon.ico') # Page class, everything else is API class
+    ERROR_DRAIN_BYTES = 8192    # After a 400/413/431, up to this much unread request is discarded before closing ...
+    ERROR_DRAIN_MS = 500        # ... for at most this long (closing with unread data sends RST, which can lose the reply)
+    _shed_discard = bytearray(256) # Shared scratch for _shed() and _drain_input()
+    # Pre-rendered so shedding load allocates nothing
+    BUSY_RESPONSE = b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: %d\r\nContent-Type: text/plain\r\nContent-Length: 5\r\nConnection: close\r\n\r\nBusy\n" % RETRY_AFTER_S
+
+    STATUS_REASONS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 431: "Request Header Fields Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+    PICO_IMG_HTML = b'<div style="width:250px; height:150px; border:1px solid #ccc; text-align:center; padding-top:50px; margin:auto; border-radius:8px;">Pico W Img</div>'
+    ERROR_PAGE_STATE = b"""<!DOCTYPE html><html><head><title>Error</title></head><body><h1>Board State Error</h1></body></html>"""
+
+    def __init__(self, wifi):
+        """ wifi: Wifi_manager, already joining (its run() task keeps the link up). """
+        __debug__ and _log.debug("Ctrl: Initializing Html_controler...")
+        self.console = log.Log_ring(self.CONSOLE_MAX_LINES, self.CONSOLE_LINE_BYTES)
+        self.console.append(log.INFO, _log.id, "Web Console Log Initializing...")
+        self.wifi = wifi
+        self.ip = wifi.ip
         
-        DPRINT("Ctrl: Instantiating Pico_board...")
-        self.board = Pico_board(wlan, ssid, password)
-        DPRINT("Ctrl: Pico_board instantiated.")
+        __debug__ and _log.debug("Ctrl: Instantiating Pico_board...")
+        self.board = Pico_board(wifi)
+        __debug__ and _log.debug("Ctrl: Pico_board instantiated.")
         
-        DPRINT("Ctrl: Instantiating Request_handler...")
+        __debug__ and _log.debug("Ctrl: Instantiating Request_handler...")
         self.handler = Request_handler(self.board) # Pass board to handler
-        DPRINT("Ctrl: Request_handler instantiated.")
+        __debug__ and _log.debug("Ctrl: Request_handler instantiated.")
+        if self.board.rules: self.board.rules.load_saved(self.handler.parse_pin_ops) # Rules from the last upload
+
+        self.state_json = Board_state_json(self.board) # Streams /api/board_state without building dicts
+        self.state_bin = Board_state_bin(self.board, lambda: self.console.seq) # /api/board_state.bin and STATE_BIN_PORT
+        self.metrics = self.board.metrics
+        self.router = self._build_router()
+        self.admission = Admission_control(self.MAX_CONNECTIONS, self.MAX_ACTIVE_REQUESTS, self.MAX_WAITING_REQUESTS,
+                                           self.MAX_WAIT_MS, self.CLIENT_RATE_PER_S, self.CLIENT_BURST)
+        self._register_metrics()
         
         # Add log_message method to board
         if not hasattr(self.board, 'log_message'):
             self.board.log_message = self.html_out
-        DPRINT("Ctrl: Monkey-patched 'log_message' onto board instance.")
-
-        self.ip = "0.0.0.0"
-        if self.board.nic and self.board.nic.isconnected():
-            self.ip = self.board.nic.ifconfig()[0]
-            DPRINT(f"Ctrl: Wi-Fi OK. IP: {self.ip}. Attempting initial template load...")
-            # Try loading templates initially.
-            if self.load_templates():
-                self.html_out(f"Board & Templates ready. IP: http://{self.ip}/", element_tag='system')
-            else:
-                 self.html_out(f"Board ready, but TEMPLATES FAILED TO LOAD. IP: http://{self.ip}/", element_tag='error')
-            DPRINT(f"Ctrl: Init OK. IP: {self.ip}")
+        __debug__ and _log.debug("Ctrl: Monkey-patched 'log_message' onto board instance.")
+
+        wifi.add_listener(self._on_wifi_change)
+        # Templates don't need the network: load them while the radio is still joining
+        if self.load_templates():
+            self.html_out("Board & Templates ready.", element_tag='system')
         else:
-            self.html_out("Board init, Wi-Fi disconnected.", element_tag='error')
-            DPRINT("Ctrl: Init complete, NO WIFI.")
+             self.html_out("Board ready, but TEMPLATES FAILED TO LOAD.", element_tag='error')
+        __debug__ and _log.debug("Ctrl: Init OK. Wi-Fi state %s, IP %s", wifi.state, self.ip)
+
+    def _on_wifi_change(self, state, ip):
+        """ Wifi_manager listener: notes link changes on the console (which also pushes the new status/IP to clients). """
+        was_up = self.ip != "0.0.0.0"
+        self.ip = ip
+        if state == WIFI_UP:
+            self.html_out(f"Wi-Fi connected to '{self.wifi.ssid}'. IP: http://{ip}/", 'system')
+        elif was_up:
+            self.html_out("Wi-Fi link lost, reconnecting...", 'error')
 
     # --- Template Loading and Memory Management ---
     def load_templates(self):
-        """ Reads HTML/CSS/JS files, parses HTML template, caches content. """
-        DPRINT("Ctrl.load_templates: Loading template.html, style.css, app.js...")
+        """ Reads HTML/CSS/JS files, compiles HTML template, caches content. """
+        __debug__ and _log.debug("Ctrl.load_templates: Loading template.html, style.css, app.js...")
         if self.templates_loaded:
-             DPRINT("Ctrl.load_templates: Already loaded.")
+             __debug__ and _log.debug("Ctrl.load_templates: Already loaded.")
              return True
 
         # Clear existing cache
-        DPRINT("Ctrl.load_templates: Clearing old cache and running gc...")
-        self.template_parts = None
-        self.template_vars = None
-        self.css_content = None
-        self.js_content = None
+        __debug__ and _log.debug("Ctrl.load_templates: Clearing old cache and running gc...")
+        self.template = None
+        self.assets = None
         self.templates_loaded = False
-        gc.collect()
-        DPRINT(f"Ctrl.load_templates: Free RAM before load: {gc.mem_free()}")
+        self.metrics.collect()
+        __debug__ and _log.debug("Ctrl.load_templates: Free RAM before load: %s", gc.mem_free())
 
         try:
-            # --- Load HTML Template ---
-            DPRINT("Ctrl.load_templates: Reading template.html...")
-            with open('template.html', 'r') as f:
-                template_content = f.read()
-            DPRINT(f"Ctrl.load_templates: Read template.html ({len(template_content)} chars)")
-
-            # --- Parse HTML Template ---
-            DPRINT("Ctrl.load_templates: Parsing template.html...")
-            parts = []
-            var_names = []
-            start_index = 0
-            tag_start = '<EXTDATA name="'
-            tag_end = '" />'
-            placeholder_tag = '<EXTDATA'
-
-            if placeholder_tag in template_content:
-                while True:
-                    tag_index = template_content.find(tag_start, start_index)
-                    if tag_index == -1:
-                        parts.append(template_content[start_index:])
-                        break
-                    parts.append(template_content[start_index:tag_index])
-                    name_start = tag_index + len(tag_start)
-                    name_end = template_content.find(tag_end, name_start)
-                    if name_end == -1:
-                        raise ValueError(f"Unclosed <EXTDATA> near index {name_start}")
-                    var_name = template_content[name_start:name_end].strip()
-                    if not var_name:
-                        raise ValueError(f"Empty name in <EXTDATA> near index {name_start}")
-                    var_names.append(var_name)
-                    start_index = name_end + len(tag_end)
-            else:
-                 parts.append(template_content) # Whole template is static
-                 DPRINT("Ctrl.load_templates: No <EXTDATA> tags found.")
-
-            self.template_parts = parts
-            self.template_vars = var_names
-            DPRINT(f"Ctrl.load_templates: Parsed template ({len(parts)} parts, {len(var_names)} vars).")
-
-            # --- Load CSS ---
-            DPRINT("Ctrl.load_templates: Reading style.css...")
-            with open('style.css', 'r') as f:
-                self.css_content = f.read()
-            DPRINT(f"Ctrl.load_templates: Read style.css ({len(self.css_content)} chars)")
-
-            # --- Load JS ---
-            DPRINT("Ctrl.load_templates: Reading app.js...")
-            with open('app.js', 'r') as f:
-                self.js_content = f.read()
-            DPRINT(f"Ctrl.load_templates: Read app.js ({len(self.js_content)} chars)")
+            # --- Load HTML Template (as bytes, compiled once into slices + slots) ---
+            __debug__ and _log.debug("Ctrl.load_templates: Reading template.html...")
+            template_content = read_asset('template.html') # Bytes, or a view into flash from ROMFS
+            __debug__ and _log.debug("Ctrl.load_templates: Read template.html (%s bytes)", len(template_content))
+
+            __debug__ and _log.debug("Ctrl.load_templates: Compiling template.html...")
+            self.template = Html_template(template_content)
+            template_content = None # Template keeps its own reference
+
+            # --- Load CSS / JS (bytes + ETag, plus .gz variants if deployed) ---
+            __debug__ and _log.debug("Ctrl.load_templates: Reading style.css and app.js...")
+            self.assets = {
+                '/style.css': Static_asset('style.css', 'text/css'),
+                '/app.js': Static_asset('app.js', 'application/javascript'),
+            }
 
             self.templates_loaded = True
             self.html_out("Templates loaded.", 'mem')
-            gc.collect()
-            DPRINT(f"Ctrl.load_templates: SUCCESS. Free RAM after load: {gc.mem_free()}")
+            self.metrics.collect()
+            __debug__ and _log.debug("Ctrl.load_templates: SUCCESS. Free RAM after load: %s", gc.mem_free())
             return True
 
         except Exception as e:
-            DPRINT(f"Ctrl.load_templates: ERROR: {e}")
+            _log.error("Ctrl.load_templates: ERROR: %s", e)
             sys.print_exception(e)
             self.free_templates()
             return False
 
     def free_templates(self):
         """ Clears cached template/CSS/JS content and runs GC. """
-        DPRINT("Ctrl.free_templates: Freeing templates from RAM...")
-        self.template_parts = None
-        self.template_vars = None
-        self.css_content = None
-        self.js_content = None
+        __debug__ and _log.debug("Ctrl.free_templates: Freeing templates from RAM...")
+        self.template = None
+        self.assets = None
+        self._pinout_cache = None
+        self._pinout_cache_version = -1
         self.templates_loaded = False
-        gc.collect()
+        self.metrics.collect()
         self.html_out("Templates freed.", 'mem')
-        DPRINT(f"Ctrl.free_templates: Free RAM: {gc.mem_free()}")
+        __debug__ and _log.debug("Ctrl.free_templates: Free RAM: %s", gc.mem_free())
         return True
 
     # Server-side Logging
     def html_out(self, output_data, element_tag='p'):
+        """ Adds a line to the web console ring (oldest overwritten). Clients see the new console.seq and fetch /api/log?since=. """
         output_data_str = str(output_data)
-        DPRINT(f"Ctrl.html_out: [{element_tag.upper()}] {output_data_str}")
-        self.WEB_DISPLAY_CONTENT.append(f"[{element_tag.upper()}] {output_data_str}")
-        if len(self.WEB_DISPLAY_CONTENT) > self.CONSOLE_MAX_LINES:
-            self.WEB_DISPLAY_CONTENT = self.WEB_DISPLAY_CONTENT[-self.CONSOLE_MAX_LINES:]
+        __debug__ and _log.debug("Ctrl.html_out: [%s] %s", element_tag.upper(), output_data_str)
+        self.console.append(log.INFO, _log.id, "[%s] %s" % (element_tag.upper(), output_data_str.replace("\n", " ")))
+        board = getattr(self, 'board', None)
+        if hasattr(board, 'next_rev'):
+            board.next_rev() # A new rev makes pollers and /api/events subscribers send log_seq
+        if hasattr(board, 'notify_state_changed'):
+            board.notify_state_changed()
 
     # --- HTML Generation Shells ---
     def _generate_pin_element_shell(self, pin, index):
@@ -233,10 +280,12 @@ class Html_controler:
         
         if is_gpio:
             js_pin_id = pin._id if isinstance(pin._id, int) and pin._id >= 0 else f"'{pin_id}'"
-            mode_options = ['<option value="IN">IN</option>', '<option value="OUT">OUT</option>']
+            mode_names = ['IN', 'OUT']
             if hasattr(pin, 'is_adc_capable') and pin.is_adc_capable:
-                 mode_options.append('<option value="ADC">ADC</option>')
-            mode_options.append('<option value="PWM">PWM</option>')
+                 mode_names.append('ADC')
+            mode_names.append('PWM')
+            # Current mode is baked in as 'selected'; the pinout cache is keyed on the board's pin layout version
+            mode_options = [f'<option value="{m}"{" selected" if m == pin.mode else ""}>{m}</option>' for m in mode_names]
             mode_select = f'<select id="pin-{pin_id}-mode" onchange="setPinMode({js_pin_id}, this.value)">{"".join(mode_options)}</select>'
             pull_options = ['<option value="NONE">Pull:NONE</option>', '<option value="UP">Pull:UP</option>', '<option value="DOWN">Pull:DOWN</option>']
             pull_control = f'<select id="pin-{pin_id}-pull" style="display: none;" onchange="setPinPull({js_pin_id}, this.value)">{"".join(pull_options)}</select>'
@@ -256,348 +305,618 @@ class Html_controler:
             element_html = f'<div {element_id_attr} class="{pin_classes.strip()}" {data_attr}>{controls_html}{pin_label_html}{pin_index_html}</div>'
         return element_html
 
-    def _generate_pinout_html_content(self):
-        DPRINT("Ctrl._generate_pinout_html_content...")
+    def _pinout_html(self):
+        """ Returns the pinout grid as bytes, rebuilt only when the board's pin layout version changes. """
+        version = getattr(self.board, 'pin_layout_version', 0)
+        if self._pinout_cache is not None and self._pinout_cache_version == version:
+            return self._pinout_cache
+
+        __debug__ and _log.debug("Ctrl._pinout_html: Rebuilding pinout cache for layout version %s...", version)
+        self._pinout_cache = None # Drop old cache before building the new one
         if not hasattr(self.board, 'pins_left') or not hasattr(self.board, 'pins_right'):
-             return "<p>Error: Board pins missing.</p>"
-        
-        # Pre-join the lists into strings FIRST
-        left_pins_html = ''.join([self._generate_pin_element_shell(pin, i + 1) for i, pin in enumerate(self.board.pins_left)])
-        right_pins_html = ''.join([self._generate_pin_element_shell(pin, 40 - i) for i, pin in enumerate(self.board.pins_right)])
+             return b"<p>Error: Board pins missing.</p>"
 
-        # Split the semicolon-separated assignments onto separate lines
-        onboard_led = "" 
-        onboard_led_shell_id = "pin-25-shell" 
-        onboard_led_data_attr = 'data-pin-id="25"'
+        chunks = [b'<div class="pinout-grid"><div class="pin-col-left">']
+        for i, pin in enumerate(self.board.pins_left):
+            chunks.append(self._generate_pin_element_shell(pin, i + 1).encode('utf-8'))
 
+        onboard_led = ""
+        onboard_led_id = 25
         if hasattr(self.board, 'onboard_led_pin') and self.board.onboard_led_pin and hasattr(self.board.onboard_led_pin, '_id'):
              onboard_led_id = self.board.onboard_led_pin._id
              onboard_led = self._generate_pin_element_shell(self.board.onboard_led_pin, onboard_led_id)
-             # Ensure these variables use underscores, not hyphens
-             onboard_led_shell_id = f"pin-{onboard_led_id}-shell" 
-             onboard_led_data_attr = f'data-pin-id="{onboard_led_id}"'
-             
-        img_html = '<div style="width:250px; height:150px; border:1px solid #ccc; text-align:center; padding-top:50px; margin:auto; border-radius:8px;">Pico W Img</div>'
-        
-        # Assign to variable before returning
-        pinout_html_content = f"""<div class="pinout-grid"><div class="pin-col-left">{left_pins_html}</div><div class="pico-graphic">{img_html}<div class="onboard-led-control" id="{onboard_led_shell_id}" {onboard_led_data_attr}>{onboard_led}</div></div><div class="pin-col-right">{right_pins_html}</div></div>"""
-        return pinout_html_content
-
-
-    # --- webpage method uses template ---
-    def webpage(self):
-        """ Generates HTML by loading template and replacing placeholders. """
-        DPRINT("Ctrl.webpage: Generating HTML from template...")
-
-        # --- Ensure templates are loaded ---
-        if not self.templates_loaded:
-             DPRINT("Ctrl.webpage: Templates not loaded, calling load_templates()...")
-             if not self.load_templates():
-                  DPRINT("Ctrl.webpage: ERROR - Template loading failed.")
-                  return """<!DOCTYPE html><html><head><title>Error</title></head><body><h1>Template Load Error</h1></body></html>"""
-        DPRINT("Ctrl.webpage: Templates are loaded.")
-        
-        # --- Get current data ---
-        DPRINT("Ctrl.webpage: Fetching current board state...")
-        data_dict = {}
-        try:
-             state = self.board.export_state_dict() # Uses cached values mostly
-             status = state.get("status", {})
-             adcs = state.get("adc_volts", {})
-             data_dict = { # Map state keys to <EXTDATA> names
-                 "time": status.get("time", "--:--:--"), "temp_c": status.get("temp_c", "--.-"),
-                 "ip": status.get("ip", "0.0.0.0"), "ble_status": status.get("ble_status", "Unknown"),
-                 "ble_name": status.get("ble_name", "N/A"), "wifi_ssid": status.get("wifi_ssid", "N/A"),
-                 "adc0_v": adcs.get("adc0", "-.---"), "adc1_v": adcs.get("adc1", "-.---"),
-                 "adc2_v": adcs.get("adc2", "-.---"),
-                 "console_log": "\n".join(self.WEB_DISPLAY_CONTENT),
-                 "pinout_html": self._generate_pinout_html_content() # Generate pinout HTML structure
-             }
-             DPRINT("Ctrl.webpage: Board state fetched OK.")
-        except Exception as e:
-            DPRINT(f"Ctrl.webpage: ERROR getting board state: {e}")
-            sys.print_exception(e)
-            return """<!DOCTYPE html><html><head><title>Error</title></head><body><h1>Board State Error</h1></body></html>"""
 
-        # --- Build HTML using cached parts and vars ---
-        DPRINT("Ctrl.webpage: Building HTML from parts...")
-        result_html_list = [] # Changed name for clarity
-        try:
-            if not self.template_parts or self.template_vars is None:
-                raise ValueError("Template not parsed.")
-            num_vars = len(self.template_vars)
-            num_parts = len(self.template_parts)
-            if num_parts != num_vars + 1:
-                raise ValueError(f"Template mismatch: {num_parts} parts, {num_vars} vars")
-            DPRINT(f"Ctrl.webpage: Joining {num_parts} parts and {num_vars} vars...")
-            
-            for i in range(num_vars):
-                result_html_list.append(self.template_parts[i]) # Static part
-                var_name = self.template_vars[i]
-                value = data_dict.get(var_name, f"[{var_name}?]") # Lookup value
-                result_html_list.append(str(value)) # Append value
-            result_html_list.append(self.template_parts[-1]) # Final static part
-            
-            # Assign final string to variable before returning
-            final_html = "".join(result_html_list) 
-            DPRINT(f"Ctrl.webpage: HTML built successfully ({len(final_html)} chars).")
-            return final_html
-        except Exception as e:
-            DPRINT(f"Ctrl.webpage: ERROR during template join: {e}")
-            sys.print_exception(e)
-            return """<!DOCTYPE html><html><head><title>Error</title></head><body><h1>Template Engine Error</h1></body></html>"""
+        chunks.append(b'</div><div class="pico-graphic">')
+        chunks.append(self.PICO_IMG_HTML)
+        chunks.append(f'<div class="onboard-led-control" id="pin-{onboard_led_id}-shell" data-pin-id="{onboard_led_id}">{onboard_led}</div></div><div class="pin-col-right">'.encode('utf-8'))
+        for i, pin in enumerate(self.board.pins_right):
+            chunks.append(self._generate_pin_element_shell(pin, 40 - i).encode('utf-8'))
+        chunks.append(b'</div></div>')
+
+        self._pinout_cache = b"".join(chunks)
+        self._pinout_cache_version = version
+        __debug__ and _log.debug("Ctrl._pinout_html: Cached %s bytes.", len(self._pinout_cache))
+        return self._pinout_cache
+
+    async def _stream_console_log(self, writer):
+        """ Streams the console ring's lines, oldest first, straight from their slots. """
+        console = self.console
+        first = seq = console.oldest()
+        while seq <= console.seq:
+            if seq > first: writer.write(b"\n")
+            writer.write(console.record(seq)[3])
+            seq += 1
+        await writer.drain()
+
+    # --- webpage uses the precompiled template ---
+    def webpage_values(self):
+        """ Returns slot values for the compiled template, aligned with template.names. """
+        __debug__ and _log.debug("Ctrl.webpage_values: Fetching current board state...")
+        state = self.board.export_state_dict() # Uses cached values mostly
+        status = state.get("status", {})
+        adcs = state.get("adc_volts", {})
+        data_dict = { # Map state keys to <EXTDATA> names
+            "time": status.get("time", "--:--:--"), "temp_c": status.get("temp_c", "--.-"),
+            "ip": status.get("ip", "0.0.0.0"), "ble_status": status.get("ble_status", "Unknown"),
+            "ble_name": status.get("ble_name", "N/A"), "wifi_ssid": status.get("wifi_ssid", "N/A"),
+            "adc0_v": adcs.get("adc0", "-.---"), "adc1_v": adcs.get("adc1", "-.---"),
+            "adc2_v": adcs.get("adc2", "-.---"),
+            "console_log": self._stream_console_log, # Streamed
+            "pinout_html": self._pinout_html()       # Cached bytes per layout version
+        }
+        return [data_dict.get(name, f"[{name}?]") for name in self.template.names]
 
 
     # --- ASYNC Server Loop (Serves HTML, CSS, JS, API) ---
     async def handle_client(self, reader, writer):
+        """ Serves requests on one connection until close, idle timeout or KEEPALIVE_MAX_REQUESTS. """
         addr = writer.get_extra_info('peername')
-        DPRINT(f"Ctrl.handle_client: Connect from {addr}")
+        __debug__ and _log.debug("Ctrl.handle_client: Connect from %s", addr)
+        if not self.admission.open_connection():
+            __debug__ and _log.debug("Ctrl.handle_client: %s connections open, refusing.", self.admission.connections)
+            await self._shed(reader, writer, self.BUSY_RESPONSE)
+            return
+        client = addr[0] if isinstance(addr, tuple) else bytes(addr[4:8]) # IP string (lwIP), or IPv4 bytes of a raw sockaddr (unix port)
+        self._set_nodelay(writer)
+        request_index = 0
+        try:
+            request = Http_request(reader, self.MAX_BODY_BYTES) # Buffer reused by every request on this connection
+            # Pipelined requests are read and answered strictly in order
+            while request_index < self.KEEPALIVE_MAX_REQUESTS:
+                keep_alive = await self._handle_request(request, writer, request_index, client)
+                request_index += 1
+                if not keep_alive:
+                    break
+            __debug__ and _log.debug("Ctrl.handle_client: Served %s request(s) on this connection.", request_index)
+        except uasyncio.CancelledError: 
+            __debug__ and _log.debug("Ctrl.handle_client: Task cancelled.")
+            raise
+        except OSError as e: 
+            _log.error("Ctrl.handle_client: OS Error: %s (Client likely disconnected)", e)
+        except MemoryError:
+            __debug__ and _log.debug("Ctrl.handle_client: Out of memory on connection, dropping it.")
+            self.metrics.collect()
+        finally:
+            __debug__ and _log.debug("Ctrl.handle_client: FINALLY block. Closing connection.")
+            self.admission.close_connection()
+            if writer: 
+                writer.close()
+                await writer.wait_closed()
+            __debug__ and _log.debug("Ctrl.handle_client: Connection fully closed.")
+
+    async def _shed(self, reader, writer, response):
+        """ Sends a pre-rendered refusal (503) and closes the connection. """
+        try:
+            writer.write(response)
+            await writer.drain()
+            # Discard a request that already arrived (non-blocking), closing with unread data sends RST and can lose the 503
+            reader.s.readinto(self._shed_discard)
+        except OSError: pass
+        writer.close()
+        await writer.wait_closed()
+
+    async def _drain_input(self, reader):
+        """ Reads and discards what the client still sends (a rejected body), up to ERROR_DRAIN_BYTES / ERROR_DRAIN_MS or its close. """
+        discard = memoryview(self._shed_discard)
+        left = self.ERROR_DRAIN_BYTES
+        deadline = utime.ticks_add(utime.ticks_ms(), self.ERROR_DRAIN_MS)
+        try:
+            while left > 0:
+                ms = utime.ticks_diff(deadline, utime.ticks_ms())
+                if ms <= 0: break
+                n = await uasyncio.wait_for_ms(reader.readinto(discard[:min(left, len(discard))]), ms)
+                if n is None: continue
+                if not n: break # Client closed: nothing left to reset
+                left -= n
+        except (uasyncio.TimeoutError, OSError): pass
+
+    def _query_str(self, full_path, name, default):
+        """ Returns query parameter 'name' from full_path (not URL-decoded), or default. """
+        query_start = full_path.find('?')
+        if query_start < 0: return default
+        for pair in full_path[query_start + 1:].split('&'):
+            key, _, value = pair.partition('=')
+            if key == name: return value
+        return default
+
+    def _query_int(self, full_path, name, default):
+        """ Returns integer query parameter 'name' from full_path, or default. """
+        value = self._query_str(full_path, name, None)
+        if value is None: return default
+        try: return int(value)
+        except ValueError: return default
+
+    def _set_nodelay(self, writer):
+        """ Disables Nagle on the client socket so keep-alive responses aren't held for delayed ACKs. """
+        nodelay = getattr(socket, 'TCP_NODELAY', None)
+        if nodelay is None: return # Not supported by this port's socket module
+        try: writer.s.setsockopt(socket.IPPROTO_TCP, nodelay, 1)
+        except (AttributeError, OSError) as e: __debug__ and _log.debug("Ctrl.handle_client: TCP_NODELAY not set: %s", e)
+
+    async def _handle_request(self, request, writer, request_index, client):
+        """ Reads and answers one request. Returns True if the connection should stay open. """
         response_sent = False
+        has_slot = False
         try:
-            # Read request line with timeout
-            DPRINT("Ctrl.handle_client: Awaiting request line...")
-            request_line_bytes = b'' # Initialize
+            # Read the whole request (head and body) under one deadline: 5 s for the first request, then the keep-alive idle timeout
+            __debug__ and _log.debug("Ctrl.handle_client: Awaiting request...")
             try:
-                request_line_bytes = await uasyncio.wait_for(reader.readline(), 5.0)
+                timeout_ms = self.REQUEST_TIMEOUT_MS if request_index == 0 else self.KEEPALIVE_IDLE_S * 1000
+                status = await uasyncio.wait_for_ms(request.read(), timeout_ms)
             except uasyncio.TimeoutError:
-                DPRINT("Ctrl.handle_client: Timeout reading req line.")
-                return # Exit cleanly on timeout
-            except Exception as e:
-                DPRINT(f"Ctrl.handle_client: Error reading req line: {e}")
-                return # Exit on other read errors
-            
-            if not request_line_bytes:
-                DPRINT("Ctrl.handle_client: Empty request line. Closing.")
-                return
-                
-            request_line = request_line_bytes.decode('utf-8', 'ignore').strip()
-            DPRINT(f"Ctrl.handle_client: Raw Request line: {request_line}")
+                _log.warning("Ctrl.handle_client: Timeout reading request.")
+                return False # Exit cleanly on timeout
+            if status == REQ_CLOSED:
+                __debug__ and _log.debug("Ctrl.handle_client: Connection closed before a request. Closing.")
+                return False
+            if status != REQ_OK:
+                __debug__ and _log.debug("Ctrl.handle_client: Rejecting request (%s). Closing.", status)
+                self._count_response(status)
+                body = self.STATUS_REASONS.get(status, "Error").encode('utf-8')
+                writer.write(b"HTTP/1.1 %d %s\r\nContent-Type: text/plain\r\nConnection: close\r\nContent-Length: %d\r\n\r\n%s" % (status, body, len(body), body))
+                await writer.drain()
+                await self._drain_input(request.reader) # Body (or rest of the head) is still unread
+                return False
+            method = request.method
+            full_path = request.full_path
+            path = request.path
+            __debug__ and _log.debug("Ctrl.handle_client: Parsed Method=%s, Path=%s, HTTP/1.1=%s, Body=%s bytes", method, path, request.http11, request.content_length)
+            t0 = utime.ticks_us() # Route latency covers admission wait, handler and sending
+
+            # --- Admission: a request slot, fair between API and page requests; clients over their rate queue last ---
+            over_rate = self.admission.note_client(client)
+            if over_rate: __debug__ and _log.debug("Ctrl.handle_client: Client %s over its request rate, deprioritised.", client)
+            request_class = Admission_control.CLASS_PAGE if path in self.PAGE_PATHS else Admission_control.CLASS_API
+            has_slot = await self.admission.acquire(request_class, over_rate)
+            if not has_slot:
+                __debug__ and _log.debug("Ctrl.handle_client: Server saturated, sending 503.")
+                self._count_response(503)
+                writer.write(self.BUSY_RESPONSE)
+                await writer.drain()
+                return False
 
-            # Read/discard headers
-            DPRINT("Ctrl.handle_client: Discarding headers...")
-            while True:
-                header_line = b'' # Initialize
-                try:
-                    header_line = await uasyncio.wait_for(reader.readline(), 1.0)
-                except uasyncio.TimeoutError:
-                    break # Assume end of headers on timeout
-                except Exception:
-                    break # Exit on other read errors
-                if not header_line or header_line == b'\r\n':
-                    break # Blank line signifies end of headers
-                # DPRINT(f"Header: {header_line.decode().strip()}") # Optional: VERY verbose
-            DPRINT("Ctrl.handle_client: Headers discarded.")
-
-            method = "GET"
-            full_path = "/"
-            path = "/"
-            try:
-                parts = request_line.split()
-                method = parts[0].upper()
-                full_path = parts[1]
-                path = full_path.split('?', 1)[0]
-            except IndexError:
-                pass # Use defaults if split fails
-            DPRINT(f"Ctrl.handle_client: Parsed Method={method}, Path={path}")
-
-            # --- ROUTING ---
-            response_code = 200
-            response_headers = {"Connection": "close"}
-            response_body_bytes = b''
-            DPRINT(f"Ctrl.handle_client: Routing path '{path}'...")
-
-            # --- Ensure Templates Loaded for File Serving ---
-            needs_files = path in ['/', '/style.css', '/app.js']
-            if needs_files and not self.templates_loaded:
-                 DPRINT(f"Ctrl.handle_client: Templates needed for '{path}', loading...")
-                 if not self.load_templates():
-                      DPRINT("Ctrl.handle_client: Template load FAILED.")
-                      response_code = 500
-                      response_headers["Content-Type"] = "text/plain"
-                      response_body_bytes = b"Server Error: Could not load template files."
-                 else:
-                      DPRINT(f"Ctrl.handle_client: Templates loaded OK.")
-
-            # --- Route Request (only if templates loaded ok or not needed) ---
-            if response_code == 200: # Check if error occurred during template load
-                DPRINT(f"Ctrl.handle_client: Processing route '{path}'...")
-                if path == '/':
-                    DPRINT("Ctrl.handle_client: Route matched '/'. Generating webpage...")
-                    response_headers["Content-Type"] = "text/html"
-                    response_headers["Cache-Control"] = "no-store"
-                    html_content = self.webpage() # Generate from template
-                    if html_content: 
-                        response_body_bytes = html_content.encode('utf-8')
-                        DPRINT(f"Ctrl.handle_client: HTML generated ({len(response_body_bytes)} bytes).")
-                    else: 
-                        DPRINT("Ctrl.handle_client: webpage() returned empty.")
-                        response_code = 500
-                        response_body_bytes = b"Template Error"
-
-                elif path == '/style.css':
-                     DPRINT("Ctrl.handle_client: Route matched '/style.css'.")
-                     response_headers["Content-Type"] = "text/css"
-                     response_headers["Cache-Control"] = "no-store"
-                     if self.css_content: 
-                         response_body_bytes = self.css_content.encode('utf-8')
-                         DPRINT(f"Ctrl.handle_client: Serving CSS ({len(response_body_bytes)} bytes).")
-                     else: 
-                         DPRINT("Ctrl.handle_client: CSS content is missing.")
-                         response_code = 404
-                         response_body_bytes = b"/* CSS not found */"
-
-                elif path == '/app.js':
-                     DPRINT("Ctrl.handle_client: Route matched '/app.js'.")
-                     response_headers["Content-Type"] = "application/javascript"
-                     response_headers["Cache-Control"] = "no-store"
-                     if self.js_content: 
-                         response_body_bytes = self.js_content.encode('utf-8')
-                         DPRINT(f"Ctrl.handle_client: Serving JS ({len(response_body_bytes)} bytes).")
-                     else: 
-                         DPRINT("Ctrl.handle_client: JS content is missing.")
-                         response_code = 404
-                         response_body_bytes = b"// JS not found"
-
-                elif path == '/favicon.ico':
-                     DPRINT("Ctrl.handle_client: Route matched '/favicon.ico'. Sending 404.")
-                     response_code = 404
-                     response_headers["Content-Type"] = "text/plain"
-
-                elif path == '/api/board_state':
-                    DPRINT("Ctrl.handle_client: Route matched '/api/board_state'.")
-                    response_headers["Content-Type"] = "application/json"
-                    state_obj = self.board.export_state_dict()
-                    state_obj['server_log'] = self.WEB_DISPLAY_CONTENT # Add server log
-                    DPRINT("Ctrl.handle_client: State exported. Serializing JSON...")
-                    try: 
-                        response_body_bytes = ujson.dumps(state_obj).encode('utf-8')
-                        DPRINT(f"Ctrl.handle_client: JSON state serialized ({len(response_body_bytes)} bytes).")
-                    except Exception as json_err: 
-                        DPRINT(f"JSON dump error: {json_err}")
-                        response_code=500
-                        response_body_bytes=b'{"status":"error","message":"JSON state error"}'
-
-                elif path == '/control/load_templates':
-                     DPRINT("Ctrl.handle_client: Route matched '/control/load_templates'.")
-                     response_headers["Content-Type"] = "application/json"
-                     success = self.load_templates()
-                     response_body_bytes = ujson.dumps({"status": "success" if success else "error", "message": "Templates loaded." if success else "Failed."}).encode('utf-8')
-
-                elif path == '/control/free_templates':
-                     DPRINT("Ctrl.handle_client: Route matched '/control/free_templates'.")
-                     response_headers["Content-Type"] = "application/json"
-                     success = self.free_templates()
-                     response_body_bytes = ujson.dumps({"status": "success" if success else "error", "message": "Templates freed." if success else "Failed."}).encode('utf-8')
-
-                elif path.startswith(('/pin/', '/pwm/', '/ble/', '/wifi/', '/console/')):
-                    DPRINT(f"Ctrl.handle_client: Route matched API '{path}'. Passing to handler...")
-                    response_headers["Content-Type"] = "application/json"
-                    result_obj = await self.handler.handle_request(path)
-                    DPRINT(f"Ctrl.handle_client: Handler returned. Serializing JSON...")
-                    try: 
-                        response_body_bytes = ujson.dumps(result_obj).encode('utf-8')
-                        DPRINT(f"Ctrl.handle_client: JSON result serialized ({len(response_body_bytes)} bytes).")
-                    except Exception as json_err: 
-                        DPRINT(f"JSON dump error (handler): {json_err}")
-                        response_code=500
-                        response_body_bytes=b'{"status":"error","message":"JSON result error"}'
-
-                else: # Unknown path
-                     DPRINT(f"Ctrl.handle_client: Unknown path '{path}', sending 404.")
-                     response_code = 404
-                     response_headers["Content-Type"] = "text/plain"
-                     response_body_bytes = b"Not Found"
-            
+            # --- Keep-alive decision (HTTP/1.1 default on, HTTP/1.0 only on request) ---
+            if request.http11:
+                keep_alive = not request.conn_close
+            else:
+                keep_alive = request.conn_keep_alive
+            if request_index + 1 >= self.KEEPALIVE_MAX_REQUESTS:
+                keep_alive = False # Per-connection request cap reached
+
+            # --- ROUTING (table lookup, sync/async decided at registration) ---
+            if keep_alive:
+                response_headers = {"Connection": "keep-alive", "Keep-Alive": self.KEEPALIVE_HEADER}
+            else:
+                response_headers = {"Connection": "close"}
+            ex = Http_exchange(method, full_path, path, keep_alive, response_headers, request.if_none_match, request.accept_encoding, request.body)
+            route = self.router.match(path)
+            if route is None:
+                _log.info("Ctrl.handle_client: Unknown path '%s', sending 404.", path)
+                ex.error(404, b"Not Found")
+                route_slot = self._unrouted_slot
             else:
-                 DPRINT(f"Ctrl.handle_client: Skipping routing due to earlier error (Code {response_code}).")
+                handler, is_async, route_slot = route
+                __debug__ and _log.debug("Ctrl.handle_client: Routing '%s' to %s...", path, handler.__name__)
+                if is_async: await handler(ex)
+                else: handler(ex)
 
             # --- Send Response ---
-            DPRINT(f"Ctrl.handle_client: Sending Status {response_code}...")
-            writer.write(f"HTTP/1.1 {response_code} OK\r\n".encode('utf-8')) # Simplified status
-            
-            DPRINT("Ctrl.handle_client: Sending Headers...")
-            for key, value in response_headers.items(): 
-                writer.write(f"{key}: {value}\r\n".encode('utf-8'))
-            writer.write(f"Content-Length: {len(response_body_bytes)}\r\n\r\n".encode('utf-8')) # Blank line needed
+            keep_alive = ex.keep_alive
+            response_code = ex.code
+            response_body_bytes = ex.body
+            __debug__ and _log.debug("Ctrl.handle_client: Sending Status %s and headers...", response_code)
+            head = [f"HTTP/1.1 {response_code} {self.STATUS_REASONS.get(response_code, 'OK')}\r\n".encode('utf-8')]
+            for key, value in ex.headers.items(): 
+                head.append(f"{key}: {value}\r\n".encode('utf-8'))
+            streamed = ex.page_values is not None or ex.state_since is not None or ex.body_stream is not None
+            if streamed and keep_alive:
+                head.append(b"Transfer-Encoding: chunked\r\n\r\n") # Streamed body framed by chunks
+            elif streamed or ex.event_stream is not None or response_code == 304:
+                head.append(b"\r\n") # No Content-Length: streamed body ends when connection closes, 304 has no body
+            else:
+                head.append(f"Content-Length: {len(response_body_bytes)}\r\n\r\n".encode('utf-8')) # Blank line needed
+            if response_body_bytes and len(response_body_bytes) <= self.SMALL_BODY_BYTES:
+                # Small bodies go out in the same segment as the headers (avoids Nagle/delayed-ACK stalls on keep-alive)
+                head.append(bytes(response_body_bytes) if isinstance(response_body_bytes, memoryview) else response_body_bytes) # join() takes bytes only
+                response_body_bytes = b''
+            writer.write(b"".join(head))
+            head = None
             
-            DPRINT("Ctrl.handle_client: Draining headers...")
+            __debug__ and _log.debug("Ctrl.handle_client: Draining headers...")
             await writer.drain() # Ensure headers sent
-            DPRINT("Ctrl.handle_client: Headers drained.")
-
-            if response_body_bytes:
-                DPRINT(f"Ctrl.handle_client: Sending body ({len(response_body_bytes)} bytes)...")
+            response_sent = True # Headers are out, a 500 can no longer be sent
+            __debug__ and _log.debug("Ctrl.handle_client: Headers drained.")
+
+            if ex.page_values is not None:
+                __debug__ and _log.debug("Ctrl.handle_client: Streaming page from template...")
+                if keep_alive:
+                    chunked = Chunked_writer(writer)
+                    await self.template.render(chunked, ex.page_values)
+                    await chunked.finish()
+                else:
+                    await self.template.render(writer, ex.page_values)
+                __debug__ and _log.debug("Ctrl.handle_client: Page streamed.")
+            elif ex.state_since is not None:
+                __debug__ and _log.debug("Ctrl.handle_client: Streaming board state JSON...")
+                since = ex.state_since
+                out = Chunked_writer(writer) if keep_alive else writer
+                await self.state_json.write(Json_stream(out), since, self.console.seq)
+                if keep_alive: await out.finish()
+                __debug__ and _log.debug("Ctrl.handle_client: Board state streamed.")
+            elif ex.body_stream is not None:
+                out = Chunked_writer(writer) if keep_alive else writer
+                await ex.body_stream(Json_stream(out)) # Json_stream used as a plain buffered writer here
+                if keep_alive: await out.finish()
+            elif ex.event_stream is not None:
+                self.admission.release() # Long-lived stream, mostly idle: don't hold a slot
+                has_slot = False
+                await ex.event_stream.run(writer) # Returns only via OSError when the client disconnects
+            elif response_body_bytes:
+                __debug__ and _log.debug("Ctrl.handle_client: Sending body (%s bytes)...", len(response_body_bytes))
                 await writer.awrite(response_body_bytes)
-                DPRINT("Ctrl.handle_client: Draining body...")
+                __debug__ and _log.debug("Ctrl.handle_client: Draining body...")
                 await writer.drain()
-                DPRINT("Ctrl.handle_client: Body drained.")
+                __debug__ and _log.debug("Ctrl.handle_client: Body drained.")
             else:
-                DPRINT("Ctrl.handle_client: No body to send.")
+                __debug__ and _log.debug("Ctrl.handle_client: No body to send (or sent with headers).")
                 
-            response_sent = True
-            DPRINT(f"Ctrl.handle_client: Response {response_code} sent complete.")
+            __debug__ and _log.debug("Ctrl.handle_client: Response %s sent complete.", response_code)
+            self._count_response(response_code)
+            if route_slot is not None: self.metrics.observe(route_slot, utime.ticks_diff(utime.ticks_us(), t0))
+            return keep_alive
 
         except uasyncio.CancelledError: 
-            DPRINT("Ctrl.handle_client: Task cancelled.")
             raise
-        except OSError as e: 
-            DPRINT(f"Ctrl.handle_client: OS Error: {e} (Client likely disconnected)")
+        except OSError: 
+            raise # Client likely disconnected, handled by handle_client
+        except MemoryError:
+            _log.error("Ctrl.handle_client: MemoryError while answering, shedding with 503.")
+            ex = None
+            self.metrics.collect()
+            if not response_sent:
+                try:
+                    writer.write(self.BUSY_RESPONSE)
+                    await writer.drain()
+                except OSError: pass
+            return False
         except Exception as e:
-            DPRINT(f"Ctrl.handle_client: Unexpected Exception: {e}")
+            _log.error("Ctrl.handle_client: Unexpected Exception: %s", e)
             sys.print_exception(e)
             if not response_sent and writer and not writer.is_closing():
                 try: # Send 500
-                    DPRINT("Ctrl.handle_client: Attempting to send 500 error to client...")
+                    __debug__ and _log.debug("Ctrl.handle_client: Attempting to send 500 error to client...")
                     err_bytes = ujson.dumps({"status": "error", "message": f"Server Error: {e}"}).encode('utf-8')
                     writer.write(b"HTTP/1.1 500 ISE\r\nContent-Type: application/json\r\nConnection: close\r\n")
                     writer.write(f"Content-Length: {len(err_bytes)}\r\n\r\n".encode('utf-8'))
                     await writer.drain()
                     await writer.awrite(err_bytes)
                     await writer.drain()
-                    DPRINT("Ctrl.handle_client: 500 error sent.")
+                    __debug__ and _log.debug("Ctrl.handle_client: 500 error sent.")
                 except Exception as send_err: 
-                    DPRINT(f"Ctrl.handle_client: Error sending 500: {send_err}")
+                    _log.error("Ctrl.handle_client: Error sending 500: %s", send_err)
+            return False
         finally:
-            DPRINT("Ctrl.handle_client: FINALLY block. Closing connection.")
-            if writer: 
-                writer.close()
-                await writer.wait_closed()
-            DPRINT("Ctrl.handle_client: Connection fully closed.")
+            if has_slot: self.admission.release()
+
+    # --- Routes (registered once in _build_router; each fills in an Http_exchange) ---
+    def _build_router(self):
+        router = Http_router()
+        slot = self._route_slot # Each route's tag is its latency histogram slot
+        router.add('/', self._route_page, tag=slot('/'))
+        router.add('/style.css', self._route_asset, tag=slot('/style.css'))
+        router.add('/app.js', self._route_asset, tag=slot('/app.js'))
+        router.add('/favicon.ico', self._route_favicon, tag=slot('/favicon.ico'))
+        router.add('/api/board_state', self._route_board_state, tag=slot('/api/board_state'))
+        router.add('/api/board_state.bin', self._route_board_state_bin, tag=slot('/api/board_state.bin'))
+        router.add('/api/events', self._route_events, tag=None) # Lasts until the client leaves, not a latency
+        router.add('/api/log', self._route_log, tag=slot('/api/log'))
+        router.add('/api/metrics', self._route_metrics, tag=slot('/api/metrics'))
+        router.add('/api/debug_log', self._route_debug_log, tag=slot('/api/debug_log'))
+        router.add('/control/load_templates', self._route_load_templates, tag=slot('/control/load_templates'))
+        router.add('/control/free_templates', self._route_free_templates, tag=slot('/control/free_templates'))
+        router.add('/api/rules', self._route_rules, tag=slot('/api/rules'))
+        router.add('/api/history', self._route_history_info, tag=slot('/api/history'))
+        router.add_prefix('/api/history/', self._route_history, False, slot('/api/history/'))
+        router.add('/pin/batch', self._route_pin_batch, tag=slot('/pin/batch')) # Exact match wins over the '/pin/' prefix
+        for prefix in ('/pin/', '/pwm/', '/ble/', '/wifi/', '/console/'):
+            router.add_prefix(prefix, self._route_action, True, slot(prefix))
+        self._unrouted_slot = slot('unmatched')
+        return router
+
+    # --- Metrics ---
+    def _route_slot(self, route):
+        return self.metrics.histogram(b'pico_http_request_duration_seconds', b'Time from parsed request to response sent', b'route="%s"' % route.encode())
+
+    def _register_metrics(self):
+        """ Response code counters and server/admission gauges (route histograms are registered by _build_router). """
+        m = self.metrics
+        self._code_slots = {}
+        for code in self.STATUS_REASONS:
+            self._code_slots[code] = m.counter(b'pico_http_responses_total', b'Responses sent by status code', b'code="%d"' % code)
+        adm = self.admission
+        m.gauge(b'pico_http_connections', b'Open client connections', lambda: adm.connections)
+        m.gauge(b'pico_http_requests_active', b'Requests holding a server slot', lambda: adm.active)
+        m.gauge(b'pico_http_requests_waiting', b'Requests queued for a server slot', adm.waiting)
+        m.gauge(b'pico_http_connections_refused_total', b'Connections refused at MAX_CONNECTIONS', lambda: adm.refused_connections, kind=b'counter')
+        m.gauge(b'pico_http_requests_refused_total', b'Requests refused with a full or timed out wait queue', lambda: adm.refused_requests, kind=b'counter')
+        m.gauge(b'pico_http_requests_over_rate_total', b'Requests over CLIENT_RATE_PER_S, queued behind other clients', lambda: adm.over_rate, kind=b'counter')
+        m.gauge(b'pico_http_requests_queued_total', b'Requests that had to wait for a slot', lambda: adm.queued, kind=b'counter')
+        m.gauges(b'pico_http_client_requests_total', b'Requests per tracked client IP (client="other": clients the table had no room for)', lambda: self._client_series(2), kind=b'counter')
+        m.gauges(b'pico_http_client_over_rate_total', b'Requests over CLIENT_RATE_PER_S per tracked client IP', lambda: self._client_series(3), kind=b'counter')
+        wifi = self.wifi
+        m.gauge(b'pico_wifi_up', b'1 while Wi-Fi holds an IP address', lambda: 1 if wifi.state == WIFI_UP else 0)
+        m.gauge(b'pico_wifi_connects_total', b'Successful Wi-Fi joins', lambda: wifi.connects, kind=b'counter')
+        m.gauge(b'pico_wifi_drops_total', b'Wi-Fi links lost after being up', lambda: wifi.drops, kind=b'counter')
+        m.gauge(b'pico_wifi_failures_total', b'Wi-Fi join attempts that failed or timed out', lambda: wifi.failures, kind=b'counter')
+
+    def _client_series(self, field):
+        """ (labels, value) per client tracked by admission control: field 2 requests, 3 requests over rate. """
+        series = []
+        for key, entry in self.admission.clients():
+            ip = key if isinstance(key, str) else "%d.%d.%d.%d" % tuple(key) # Raw IPv4 bytes on the unix port
+            series.append((b'client="%s"' % ip.encode(), entry[field]))
+        return series
+
+    def _count_response(self, code):
+        slot = self._code_slots.get(code)
+        if slot is not None: self.metrics.inc(slot)
+
+    def _route_metrics(self, ex):
+        """ GET /api/metrics: Prometheus text format, streamed from the preallocated metric arrays. """
+        ex.headers["Content-Type"] = "text/plain; version=0.0.4"
+        ex.headers["Cache-Control"] = "no-store"
+        ex.body_stream = self.metrics.write
+
+    def _route_log(self, ex):
+        """ GET /api/log?since=N: web console lines after sequence number N, as 'seq text' lines (all held lines if N is from a previous boot). """
+        since = self._query_int(ex.full_path, 'since', 0)
+        if since > self.console.seq: since = 0
+        ex.headers["Content-Type"] = "text/plain; charset=utf-8"
+        ex.headers["Cache-Control"] = "no-store"
+        ex.body_stream = lambda out: self.console.write_text(out, since, False)
+
+    def _route_debug_log(self, ex):
+        """ GET /api/debug_log?since=N: log ring records after sequence number N, one text line each. """
+        since = self._query_int(ex.full_path, 'since', 0)
+        ex.headers["Content-Type"] = "text/plain; charset=utf-8"
+        ex.headers["Cache-Control"] = "no-store"
+        ex.body_stream = lambda out: log.ring.write_text(out, since)
+
+    def _route_history_info(self, ex):
+        """ GET /api/history: recorded channels, resolutions and each ring's seq range. """
+        ex.headers["Content-Type"] = "application/json"
+        ex.headers["Cache-Control"] = "no-store"
+        history = self.board.history
+        ex.body = ujson.dumps(history.info_dict() if history else {"channels": {}}).encode('utf-8')
+
+    def _route_history(self, ex):
+        """
+        GET /api/history/<channel>?res=raw|1s|1m&from=<seq>&format=csv|bin:
+        entries from seq 'from' on (all held by default, or if 'from' is from a
+        previous boot), streamed as CSV in units or packed binary (history.BIN_HEADER).
+        """
+        history = self.board.history
+        ch = history.channels.get(ex.path[len('/api/history/'):]) if history else None
+        res_name = self._query_str(ex.full_path, 'res', 'raw')
+        fmt = self._query_str(ex.full_path, 'format', 'csv')
+        if ch is None or res_name not in RES_NAMES or fmt not in ('csv', 'bin'):
+            ex.error(404, b"Unknown history channel, res (raw, 1s, 1m) or format (csv, bin).")
+            return
+        res = RES_NAMES.index(res_name)
+        start = self._query_int(ex.full_path, 'from', 0)
+        ex.headers["Cache-Control"] = "no-store"
+        if fmt == 'bin':
+            ex.headers["Content-Type"] = "application/octet-stream"
+            ex.body_stream = lambda out: history.write_bin(out, ch, res, start)
+        else:
+            ex.headers["Content-Type"] = "text/csv"
+            ex.body_stream = lambda out: history.write_csv(out, ch, res, start)
+
+    def _ensure_templates(self, ex):
+        """ Loads templates on demand for file routes. Sets a 500 and returns False on failure. """
+        if self.templates_loaded: return True
+        __debug__ and _log.debug("Ctrl.handle_client: Templates needed for '%s', loading...", ex.path)
+        if self.load_templates():
+            __debug__ and _log.debug("Ctrl.handle_client: Templates loaded OK.")
+            return True
+        _log.error("Ctrl.handle_client: Template load FAILED.")
+        ex.error(500, b"Server Error: Could not load template files.")
+        return False
+
+    def _route_page(self, ex):
+        if not self._ensure_templates(ex): return
+        __debug__ and _log.debug("Ctrl.handle_client: Route matched '/'. Generating webpage...")
+        ex.headers["Content-Type"] = "text/html"
+        ex.headers["Cache-Control"] = "no-store"
+        try:
+            ex.page_values = self.webpage_values() # Body is streamed from the template
+            __debug__ and _log.debug("Ctrl.handle_client: Page values ready, body will be streamed.")
+        except Exception as e:
+            _log.error("Ctrl.handle_client: ERROR getting board state: %s", e)
+            sys.print_exception(e)
+            ex.code = 500
+            ex.body = self.ERROR_PAGE_STATE
+
+    def _route_asset(self, ex):
+        if not self._ensure_templates(ex): return
+        path = ex.path
+        __debug__ and _log.debug("Ctrl.handle_client: Route matched asset '%s'.", path)
+        asset = self.assets.get(path) if self.assets else None
+        if not asset:
+            _log.warning("Ctrl.handle_client: Asset '%s' is missing.", path)
+            ex.error(404, b"Asset not found")
+            return
+        body, etag, encoding = asset.select(ex.accept_encoding)
+        headers = ex.headers
+        headers["Content-Type"] = asset.content_type
+        headers["Cache-Control"] = "no-cache" # Always revalidate, 304 is cheap
+        headers["ETag"] = etag
+        headers["Vary"] = "Accept-Encoding"
+        if Static_asset.etag_matches(ex.if_none_match, etag):
+            __debug__ and _log.debug("Ctrl.handle_client: ETag %s matches, sending 304.", etag)
+            ex.code = 304
+        else:
+            if encoding: headers["Content-Encoding"] = encoding
+            ex.body = body # Immutable bytes, no per-request encode
+            __debug__ and _log.debug("Ctrl.handle_client: Serving %s (%s bytes, encoding=%s).", path, len(body), encoding)
+
+    def _route_favicon(self, ex):
+        __debug__ and _log.debug("Ctrl.handle_client: Route matched '/favicon.ico'. Sending 404.")
+        ex.error(404, b'')
+
+    def _route_board_state(self, ex):
+        __debug__ and _log.debug("Ctrl.handle_client: Route matched '/api/board_state'.")
+        ex.headers["Content-Type"] = "application/json"
+        ex.headers["Cache-Control"] = "no-store"
+        since = self._query_int(ex.full_path, 'since', 0)
+        epoch = self._query_int(ex.full_path, 'epoch', None)
+        if not (0 < since <= self.board.state_rev and epoch in (None, self.board.state_epoch)):
+            since = 0 # First poll, or 'since' is from a previous boot: send everything
+        ex.state_since = since # Body is streamed from the board model
+        __debug__ and _log.debug("Ctrl.handle_client: State since rev %s will be streamed.", since)
+
+    def _route_board_state_bin(self, ex):
+        """ GET /api/board_state.bin?since=&epoch=: same selection as /api/board_state, as a state_bin frame. """
+        ex.headers["Content-Type"] = "application/octet-stream"
+        ex.headers["Cache-Control"] = "no-store"
+        epoch = self._query_int(ex.full_path, 'epoch', self.board.state_epoch)
+        since = self.state_bin.since_for(epoch, self._query_int(ex.full_path, 'since', 0))
+        ex.body_stream = lambda out: self.state_bin.write(out, since) # Packed right before it is written
+
+    def _route_events(self, ex):
+        __debug__ and _log.debug("Ctrl.handle_client: Route matched '/api/events'. Starting event stream...")
+        lo, hi = self.EVENTS_MIN_INTERVAL_LIMITS
+        min_interval_ms = self._query_int(ex.full_path, 'min_interval_ms', self.EVENTS_MIN_INTERVAL_MS)
+        ex.event_stream = Board_event_stream(self, max(lo, min(hi, min_interval_ms)))
+        ex.keep_alive = False # Stream ends only when the connection closes
+        ex.headers = {"Connection": "close", "Content-Type": "text/event-stream", "Cache-Control": "no-store"}
+
+    def _route_load_templates(self, ex):
+        __debug__ and _log.debug("Ctrl.handle_client: Route matched '/control/load_templates'.")
+        ex.headers["Content-Type"] = "application/json"
+        success = self.load_templates()
+        ex.body = ujson.dumps({"status": "success" if success else "error", "message": "Templates loaded." if success else "Failed."}).encode('utf-8')
+
+    def _route_free_templates(self, ex):
+        __debug__ and _log.debug("Ctrl.handle_client: Route matched '/control/free_templates'.")
+        ex.headers["Content-Type"] = "application/json"
+        success = self.free_templates()
+        ex.body = ujson.dumps({"status": "success" if success else "error", "message": "Templates freed." if success else "Failed."}).encode('utf-8')
+
+    def _route_pin_batch(self, ex):
+        """ POST /pin/batch: JSON list of pin ops, validated here and applied by the worker under one lock. """
+        __debug__ and _log.debug("Ctrl.handle_client: Route matched '/pin/batch' (%s byte body).", len(ex.request_body))
+        ex.headers["Content-Type"] = "application/json"
+        if ex.method != "POST":
+            ex.headers["Allow"] = "POST"
+            ex.error(405, b'{"status":"error","message":"Use POST with a JSON list of operations"}', "application/json")
+            return
+        actions, error = self.handler.parse_pin_batch(ex.request_body)
+        if error:
+            ex.error(400, ujson.dumps({"status": "error", "message": error}).encode('utf-8'), "application/json")
+            return
+        success, message = self.board.queue_pin_batch(actions)
+        if not success: ex.code = 503
+        ex.body = ujson.dumps({"status": "success" if success else "error", "message": message, "count": len(actions)}).encode('utf-8')
+
+    def _route_rules(self, ex):
+        """ GET /api/rules: loaded rules and hit counters. POST /api/rules: replace them (JSON, see Rule_engine; {"rules": []} clears). """
+        ex.headers["Content-Type"] = "application/json"
+        ex.headers["Cache-Control"] = "no-store"
+        rules = self.board.rules
+        if not rules:
+            ex.error(503, b'{"status":"error","message":"Rule engine unavailable"}', "application/json")
+            return
+        if ex.method == "POST":
+            __debug__ and _log.debug("Ctrl.handle_client: Rules upload (%s bytes).", len(ex.request_body))
+            try: spec = ujson.loads(ex.request_body)
+            except ValueError: spec = None
+            error = rules.load(spec, self.handler.parse_pin_ops) if spec is not None else "Body is not valid JSON"
+            if error:
+                ex.error(400, ujson.dumps({"status": "error", "message": error}).encode('utf-8'), "application/json")
+                return
+            rules.save(ex.request_body)
+            self.html_out(f"{len(rules.names)} rule(s) loaded at {rules.rate_hz} Hz.", 'system')
+        elif ex.method != "GET":
+            ex.headers["Allow"] = "GET, POST"
+            ex.error(405, b'{"status":"error","message":"Use GET, or POST a JSON rule set"}', "application/json")
+            return
+        ex.body = ujson.dumps(rules.status_dict()).encode('utf-8')
+
+    async def _route_action(self, ex):
+        __debug__ and _log.debug("Ctrl.handle_client: Route matched API '%s'. Passing to handler...", ex.path)
+        ex.headers["Content-Type"] = "application/json"
+        result_obj = await self.handler.handle_request(ex.path)
+        self.board.notify_state_changed() # BLE/Wi-Fi/console changes (pin actions notify when applied)
+        __debug__ and _log.debug("Ctrl.handle_client: Handler returned. Serializing JSON...")
+        try: 
+            ex.body = ujson.dumps(result_obj).encode('utf-8')
+            __debug__ and _log.debug("Ctrl.handle_client: JSON result serialized (%s bytes).", len(ex.body))
+        except Exception as json_err: 
+            _log.error("JSON dump error (handler): %s", json_err)
+            ex.code = 500
+            ex.body = b'{"status":"error","message":"JSON result error"}'
 
     # --- Background Task ---
-    async def background_update_task(self, interval_ms=59000):
-        DPRINT("Ctrl.background_task: Starting background input scanner...")
+    async def background_update_task(self, interval_ms=None):
+        if interval_ms is None:
+            interval_ms = self.INPUT_RESYNC_MS if getattr(self.board, 'edge_ring', None) else self.INPUT_SCAN_MS
+        __debug__ and _log.debug("Ctrl.background_task: Starting background input scanner (%s ms)...", interval_ms)
         while True:
             try:
                 if hasattr(self.board, 'update_inputs') and callable(self.board.update_inputs): 
                     # DPRINT("Ctrl.background_task: Calling board.update_inputs()...") # Too noisy
                     await self.board.update_inputs()
                 else: 
-                    DPRINT("Ctrl.background_task: board.update_inputs missing.")
+                    _log.warning("Ctrl.background_task: board.update_inputs missing.")
                     await uasyncio.sleep_ms(interval_ms * 5) # Sleep longer if method missing
             except Exception as e: 
-                DPRINT(f"Ctrl.background_task: Error: {e}")
+                _log.error("Ctrl.background_task: Error: %s", e)
                 sys.print_exception(e)
             await uasyncio.sleep_ms(interval_ms)
 
 
     # --- Main Server Entry Point (Async) ---
     async def serve_async(self):
-        if not self.ip or self.ip == "0.0.0.0": 
-            DPRINT("Ctrl.serve_async: No valid IP. Server NOT started.")
-            return
-        DPRINT(f"Ctrl.serve_async: Starting async server on {self.ip}:80")
+        __debug__ and _log.debug("Ctrl.serve_async: Waiting for an IP address...")
+        await self.wifi.up.wait() # Returns at once if already connected
+        __debug__ and _log.debug("Ctrl.serve_async: Starting async server on port %s (IP %s)", self.HTTP_PORT, self.ip)
         try:
-            server = await uasyncio.start_server(self.handle_client, self.ip, 80, backlog=2)
-            DPRINT("Ctrl.serve_async: Server started and listening.")
+            # Bound to all addresses: keeps serving if a reconnect brings a new DHCP address
+            server = await uasyncio.start_server(self.handle_client, "0.0.0.0", self.HTTP_PORT, backlog=2)
+            __debug__ and _log.debug("Ctrl.serve_async: Server started and listening.")
             self.html_out(f"Async Server LIVE at http://{self.ip}/")
+            if self.STATE_BIN_PORT:
+                await uasyncio.start_server(self.state_bin.serve_client, "0.0.0.0", self.STATE_BIN_PORT, backlog=1)
+                __debug__ and _log.debug("Ctrl.serve_async: Binary state port %s listening.", self.STATE_BIN_PORT)
             print(f"--- ASYNC SERVER RUNNING at http://{self.ip}/ ---")
             while True:
                 await uasyncio.sleep(60) # Keep alive loop
         except OSError as e:
-            DPRINT(f"Ctrl.serve_async: FATAL BIND/START ERROR: {e}")
+            _log.error("Ctrl.serve_async: FATAL BIND/START ERROR: %s", e)
             if e.args[0] == 98: # EADDRINUSE
-                print("FATAL: Port 80 busy. Rebooting...")
-                self.html_out("FATAL: Port 80 busy. Rebooting...", 'error')
+                print(f"FATAL: Port {self.HTTP_PORT} busy. Rebooting...")
+                self.html_out(f"FATAL: Port {self.HTTP_PORT} busy. Rebooting...", 'error')
                 time.sleep(1)
                 machine.reset()
             else: 
@@ -607,7 +926,7 @@ class Html_controler:
                 while True: 
                     machine.idle() 
         except Exception as e:
-             DPRINT(f"Ctrl.serve_async: UNEXPECTED SERVER ERROR: {e}")
+             _log.error("Ctrl.serve_async: UNEXPECTED SERVER ERROR: %s", e)
              sys.print_exception(e)
              self.html_out(f"FATAL: Server loop error: {e}. Resetting.", 'error')
              print("Forcing reset...")
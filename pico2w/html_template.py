@@ -0,0 +1,76 @@
+# html_template.py
+import log
+
+_log = log.Logger("html_template")
+
+class Html_template:
+    """
+    HTML template compiled once into static byte slices and named slots.
+    Rendering streams each slice and slot value straight to a StreamWriter,
+    so the full page never exists in RAM as a single string.
+    """
+    TAG_START = b'<EXTDATA name="'
+    TAG_END = b'" />'
+
+    def __init__(self, source):
+        """
+        Compiles template source (bytes, or a memoryview of a ROMFS file)
+        into parts/slots. Raises ValueError on bad tags.
+        """
+        self._source = source # Keep source alive, parts are views into it
+        mv = memoryview(source)
+        if not isinstance(source, (bytes, bytearray)):
+            source = bytes(source) # find() needs bytes: scan a temporary copy, parts still view the original (flash)
+        self.parts = [] # memoryview slices of static content
+        self.slots = [] # For each gap between parts: index into self.names
+        self.names = [] # Unique <EXTDATA> names in first-seen order
+
+        start_index = 0
+        while True:
+            tag_index = source.find(self.TAG_START, start_index)
+            if tag_index == -1:
+                self.parts.append(mv[start_index:])
+                break
+            self.parts.append(mv[start_index:tag_index])
+            name_start = tag_index + len(self.TAG_START)
+            name_end = source.find(self.TAG_END, name_start)
+            if name_end == -1:
+                raise ValueError(f"Unclosed <EXTDATA> near index {name_start}")
+            var_name = source[name_start:name_end].strip().decode('utf-8')
+            if not var_name:
+                raise ValueError(f"Empty name in <EXTDATA> near index {name_start}")
+            if var_name not in self.names:
+                self.names.append(var_name)
+            self.slots.append(self.names.index(var_name))
+            start_index = name_end + len(self.TAG_END)
+        __debug__ and _log.debug("Template: Compiled %s parts, %s slots, %s names.", len(self.parts), len(self.slots), len(self.names))
+
+    def slot_index(self, name):
+        """ Returns the slot index for an <EXTDATA> name, or -1 if unused. """
+        try: return self.names.index(name)
+        except ValueError: return -1
+
+    async def render(self, writer, values):
+        """
+        Streams the template to writer. values is a sequence aligned with
+        self.names; each entry is bytes, str, None, or an async callable
+        taking the writer (for large fragments that stream themselves).
+        """
+        parts = self.parts
+        slots = self.slots
+        for i in range(len(slots)):
+            writer.write(parts[i])
+            await writer.drain()
+            value = values[slots[i]]
+            if value is None:
+                continue
+            if isinstance(value, bytes):
+                writer.write(value)
+            elif isinstance(value, str):
+                writer.write(value.encode('utf-8'))
+            else:
+                await value(writer) # Streams itself
+                continue
+            await writer.drain()
+        writer.write(parts[-1])
+        await writer.drain()
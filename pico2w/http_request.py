@@ -0,0 +1,208 @@
+# http_request.py
+import log
+
+_log = log.Logger("http_request")
+
+# Status returned by Http_request.read() besides HTTP error codes
+REQ_OK = 0
+REQ_CLOSED = 1 # Peer closed (or sent nothing) before a full request arrived
+
+def _eq_ci(buf, start, end, token):
+    """ True if buf[start:end] equals lowercase ASCII token, ignoring case. No allocation. """
+    n = len(token)
+    if end - start != n: return False
+    i = 0
+    while i < n: # while, not range(): no iterator object per call
+        if buf[start + i] | 0x20 != token[i]: return False
+        i += 1
+    return True
+
+def _has_ci(buf, start, end, token):
+    """ True if lowercase ASCII token occurs in buf[start:end], ignoring case. No allocation. """
+    n = len(token)
+    first = token[0]
+    i = start
+    while i <= end - n:
+        if buf[i] | 0x20 == first and _eq_ci(buf, i, i + n, token): return True
+        i += 1
+    return False
+
+def _q_zero(buf, start, end):
+    """ True if the parameters in buf[start:end] (';q=0', ';q=0.000'...) give a quality of 0. No allocation. """
+    i = start + 1
+    while i < end:
+        if buf[i] | 0x20 == 113 and buf[i - 1] in (59, 32, 9): # 'q' starting a parameter
+            j = i + 1
+            while j < end and buf[j] in (32, 9): j += 1
+            if j < end and buf[j] == 61: # '='
+                j += 1
+                while j < end and buf[j] in (32, 9): j += 1
+                zero = j < end
+                while j < end and buf[j] not in (59, 32, 9):
+                    if buf[j] not in (48, 46): zero = False # Any digit but '0' (or '.') makes it non-zero
+                    j += 1
+                return zero
+        i += 1
+    return False
+
+def _accepts_gzip(buf, start, end):
+    """
+    True if the Accept-Encoding value in buf[start:end] accepts gzip: listed
+    (or '*' with gzip not listed) without q=0. No allocation.
+    """
+    star = False
+    pos = start
+    while pos < end:
+        item_end = buf.find(b',', pos, end)
+        if item_end < 0: item_end = end
+        s = pos
+        while s < item_end and buf[s] in (32, 9): s += 1
+        params = buf.find(b';', s, item_end)
+        if params < 0: params = item_end
+        e = params
+        while e > s and buf[e - 1] in (32, 9): e -= 1
+        is_gzip = _eq_ci(buf, s, e, b'gzip') or _eq_ci(buf, s, e, b'x-gzip')
+        if is_gzip: return not _q_zero(buf, params, item_end)
+        if e - s == 1 and buf[s] == 42: star = not _q_zero(buf, params, item_end) # '*'
+        pos = item_end + 1
+    return star
+
+class Http_request:
+    """
+    Per-connection HTTP/1.x request reader. The head is read with readinto
+    into one preallocated buffer (HEAD_MAX bytes, also the hard limit on
+    request line + headers) and parsed in place: only the path and an
+    If-None-Match value become strings, other headers are matched or
+    skipped without copying. Bytes of a pipelined next request stay in
+    the buffer for the next read(). Call read() under one deadline
+    (uasyncio.wait_for_ms) covering head and body.
+    """
+    HEAD_MAX = 1024
+    METHODS = ((b'get', "GET"), (b'post', "POST"), (b'head', "HEAD"), (b'put', "PUT"), (b'delete', "DELETE"), (b'options', "OPTIONS"))
+
+    def __init__(self, reader, body_max=2048, head_max=HEAD_MAX):
+        self.reader = reader
+        self.body_max = body_max
+        self.buf = bytearray(head_max)
+        self.mv = memoryview(self.buf)
+        self.start = 0 # First unconsumed byte in buf
+        self.end = 0 # End of received bytes in buf
+        self._reset()
+
+    def _reset(self):
+        self.method = "GET"
+        self.full_path = "/"
+        self.path = "/"
+        self.http11 = False
+        self.content_length = 0
+        self.conn_close = False # Connection: close
+        self.conn_keep_alive = False # Connection: keep-alive
+        self.if_none_match = None
+        self.accept_encoding = None
+        self.body = b''
+
+    async def read(self):
+        """
+        Reads the next request. Returns REQ_OK (fields set), REQ_CLOSED, or
+        an HTTP error code (400, 413, 431) after which the connection
+        should be closed.
+        """
+        self._reset()
+        buf = self.buf
+        scan = self.start
+        while True:
+            while self.start < self.end and buf[self.start] in (13, 10): # Stray CRLF between requests
+                self.start += 1
+            head_end = buf.find(b'\r\n\r\n', max(scan, self.start), self.end)
+            if head_end >= 0: break
+            if self.start == self.end:
+                self.start = self.end = 0
+            elif self.end == len(buf):
+                if not self.start: return 431 # Head does not fit in the buffer
+                n = self.end - self.start
+                buf[:n] = self.mv[self.start:self.end] # Compact the partial head to the front
+                self.start, self.end = 0, n
+            scan = max(self.start, self.end - 3) # A terminator may straddle reads
+            n = await self.reader.readinto(self.mv[self.end:])
+            if n is None: continue
+            if not n: return REQ_CLOSED
+            self.end += n
+
+        status = self._parse_head(self.start, head_end)
+        self.start = head_end + 4
+        if status == REQ_OK and self.content_length:
+            status = await self._read_body()
+        if self.start == self.end:
+            self.start = self.end = 0
+        return status
+
+    async def _read_body(self):
+        n = self.content_length
+        body = bytearray(n)
+        have = min(n, self.end - self.start)
+        if have:
+            body[:have] = self.mv[self.start:self.start + have]
+            self.start += have
+        if have < n:
+            body_mv = memoryview(body)
+            while have < n:
+                got = await self.reader.readinto(body_mv[have:])
+                if got is None: continue
+                if not got: return REQ_CLOSED
+                have += got
+        self.body = body
+        return REQ_OK
+
+    def _parse_head(self, start, end):
+        """ Parses the request line and the headers used by the server from buf[start:end]. """
+        buf = self.buf
+        line_end = buf.find(b'\r\n', start, end)
+        if line_end < 0: line_end = end
+        sp1 = buf.find(b' ', start, line_end)
+        sp2 = buf.find(b' ', sp1 + 1, line_end) if sp1 > start else -1
+        if sp2 < 0:
+            __debug__ and _log.debug("Http_request: Malformed request line.")
+            return 400
+        self.method = None
+        for token, name in self.METHODS:
+            if _eq_ci(buf, start, sp1, token):
+                self.method = name
+                break
+        if self.method is None: self.method = buf[start:sp1].decode('utf-8', 'ignore').upper()
+        self.full_path = str(self.mv[sp1 + 1:sp2], 'utf-8')
+        query = self.full_path.find('?')
+        self.path = self.full_path[:query] if query >= 0 else self.full_path
+        self.http11 = _eq_ci(buf, sp2 + 1, line_end, b'http/1.1')
+
+        pos = line_end + 2
+        while pos < end:
+            eol = buf.find(b'\r\n', pos, end)
+            if eol < 0: eol = end
+            colon = buf.find(b':', pos, eol)
+            if colon > pos:
+                vs = colon + 1
+                while vs < eol and buf[vs] in (32, 9): vs += 1
+                ve = eol
+                while ve > vs and buf[ve - 1] in (32, 9): ve -= 1
+                name_len = colon - pos
+                if name_len == 14 and _eq_ci(buf, pos, colon, b'content-length'):
+                    if vs == ve: return 400
+                    length = 0
+                    while vs < ve:
+                        digit = buf[vs] - 48
+                        if not 0 <= digit <= 9: return 400
+                        length = length * 10 + digit
+                        if length > self.body_max:
+                            __debug__ and _log.debug("Http_request: Body over %s bytes.", self.body_max)
+                            return 413
+                        vs += 1
+                    self.content_length = length
+                elif name_len == 10 and _eq_ci(buf, pos, colon, b'connection'):
+                    self.conn_close = _has_ci(buf, vs, ve, b'close')
+                    self.conn_keep_alive = _has_ci(buf, vs, ve, b'keep-alive')
+                elif name_len == 13 and _eq_ci(buf, pos, colon, b'if-none-match'):
+                    self.if_none_match = str(self.mv[vs:ve], 'utf-8')
+                elif name_len == 15 and _eq_ci(buf, pos, colon, b'accept-encoding'):
+                    self.accept_encoding = "gzip" if _accepts_gzip(buf, vs, ve) else None # All Static_asset.select() looks for
+            pos = eol + 2
+        return REQ_OK
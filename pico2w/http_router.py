@@ -0,0 +1,62 @@
+# http_router.py
+
+class Http_exchange:
+    """
+    One request/response on a connection. Route handlers read the parsed
+    request fields and fill in the response fields; handle_client sends it.
+    """
+    def __init__(self, method, full_path, path, keep_alive, headers, if_none_match=None, accept_encoding=None, request_body=b''):
+        # Request
+        self.method = method
+        self.full_path = full_path
+        self.path = path
+        self.request_body = request_body
+        self.if_none_match = if_none_match
+        self.accept_encoding = accept_encoding
+        # Response
+        self.keep_alive = keep_alive
+        self.code = 200
+        self.headers = headers
+        self.body = b''
+        self.page_values = None # Set when the page body is streamed from the template
+        self.event_stream = None # Set for /api/events (body streamed until the client leaves)
+        self.state_since = None # Set for /api/board_state (JSON streamed from the board model)
+        self.body_stream = None # Set to an async fn(Json_stream) that writes the body (e.g. /api/metrics)
+
+    def error(self, code, body, content_type="text/plain"):
+        self.code = code
+        self.headers["Content-Type"] = content_type
+        self.body = body
+
+
+class Http_router:
+    """
+    Route table built once at startup. Exact paths and one or two segment
+    prefixes ('/pin/', '/api/history/') map to (handler, is_async, tag) entries, so dispatch
+    is a dict lookup with the sync/async decision already made. tag is
+    opaque to the router (the controller keeps the route's metrics slot there).
+    """
+    def __init__(self):
+        self.exact = {}
+        self.prefixes = {}
+
+    def add(self, path, handler, is_async=False, tag=None):
+        self.exact[path] = (handler, is_async, tag)
+
+    def add_prefix(self, prefix, handler, is_async=False, tag=None):
+        """ prefix must be one or two path segments with all slashes, e.g. '/pin/' or '/api/history/'. """
+        if not (prefix.startswith('/') and prefix.endswith('/') and 2 <= prefix.count('/') <= 3):
+            raise ValueError(f"Route prefix must look like '/name/' or '/name/name/': {prefix}")
+        self.prefixes[prefix] = (handler, is_async, tag)
+
+    def match(self, path):
+        """ Returns the (handler, is_async, tag) entry for path, or None. """
+        entry = self.exact.get(path)
+        if entry is None:
+            end = path.find('/', 1)
+            if end > 0:
+                entry = self.prefixes.get(path[:end + 1])
+                if entry is None:
+                    end = path.find('/', end + 1)
+                    if end > 0: entry = self.prefixes.get(path[:end + 1])
+        return entry
@@ -0,0 +1,49 @@
+# input_edges.py
+import array
+import utime
+import uasyncio
+from micropython import const
+
+EDGE_RING_SIZE = const(64) # Power of two (index wraps with a mask)
+
+class Input_edge_ring:
+    """
+    Preallocated ring of input transitions (ticks_us, pin id, level) filled
+    by Pin.irq edge handlers. Handlers only store into the arrays and set
+    a ThreadSafeFlag (no allocation, safe for hard IRQs); the board's edge
+    consumer task waits on that flag and drains the ring.
+    Single producer side (IRQs) writes head, single consumer writes tail.
+    """
+    def __init__(self, size=EDGE_RING_SIZE):
+        self.size = size
+        self.mask = size - 1
+        self.ticks = array.array('I', bytes(4 * size)) # ticks_us() at each edge
+        self.pins = bytearray(size)
+        self.levels = bytearray(size)
+        self.head = 0 # Next slot written by an IRQ
+        self.tail = 0 # Next slot read by the consumer
+        self.dropped = 0 # Edges lost because the ring was full (consumer resyncs by scanning)
+        self.flag = uasyncio.ThreadSafeFlag()
+
+    def handler(self, pin_id):
+        """ Returns the IRQ handler for pin_id (create once per pin, then reuse). """
+        ring = self
+        def on_edge(pin):
+            head = ring.head
+            nxt = (head + 1) & ring.mask
+            if nxt == ring.tail:
+                ring.dropped += 1
+            else:
+                ring.ticks[head] = utime.ticks_us()
+                ring.pins[head] = pin_id
+                ring.levels[head] = pin.value()
+                ring.head = nxt # Publish last, the slot is complete
+            ring.flag.set()
+        return on_edge
+
+    def pending(self):
+        return self.head != self.tail
+
+    def advance(self):
+        """ Consumer: Releases the oldest edge (slot tail) after it has been read. """
+        self.tail = (self.tail + 1) & self.mask
@@ -0,0 +1,137 @@
+# json_stream.py
+import log
+import io
+import ujson
+
+_log = log.Logger("json_stream")
+
+class Json_stream:
+    """
+    Buffered JSON output to a StreamWriter (or Chunked_writer).
+    Fragments are staged in a native io.BytesIO (so ujson.dump(obj, js.io)
+    serializes into it with no intermediate string and no Python calls),
+    then copied out through one small reusable buffer when about BUF_SIZE
+    bytes are pending. Callers write a field or entry at a time, then call
+    check() so staging never holds much more than one buffer.
+    """
+    BUF_SIZE = 256
+
+    def __init__(self, writer, buf_size=BUF_SIZE):
+        self.writer = writer
+        self.io = io.BytesIO(buf_size) # Staging; grows only if one entry exceeds buf_size
+        self.buf = bytearray(buf_size)
+        self.mv = memoryview(self.buf)
+        self.pending = False # Flushed since last drain
+        self.total = 0 # Bytes written so far
+
+    def write(self, b):
+        """ Sync: Appends bytes. """
+        self.io.write(b)
+        self.check()
+
+    def dump(self, obj):
+        """ Sync: Appends obj as JSON (small values; large lists should be written an item at a time). """
+        ujson.dump(obj, self.io)
+        self.check()
+
+    def check(self):
+        """ Sync: Flushes once BUF_SIZE bytes are staged. """
+        if self.io.tell() >= len(self.buf):
+            self.flush()
+
+    def flush(self):
+        """ Sync: Hands staged bytes to the writer (it copies them only if the socket is busy). """
+        n = self.io.tell()
+        if not n: return
+        self.total += n
+        self.io.seek(0)
+        while n > 0:
+            got = self.io.readinto(self.buf) # May read stale bytes past n, those are not sent
+            if got >= n:
+                self.writer.write(self.mv[:n] if n < len(self.buf) else self.buf)
+                break
+            self.writer.write(self.buf)
+            n -= got
+        self.io.seek(0) # Later writes overwrite; only bytes up to tell() are ever sent
+        self.pending = True
+
+    async def drain(self):
+        """ Waits for the writer only if something was flushed, keeping its queue to about one buffer. """
+        if self.pending:
+            self.pending = False
+            await self.writer.drain()
+
+    async def finish(self):
+        self.flush()
+        await self.drain()
+        __debug__ and _log.debug("Json_stream: Wrote %s bytes.", self.total)
+
+
+class Board_state_json:
+    """
+    Streams /api/board_state JSON by walking the board model directly
+    (no per-pin dicts). The static head of each pin entry (id, name) is
+    encoded once here; only mode/value/pull/controller/PWM are written
+    per request.
+    """
+    K_VALUE = b', "value": '
+    K_PULL = b', "pull": '
+    K_CONTROLLER = b', "controller": '
+    K_PWM_FREQ = b', "pwm_freq": '
+    K_PWM_DUTY = b', "pwm_duty": '
+    K_PWM_EFFECT = b', "pwm_effect": '
+    K_ADC = (b'"adc0": ', b'"adc1": ', b'"adc2": ')
+
+    def __init__(self, board):
+        self.board = board
+        self.pin_heads = [b'{"id": %d, "name": ' % pin._id + ujson.dumps(pin.name).encode('utf-8') + b', "mode": '
+                          for pin in board.all_gpio_pins]
+
+    async def write(self, js, since, log_seq):
+        """
+        Writes the state object to Json_stream js. since <= 0 writes every
+        pin and ADC channel (full=true), otherwise only those stamped after
+        revision 'since' (same shape as Pico_board.export_state_since).
+        """
+        board = self.board
+        board.sample_adc() # Stamp ADC first so 'rev' covers the values written
+        full = since <= 0
+        out = js.io # Native stream: constant keys and ujson.dump go straight in
+        put = out.write
+
+        put(b'{"rev": '); ujson.dump(board.state_rev, out)
+        put(b', "epoch": '); ujson.dump(board.state_epoch, out)
+        put(b', "full": true, "pins": [' if full else b', "full": false, "pins": [')
+        pin_revs = board.pin_revs
+        pin_heads = self.pin_heads
+        first = True
+        for i, pin in enumerate(board.all_gpio_pins):
+            if not full and pin_revs[pin._id] <= since: continue
+            if not first: put(b', ')
+            first = False
+            put(pin_heads[i]); ujson.dump(pin.mode, out)
+            put(self.K_VALUE); ujson.dump(pin.value, out)
+            put(self.K_PULL); ujson.dump(pin.pull_str, out)
+            put(self.K_CONTROLLER); ujson.dump(pin.controlled_by, out)
+            pwm = pin.pwm_instance
+            if pwm:
+                put(self.K_PWM_FREQ); ujson.dump(pwm.freq, out)
+                put(self.K_PWM_DUTY); ujson.dump(pwm.duty_percent, out)
+                if pwm.effect: put(self.K_PWM_EFFECT); ujson.dump(pwm.effect.kind, out)
+            put(b'}')
+            js.check()
+            if js.pending: await js.drain()
+
+        put(b'], "status": ')
+        ujson.dump(board.status_dict(), out)
+        put(b', "adc_volts": {')
+        first = True
+        for ch in range(3):
+            if not full and board.adc_revs[ch] <= since: continue
+            if not first: put(b', ')
+            first = False
+            put(self.K_ADC[ch])
+            ujson.dump(f"{board.adc.read_volts(ch):.3f}" if full else board.adc_stamped_volts(ch), out)
+        put(b'}, "log_seq": '); ujson.dump(log_seq, out) # Console lines themselves come from /api/log?since=
+        put(b'}')
+        await js.finish()
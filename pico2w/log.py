@@ -0,0 +1,122 @@
+# log.py
+"""
+Leveled logging for all pico2w modules (replaces the per-module DPRINT).
+
+Each module creates one Logger and writes debug records as
+    __debug__ and _log.debug("Pin %d -> %s", pin_id, value)
+MicroPython folds __debug__ at compile time, so with optimisation level 1
+or higher (micropython.opt_level(1) before the app is imported, as
+html_server.py does when config.DEBUG is False, or mpy-cross -O1) the
+whole statement, arguments included, is not compiled at all.
+info/warning/error records are always compiled and filtered by level.
+Formatting is %-style and only happens for records that pass the filter.
+
+Records go to a fixed binary ring (dumped with dump() on serial or at
+/api/debug_log) and are echoed to the console when LOG_ECHO is on.
+"""
+import config
+import struct
+import utime
+from micropython import const
+
+# Levels
+DEBUG = const(10)
+INFO = const(20)
+WARNING = const(30)
+ERROR = const(40)
+LEVEL_CHARS = {DEBUG: b'D', INFO: b'I', WARNING: b'W', ERROR: b'E'}
+
+# Fixed at import from config: default level, per-module levels (by Logger name), console echo
+LEVEL = getattr(config, 'LOG_LEVEL', DEBUG if config.DEBUG else WARNING)
+MODULE_LEVELS = getattr(config, 'LOG_LEVELS', {})
+ECHO = getattr(config, 'LOG_ECHO', config.DEBUG)
+
+RING_SLOTS = const(48)
+SLOT_BYTES = const(96)
+HEADER_FORMAT = "<IIBBH" # seq, ticks_ms, level, logger id, text length
+HEADER_BYTES = const(12)
+
+class Log_ring:
+    """
+    Preallocated ring of fixed-size binary records (header + text truncated
+    to the slot). Each record has a sequence number, so readers can ask
+    for records after the last one they saw.
+    """
+    def __init__(self, slots=RING_SLOTS, slot_bytes=SLOT_BYTES):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.buf = bytearray(slots * slot_bytes)
+        self.mv = memoryview(self.buf)
+        self.seq = 0 # Sequence number of the newest record (0 = none yet)
+
+    def append(self, level, logger_id, text):
+        """ Stores text (bytes or str) as the next record, returns its sequence number. """
+        if isinstance(text, str): text = text.encode('utf-8')
+        self.seq += 1
+        off = (self.seq % self.slots) * self.slot_bytes
+        n = len(text)
+        if n > self.slot_bytes - HEADER_BYTES:
+            n = self.slot_bytes - HEADER_BYTES
+            while n and text[n] & 0xC0 == 0x80: n -= 1 # Don't split a UTF-8 character
+        struct.pack_into(HEADER_FORMAT, self.buf, off, self.seq, utime.ticks_ms(), level, logger_id, n)
+        self.mv[off + HEADER_BYTES:off + HEADER_BYTES + n] = text[:n] if n < len(text) else text
+        return self.seq
+
+    def oldest(self):
+        """ Sequence number of the oldest record still held. """
+        return max(1, self.seq - self.slots + 1)
+
+    def record(self, seq):
+        """ Returns (ticks_ms, level, logger_id, memoryview of text) for a held sequence number. """
+        off = (seq % self.slots) * self.slot_bytes
+        _, ticks, level, logger_id, n = struct.unpack_from(HEADER_FORMAT, self.buf, off)
+        return ticks, level, logger_id, self.mv[off + HEADER_BYTES:off + HEADER_BYTES + n]
+
+    async def write_text(self, out, since=0, detail=True):
+        """
+        Writes records after 'since' as text lines to a Json_stream-like
+        writer: 'seq ticks_ms level logger: text', or 'seq text' without detail.
+        """
+        for seq in range(max(since + 1, self.oldest()), self.seq + 1):
+            ticks, level, logger_id, text = self.record(seq)
+            if detail: out.write(b'%d %d %s %s: ' % (seq, ticks, LEVEL_CHARS.get(level, b'?'), _names[logger_id]))
+            else: out.write(b'%d ' % seq)
+            out.write(text)
+            out.write(b'\n')
+            if out.pending: await out.drain()
+        await out.finish()
+
+ring = Log_ring()
+_names = [] # Logger id -> name (bytes)
+
+class Logger:
+    """ Per-module logger. The level comes from config.LOG_LEVELS[name], else LOG_LEVEL. """
+    def __init__(self, name):
+        self.name = name
+        self.id = len(_names)
+        _names.append(name.encode('utf-8'))
+        self.level = MODULE_LEVELS.get(name, LEVEL)
+
+    def _emit(self, level, fmt, args):
+        try: text = fmt % args if args else fmt
+        except (TypeError, ValueError): text = f"{fmt} {args}" # Bad format string, keep the data
+        ring.append(level, self.id, text)
+        if ECHO: print(text)
+
+    def debug(self, fmt, *args):
+        if self.level <= DEBUG: self._emit(DEBUG, fmt, args)
+
+    def info(self, fmt, *args):
+        if self.level <= INFO: self._emit(INFO, fmt, args)
+
+    def warning(self, fmt, *args):
+        if self.level <= WARNING: self._emit(WARNING, fmt, args)
+
+    def error(self, fmt, *args):
+        if self.level <= ERROR: self._emit(ERROR, fmt, args)
+
+def dump(since=0):
+    """ Prints held records after 'since' on the console (serial REPL). """
+    for seq in range(max(since + 1, ring.oldest()), ring.seq + 1):
+        ticks, level, logger_id, text = ring.record(seq)
+        print(seq, ticks, str(LEVEL_CHARS.get(level, b'?'), 'utf-8'), str(_names[logger_id], 'utf-8') + ":", str(text, 'utf-8'))
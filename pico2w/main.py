@@ -0,0 +1,7 @@
+# main.py
+# Starts the web server after boot.py has connected Wi-Fi. With a ROMFS
+# deploy (tools/build_romfs.py) html_server and the rest of the app are
+# imported from /rom; this file, boot.py and config.py stay on the
+# board's filesystem.
+import html_server
+html_server.run()
@@ -0,0 +1,153 @@
+# metrics.py
+import array
+import gc
+import utime
+import uasyncio
+from micropython import const
+
+MAX_HISTOGRAMS = const(48)
+MAX_COUNTERS = const(32)
+HEAP_PROBE_MS = const(30000) # Largest free block is re-measured this often (run_heap_probe)
+HEAP_PROBE_STEP = const(1024) # Resolution of that measurement (bytes)
+
+# Histogram bucket upper bounds in microseconds (+Inf is implicit), and their 'le' labels in seconds
+BUCKETS_US = (1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000, 500000, 1000000, 2000000)
+BUCKET_LABELS = tuple(b'%d.%03d' % (us // 1000000, us // 1000 % 1000) for us in BUCKETS_US) + (b'+Inf',)
+
+class Metrics:
+    """
+    Counters and fixed-bucket latency histograms kept in preallocated
+    arrays: observe()/inc() only index and add (no allocation, safe on
+    hot paths). Series are registered once at startup; gauges and
+    counters owned elsewhere (queue depth, shed connections...) are
+    registered as callbacks and read only when scraped.
+    write() streams everything in the Prometheus text format.
+    """
+    def __init__(self):
+        n = len(BUCKETS_US) + 1
+        self._buckets = n
+        self._hist_counts = array.array('I', bytes(4 * MAX_HISTOGRAMS * n)) # Per bucket (not cumulative)
+        self._hist_sum_s = array.array('I', bytes(4 * MAX_HISTOGRAMS)) # Sum split into s + us so it stays a small int
+        self._hist_sum_us = array.array('I', bytes(4 * MAX_HISTOGRAMS))
+        self._n_hist = 0
+        self._counters = array.array('I', bytes(4 * MAX_COUNTERS))
+        self._n_counters = 0
+        self._families = [] # [name, kind, help, [(labels, slot or callable), ...]] in registration order
+        self._largest_free = 0 # Last run_heap_probe() result
+        self.gc_pause = self.histogram(b'pico_gc_pause_seconds', b'Duration of gc.collect() calls made by the app')
+        self.gauge(b'pico_heap_free_bytes', b'gc.mem_free()', gc.mem_free)
+        self.gauge(b'pico_heap_alloc_bytes', b'gc.mem_alloc()', gc.mem_alloc)
+        self.gauge(b'pico_heap_largest_free_bytes', b'Largest allocatable block (1 KB resolution, re-probed every 30 s)', lambda: self._largest_free)
+        self.gauge(b'pico_uptime_seconds', b'Seconds since boot', lambda: utime.ticks_ms() // 1000)
+
+    # --- Registration (startup only) ---
+    def _series(self, name, kind, help_text, labels, ref):
+        for family in self._families:
+            if family[0] == name:
+                family[3].append((labels, ref))
+                return
+        self._families.append([name, kind, help_text, [(labels, ref)]])
+
+    def histogram(self, name, help_text, labels=b''):
+        """ Registers a latency histogram series (labels like b'route="/"'), returns its slot for observe(). """
+        if self._n_hist >= MAX_HISTOGRAMS: raise ValueError("Metrics: MAX_HISTOGRAMS reached")
+        slot = self._n_hist
+        self._n_hist += 1
+        self._series(name, b'histogram', help_text, labels, slot)
+        return slot
+
+    def counter(self, name, help_text, labels=b''):
+        """ Registers a counter series, returns its slot for inc(). """
+        if self._n_counters >= MAX_COUNTERS: raise ValueError("Metrics: MAX_COUNTERS reached")
+        slot = self._n_counters
+        self._n_counters += 1
+        self._series(name, b'counter', help_text, labels, slot)
+        return slot
+
+    def gauge(self, name, help_text, fn, labels=b'', kind=b'gauge'):
+        """ Registers a value read from fn() at scrape time (kind=b'counter' for counts kept elsewhere). """
+        self._series(name, kind, help_text, labels, fn)
+
+    def gauges(self, name, help_text, fn, kind=b'gauge'):
+        """ Registers series whose label sets are only known at scrape time (per client IP...): fn() returns (labels, value) pairs. """
+        self._series(name, kind, help_text, None, fn)
+
+    # --- Recording (hot path) ---
+    def observe(self, slot, us):
+        """ Records one duration in microseconds. """
+        bounds = BUCKETS_US
+        i = 0
+        n = len(bounds)
+        while i < n and us > bounds[i]: i += 1
+        self._hist_counts[slot * self._buckets + i] += 1
+        r = self._hist_sum_us[slot] + us
+        if r >= 1000000:
+            self._hist_sum_s[slot] += r // 1000000
+            r %= 1000000
+        self._hist_sum_us[slot] = r
+
+    def inc(self, slot, n=1):
+        self._counters[slot] += n
+
+    def collect(self):
+        """ gc.collect(), timed into pico_gc_pause_seconds. """
+        t0 = utime.ticks_us()
+        gc.collect()
+        self.observe(self.gc_pause, utime.ticks_diff(utime.ticks_us(), t0))
+
+    async def run_heap_probe(self):
+        """ Task: re-measures the largest free block every HEAP_PROBE_MS, so scrapes only read the last result. """
+        while True:
+            self._largest_free = await self._probe_largest_free()
+            await uasyncio.sleep_ms(HEAP_PROBE_MS)
+
+    async def _probe_largest_free(self):
+        """
+        Largest block that can be allocated. MicroPython only prints this
+        (micropython.mem_info), so it is found by binary search with trial
+        allocations after one collect. Not timed into pico_gc_pause_seconds
+        (the heap collects earlier probes itself before failing an
+        allocation); yields between trials so other tasks keep running.
+        """
+        gc.collect()
+        lo, hi = 0, gc.mem_free()
+        while hi - lo > HEAP_PROBE_STEP:
+            mid = (lo + hi) // 2
+            try:
+                probe = bytearray(mid)
+                probe = None
+                lo = mid
+            except MemoryError:
+                hi = mid
+            await uasyncio.sleep_ms(0)
+        return lo
+
+    # --- Export ---
+    async def write(self, out):
+        """ Writes all series in the Prometheus text format to a Json_stream-like buffered writer. Histograms with no samples are skipped. """
+        labels_sep = b','
+        for name, kind, help_text, series in self._families:
+            out.write(b'# HELP %s %s\n# TYPE %s %s\n' % (name, help_text, name, kind))
+            for labels, ref in series:
+                if kind == b'histogram':
+                    base = ref * self._buckets
+                    total = 0
+                    for i in range(self._buckets):
+                        total += self._hist_counts[base + i]
+                    if not total: continue
+                    cumulative = 0
+                    sep = labels_sep if labels else b''
+                    for i in range(self._buckets):
+                        cumulative += self._hist_counts[base + i]
+                        out.write(b'%s_bucket{%s%sle="%s"} %d\n' % (name, labels, sep, BUCKET_LABELS[i], cumulative))
+                    braces = b'{%s}' % labels if labels else b''
+                    out.write(b'%s_sum%s %d.%06d\n%s_count%s %d\n' % (name, braces, self._hist_sum_s[ref], self._hist_sum_us[ref], name, braces, total))
+                elif labels is None:
+                    for series_labels, value in ref():
+                        out.write(b'%s{%s} %d\n' % (name, series_labels, value))
+                else:
+                    value = ref() if callable(ref) else self._counters[ref]
+                    if labels: out.write(b'%s{%s} %d\n' % (name, labels, value))
+                    else: out.write(b'%s %d\n' % (name, value))
+                if out.pending: await out.drain()
+        await out.finish()
@@ -1,13 +1,11 @@
 import machine
-import config
+import log
 
 # Need Pico_pin for type hints/constants if used, though not strictly necessary here
 try: from pico_pin import Pico_pin
 except: Pico_pin = None
 
-def DPRINT(s):
-    if config.DEBUG:
-        print(s)
+_log = log.Logger("pico_adc")
 
 class Pico_adc:
     """
@@ -16,29 +14,32 @@ class Pico_adc:
     """
 
     CONVERSION_FACTOR = 3.3 / 65535.0
+    # Temperature = raw * TEMP_SCALE + TEMP_OFFSET (datasheet formula below, folded for raw history samples)
+    TEMP_SCALE = -CONVERSION_FACTOR / 0.001721
+    TEMP_OFFSET = 27.0 + 0.706 / 0.001721
 
-    def __init__(self, board_pins):
-        DPRINT("ADC: Initializing ADC subsystem...")
+    def __init__(self, pin_table):
+        __debug__ and _log.debug("ADC: Initializing ADC subsystem...")
         # Link to the board's pins using their IDs
         self._pin_adc0_id = 26
         self._pin_adc1_id = 27
         self._pin_adc2_id = 28
 
-        self._pin_adc0 = self._find_pin(board_pins, self._pin_adc0_id)
-        self._pin_adc1 = self._find_pin(board_pins, self._pin_adc1_id)
-        self._pin_adc2 = self._find_pin(board_pins, self._pin_adc2_id)
+        self._pin_adc0 = self._find_pin(pin_table, self._pin_adc0_id)
+        self._pin_adc1 = self._find_pin(pin_table, self._pin_adc1_id)
+        self._pin_adc2 = self._find_pin(pin_table, self._pin_adc2_id)
 
         # Initialize machine.ADC objects
-        DPRINT("ADC: Creating machine.ADC instances...")
+        __debug__ and _log.debug("ADC: Creating machine.ADC instances...")
         try:
             # Use pin ID directly for machine.ADC constructor
             self.adc_ch0 = machine.ADC(self._pin_adc0_id) if self._pin_adc0 else None
             self.adc_ch1 = machine.ADC(self._pin_adc1_id) if self._pin_adc1 else None
             self.adc_ch2 = machine.ADC(self._pin_adc2_id) if self._pin_adc2 else None
             self.adc_ch_temp = machine.ADC(4) # Internal temp sensor is ADC(4)
-            DPRINT("ADC: machine.ADC instances created.")
+            __debug__ and _log.debug("ADC: machine.ADC instances created.")
         except Exception as e:
-            DPRINT(f"ADC: ERROR creating machine.ADC instances: {e}")
+            _log.error("ADC: ERROR creating machine.ADC instances: %s", e)
             self.adc_ch0 = self.adc_ch1 = self.adc_ch2 = self.adc_ch_temp = None
 
 
@@ -47,24 +48,21 @@ class Pico_adc:
         if self._pin_adc0 and Pico_pin:
             # Use sync init for simplicity during setup
             self._pin_adc0._sync_init_internal(controller=Pico_pin.CTRL_ADC)
-            DPRINT(f"ADC: Set {self._pin_adc0.name} controller to ADC.")
+            __debug__ and _log.debug("ADC: Set %s controller to ADC.", self._pin_adc0.name)
         if self._pin_adc1 and Pico_pin:
             self._pin_adc1._sync_init_internal(controller=Pico_pin.CTRL_ADC)
-            DPRINT(f"ADC: Set {self._pin_adc1.name} controller to ADC.")
+            __debug__ and _log.debug("ADC: Set %s controller to ADC.", self._pin_adc1.name)
         if self._pin_adc2 and Pico_pin:
             self._pin_adc2._sync_init_internal(controller=Pico_pin.CTRL_ADC)
-            DPRINT(f"ADC: Set {self._pin_adc2.name} controller to ADC.")
-
-        DPRINT("ADC: Subsystem init complete.")
-
-    def _find_pin(self, pins, pin_id):
-        """Helper to find a pin by its ID from the board's list."""
-        if not pins: return None
-        for pin in pins:
-             # Check if pin object has _id before accessing
-            if hasattr(pin, '_id') and pin._id == pin_id:
-                return pin
-        DPRINT(f"ADC: WARNING - Pin ID {pin_id} not found in board pins list.")
+            __debug__ and _log.debug("ADC: Set %s controller to ADC.", self._pin_adc2.name)
+
+        __debug__ and _log.debug("ADC: Subsystem init complete.")
+
+    def _find_pin(self, pin_table, pin_id):
+        """Helper to look up a pin in the board's id-indexed pin table."""
+        if pin_table and 0 <= pin_id < len(pin_table) and pin_table[pin_id] is not None:
+            return pin_table[pin_id]
+        _log.warning("ADC: WARNING - Pin ID %s not found in board pins list.", pin_id)
         return None
 
     def read_temp_c(self):
@@ -76,9 +74,17 @@ class Pico_adc:
             # Formula from Pico datasheet section 4.9.5. Temperature Sensor
             return 27.0 - (temp_val - 0.706) / 0.001721
         except Exception as e:
-            DPRINT(f"ADC: Error reading temp: {e}")
+            _log.error("ADC: Error reading temp: %s", e)
             return -999.0 # Use float for consistency
 
+    def read_temp_u16(self):
+        """Reads the raw 16-bit temperature sensor value (0 if unavailable). Synchronous."""
+        if not self.adc_ch_temp: return 0
+        try: return self.adc_ch_temp.read_u16()
+        except Exception as e:
+            _log.error("ADC: Error reading temp: %s", e)
+            return 0
+
     def read_u16(self, channel):
         """Reads the raw 16-bit value from an ADC channel. Synchronous."""
         adc_instance = None
@@ -92,7 +98,7 @@ class Pico_adc:
             # Add small delay/yield?
             return adc_instance.read_u16()
         except Exception as e:
-            DPRINT(f"ADC: Error reading u16 ch{channel}: {e}")
+            _log.error("ADC: Error reading u16 ch%s: %s", channel, e)
             return 0
 
     def read_volts(self, channel):
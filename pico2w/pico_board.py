@@ -1,49 +1,94 @@
 import machine
-import network
 import ubluetooth
 import utime
+import random
 from micropython import const
-import config
+import log
 import uasyncio # Added asyncio
 
 # Import hardware models
 try:
     from pico_pin import Pico_pin
     from pico_adc import Pico_adc
+    from rp_sio import Rp_sio
+    from pin_action_queue import Pin_action_queue, QueueFull
+    from input_edges import Input_edge_ring
+    from metrics import Metrics
+    from pwm_effects import Pwm_effects
+    from rules import Rule_engine
+    from history import History
 except ImportError:
     print("Pico_board: FATAL: Failed to import Pin/ADC models.")
     # Define dummy classes
     class Pico_pin: pass
     class Pico_adc: pass
+    class Rp_sio:
+        available = False
+    class Pin_action_queue: pass
+    class QueueFull(Exception): pass
+    Input_edge_ring = None
+    class Metrics: pass
+    class Pwm_effects: pass
+    Rule_engine = None
+    History = None
 
 
-def DPRINT(s):
-    if config.DEBUG:
-        print(s)
+_log = log.Logger("pico_board")
 
 # BLE Constants
 ADV_FLAG_LE_GENERAL_DISCOVERABLE = const(0x02)
 ADV_TYPE_NAME_COMPLETE = const(0x09)
 
+# Pin table covers GP0..GP29 (index = GPIO number)
+PIN_TABLE_SIZE = const(30)
+
 class Pico_board:
     """ Pico W Digital Twin Model - Uses queue for pin actions, lock for others. """
-    def __init__(self, wlan, initial_ssid, initial_password):
-        DPRINT("Board: Initializing Pico_board...")
-        self.nic = wlan
-        self.ssid = initial_ssid
-        self.password = initial_password
-        DPRINT("Board: Wi-Fi linked.")
+    ADC_DELTA_U16 = 200 # Raw ADC change (~10 mV) that stamps a new ADC revision
+    INPUT_IRQ = True # Track GPIO IN edges with Pin.irq (pins whose IRQ fails are left to update_inputs scans)
+    HISTORY_CHANNELS = ("adc0", "adc1", "adc2", "temp") # Recorded for /api/history; "gp<N>" adds a pin level (fraction high)
+    def __init__(self, wifi):
+        __debug__ and _log.debug("Board: Initializing Pico_board...")
+        self.wifi = wifi # Wifi_manager: owns the WLAN, connects in the background
+        __debug__ and _log.debug("Board: Wi-Fi linked.")
+
+        # --- Metrics (counters/histograms in preallocated arrays, served at /api/metrics) ---
+        self.metrics = Metrics()
 
         # --- Hardware Lock (for non-pin actions like BLE/WiFi/Direct HW access) ---
         self.hw_lock = uasyncio.Lock()
-        DPRINT("Board: Hardware lock created.")
-
-        # --- Pin Action Queue (for pin mode/value/pwm changes) ---
-        self.pin_action_queue = uasyncio.Queue(maxsize=30) # Increased buffer size
-        DPRINT("Board: Pin action queue created.")
+        __debug__ and _log.debug("Board: Hardware lock created.")
+
+        # --- Pin Layout Version (bumped only when a pin's mode or controller changes) ---
+        self.pin_layout_version = 0
+
+        # --- State change events (one per push subscriber, set whenever pins/status/log change) ---
+        self._state_events = []
+
+        # --- Revision stamps (/api/board_state?since=<rev> returns only fields stamped after rev) ---
+        self.state_rev = 0 # Monotonic, bumped by next_rev() for every stamped change
+        self.state_epoch = random.getrandbits(30) # New value each boot, lets clients detect a reset
+        self.pin_revs = [0] * PIN_TABLE_SIZE # Rev of each pin's last change, indexed by pin id
+        self.adc_revs = [0, 0, 0] # Per channel rev of last change
+        self._adc_raw = [0, 0, 0] # Raw value at each channel's last stamp
+
+        # --- Pin Action Queue (for pin mode/value/pwm changes; coalesces stale writes per pin) ---
+        self.pin_action_queue = Pin_action_queue(maxsize=30)
+        __debug__ and _log.debug("Board: Pin action queue created.")
+        m = self.metrics
+        self._action_hist = {} # Action type -> histogram slot (time from dequeue to applied)
+        for action_type in ('mode', 'value', 'pwm', 'batch', 'effect'):
+            self._action_hist[action_type] = m.histogram(b'pico_pin_action_duration_seconds', b'Pin worker time per action (lock wait included)', b'action="%s"' % action_type.encode())
+        m.gauge(b'pico_pin_queue_depth', b'Pin actions waiting for the worker', lambda: len(self.pin_action_queue))
+        m.gauge(b'pico_pin_queue_coalesced_total', b'Pin requests merged into a pending action', lambda: self.pin_action_queue.coalesced, kind=b'counter')
+
+        # --- PWM effects (duty tables stepped by a timer; started/stopped through the pin queue) ---
+        effects = self.pwm_effects = Pwm_effects()
+        m.gauge(b'pico_pwm_effects_running', b'PWM effects currently stepping', lambda: len(effects))
+        m.gauge(b'pico_pwm_effects_finished_total', b'PWM effects that ran to completion', lambda: effects.finished, kind=b'counter')
 
         # --- Pins (pass lock to pins) ---
-        DPRINT("Board: Initializing Pins...")
+        __debug__ and _log.debug("Board: Initializing Pins...")
         # Lists based on physical header layout
         self.pins_left = [
             Pico_pin(0, "GP0 / UART0 TX", self.hw_lock), Pico_pin(1, "GP1 / UART0 RX", self.hw_lock), Pico_pin(-3, "GND", self.hw_lock),
@@ -72,184 +117,486 @@ class Pico_board:
         self.pins = self.pins_left + self.pins_right # 40 header pins
         # Create a list of only the controllable GPIO pins for easier iteration
         self.all_gpio_pins = [p for p in self.pins if hasattr(p,'_id') and p._id >= 0] + [self.onboard_led_pin]
-        DPRINT(f"Board: Pin lists created ({len(self.pins)} header, {len(self.all_gpio_pins)} controllable).")
+        # Fixed table indexed by GPIO number (None for GPIOs not modelled) for O(1) lookups
+        self.pin_table = [None] * PIN_TABLE_SIZE
+        for pin in self.all_gpio_pins:
+            self.pin_table[pin._id] = pin
+        __debug__ and _log.debug("Board: Pin lists created (%s header, %s controllable).", len(self.pins), len(self.all_gpio_pins))
+
+        # --- SIO (bulk GPIO writes for batches and input scans; falls back to machine.Pin when unavailable) ---
+        self.sio = Rp_sio()
+
+        # --- Input snapshot (update_inputs diffs one GPIO_IN word against the last scan) ---
+        self._in_mask = 0 # Bits of pins that are GPIO inputs
+        self._sio_in_mask = 0 # Of those, bits read from SIO GPIO_IN (others via machine.Pin)
+        self._in_word = 0 # Levels at the last scan (bits in _in_mask only)
+        self._in_snapshot_valid = False # Cleared by every mode change, rebuilt on the next scan
 
         # --- ADC ---
-        DPRINT("Board: Initializing ADC...")
-        self.adc = Pico_adc(self.all_gpio_pins) # Pass all controllable pins
-        DPRINT("Board: ADC initialized.")
+        __debug__ and _log.debug("Board: Initializing ADC...")
+        self.adc = Pico_adc(self.pin_table) # Pass the id-indexed pin table
+        __debug__ and _log.debug("Board: ADC initialized.")
 
         # --- Pin Aliases & Defaults (Sync init ok here) ---
         self.gp13 = self.get_pin_by_id(13)
         self.gp14 = self.get_pin_by_id(14)
         self.gp15 = self.get_pin_by_id(15)
-        DPRINT("Board: Setting default pin modes (sync)...")
+        __debug__ and _log.debug("Board: Setting default pin modes (sync)...")
         # Use sync init for defaults during construction
         if self.gp13: self.gp13._sync_init_internal(mode=Pico_pin.MODE_OUT)
         if self.gp14: self.gp14._sync_init_internal(mode=Pico_pin.MODE_OUT)
         if self.gp15: self.gp15._sync_init_internal(mode=Pico_pin.MODE_OUT)
         if self.onboard_led_pin: self.onboard_led_pin._sync_init_internal(mode=Pico_pin.MODE_OUT)
-        DPRINT("Board: Default modes set.")
+        __debug__ and _log.debug("Board: Default modes set.")
+
+        # --- Input edge tracking (IRQs fill the ring, _process_input_edges drains it) ---
+        self.edge_ring = Input_edge_ring() if (self.INPUT_IRQ and Input_edge_ring) else None
+        self._edges_dropped = 0 # ring.dropped at the consumer's last resync
+        if self.edge_ring:
+            ring = self.edge_ring
+            self._edge_latency = m.histogram(b'pico_input_edge_latency_seconds', b'Input edge IRQ to cache update')
+            m.gauge(b'pico_input_edges_dropped_total', b'Edges lost to a full edge ring', lambda: ring.dropped, kind=b'counter')
+            for pin in self.all_gpio_pins:
+                pin.edge_ring = self.edge_ring
+                pin._update_edge_irq() # Registers only for pins currently GPIO IN
+            __debug__ and _log.debug("Board: Edge IRQs on %s input pin(s).", sum((1 for p in self.all_gpio_pins if p.has_edge_irq)))
+
+        # --- Rules (evaluated on the board, actions queued as pin batches; loaded by the controller) ---
+        self.rules = Rule_engine(self) if Rule_engine else None
+
+        # --- History (rings of selected channels, sampled by history.run()) ---
+        self.history = History(m) if History else None
+        if self.history: self._add_history_channels()
 
         # --- Bluetooth (Sync init ok here) ---
-        DPRINT("Board: Initializing Bluetooth...")
+        __debug__ and _log.debug("Board: Initializing Bluetooth...")
         self.ble = None
         self._ble_adv_active = False # Internal flag to track advertising state
         self.ble_name = "Pico-WebIO"
         self._sync_init_ble_internal() # Use sync internal version for init
 
-        DPRINT("Board: Pico_board init complete.")
+        __debug__ and _log.debug("Board: Pico_board init complete.")
 
 
     # --- Pin Action Worker Task ---
     async def _process_pin_actions(self):
         """Dedicated async task to process pin actions sequentially from the queue."""
-        DPRINT("Board._process_pin_actions: Worker task started.")
+        __debug__ and _log.debug("Board._process_pin_actions: Worker task started.")
         while True:
             action = None # Clear action for error handling
             pin = None    # Clear pin for error handling
             try:
                 # Wait indefinitely for an action from the queue
                 action = await self.pin_action_queue.get()
+                t0 = utime.ticks_us()
                 action_type, pin_id, *args = action
-                DPRINT(f"BoardWorker: Dequeued action '{action_type}' for pin {pin_id} with args {args}")
+                __debug__ and _log.debug("BoardWorker: Dequeued action '%s' for pin %s with args %s", action_type, pin_id, args)
+
+                if action_type == 'batch':
+                    # Validated list of actions, applied as one unit under a single lock acquisition
+                    async with self.hw_lock:
+                        __debug__ and _log.debug("BoardWorker: Acquired lock for batch of %s action(s).", len(args[0]))
+                        await self._apply_batch_locked(args[0])
+                    self.notify_state_changed()
+                    self.metrics.observe(self._action_hist['batch'], utime.ticks_diff(utime.ticks_us(), t0))
+                    continue
+
+                if action_type == 'effect':
+                    effect = args[0]
+                    async with self.hw_lock:
+                        self._apply_effect_locked(effect)
+                    for effect_pin in effect.pin_ids: self._stamp_pin(self.pin_table[effect_pin])
+                    self.notify_state_changed()
+                    self.metrics.observe(self._action_hist['effect'], utime.ticks_diff(utime.ticks_us(), t0))
+                    continue
 
                 pin = self.get_pin_by_id(pin_id)
                 if not pin:
-                    DPRINT(f"BoardWorker: Pin {pin_id} not found. Skipping action.")
-                    self.pin_action_queue.task_done()
+                    _log.warning("BoardWorker: Pin %s not found. Skipping action.", pin_id)
                     continue
 
                 # Acquire lock before modifying the pin
-                DPRINT(f"BoardWorker: Waiting for lock for pin {pin_id} action '{action_type}'...")
+                __debug__ and _log.debug("BoardWorker: Waiting for lock for pin %s action '%s'...", pin_id, action_type)
                 async with self.hw_lock: # No timeout needed if lock usage is correct
-                    DPRINT(f"BoardWorker: Acquired lock for pin {pin_id} action '{action_type}'.")
-
-                    # --- Perform Action ---
-                    if action_type == 'mode':
-                        mode_str, pull_str = args
-                        # Pin.init handles logic for mode/pull/controller transitions
-                        await pin.init(mode=Pico_pin.str_to_mode(mode_str), # Helper func needed?
-                                       pull=Pico_pin.str_to_pull(pull_str), # Helper func needed?
-                                       controller=Pico_pin.mode_str_to_controller(mode_str, pin.is_adc_capable)) # Helper
-                        DPRINT(f"BoardWorker: Pin {pin_id} mode set via worker.")
-
-                    elif action_type == 'value':
-                        value = args[0]
-                        # Pin setter handles mode check internally
-                        await pin.set_value_async(value)
-                        DPRINT(f"BoardWorker: Pin {pin_id} value set via worker.")
-
-                    elif action_type == 'pwm':
-                         freq, duty_pc = args
-                         if pin.pwm_instance:
-                              # PWM setters are sync, lock already held
-                              if freq is not None: pin.pwm_instance.freq = freq
-                              if duty_pc is not None: pin.pwm_instance.duty_percent = duty_pc
-                              DPRINT(f"BoardWorker: Pin {pin_id} PWM set via worker.")
-                         else: DPRINT(f"BoardWorker: Pin {pin_id} has no PWM instance. Skipping.")
-                    else:
-                        DPRINT(f"BoardWorker: Unknown action type '{action_type}'. Skipping.")
-
+                    __debug__ and _log.debug("BoardWorker: Acquired lock for pin %s action '%s'.", pin_id, action_type)
+                    await self._apply_action_locked(pin, action_type, args)
                     await uasyncio.sleep_ms(0) # Yield after hardware op
 
                 # Lock released automatically
-                DPRINT(f"BoardWorker: Released lock for pin {pin_id} action '{action_type}'.")
-                self.pin_action_queue.task_done() # Signal completion
+                __debug__ and _log.debug("BoardWorker: Released lock for pin %s action '%s' (%s coalesced so far).", pin_id, action_type, self.pin_action_queue.coalesced)
+                self._stamp_pin(pin)
+                self.notify_state_changed()
+                self.metrics.observe(self._action_hist[action_type], utime.ticks_diff(utime.ticks_us(), t0))
 
             except uasyncio.CancelledError:
-                DPRINT("Board._process_pin_actions: Task cancelled.")
+                __debug__ and _log.debug("Board._process_pin_actions: Task cancelled.")
                 raise # Re-raise CancelledError to allow clean task shutdown
             except Exception as e:
-                DPRINT(f"Board._process_pin_actions: ERROR processing action {action} for pin {pin}: {e}")
+                _log.error("Board._process_pin_actions: ERROR processing action %s for pin %s: %s", action, pin, e)
                 import sys; sys.print_exception(e)
-                # Ensure task_done is called if get() succeeded but processing failed
-                if action is not None and self.pin_action_queue.empty(): # Check if queue empty after potential get()
-                     try:
-                          # This logic might be flawed if queue fills again quickly.
-                          # Better: Check if the failed action *was* the one we got.
-                          # Simplest: Just call task_done and let potential errors happen.
-                          self.pin_action_queue.task_done()
-                          DPRINT("BoardWorker: Called task_done after error.")
-                     except ValueError: pass # task_done might fail if already called
-
+                # The failed action was already removed from the queue; carry on with the next one
                 await uasyncio.sleep_ms(100) # Delay before next attempt
 
 
+    async def _apply_action_locked(self, pin, action_type, args):
+        """ Performs one queued pin action. ASSUMES hw_lock HELD. """
+        pin_id = pin._id
+        if action_type == 'mode' or action_type == 'pwm':
+            self.pwm_effects.stop_pins((pin_id,)) # Explicit settings override a running effect
+        if action_type == 'mode':
+            mode_str, pull_str = args
+            layout_before = (pin.mode, pin.controlled_by)
+            # Pin init handles logic for mode/pull/controller transitions (lock already held)
+            await pin._init_locked(mode=Pico_pin.str_to_mode(mode_str),
+                                   pull=Pico_pin.str_to_pull(pull_str),
+                                   controller=Pico_pin.mode_str_to_controller(mode_str, pin.is_adc_capable))
+            self._note_pin_layout(pin, layout_before)
+            self._in_snapshot_valid = False # Input set or cached level may have changed
+            __debug__ and _log.debug("BoardWorker: Pin %s mode set via worker.", pin_id)
+
+        elif action_type == 'value':
+            value = args[0]
+            # Pin setter handles mode check internally (lock already held)
+            await pin._set_value_locked(value)
+            __debug__ and _log.debug("BoardWorker: Pin %s value set via worker.", pin_id)
+
+        elif action_type == 'pwm':
+             freq, duty_pc = args
+             if pin.pwm_instance:
+                  # PWM setters are sync, lock already held
+                  if freq is not None: pin.pwm_instance.freq = freq
+                  if duty_pc is not None: pin.pwm_instance.duty_percent = duty_pc
+                  __debug__ and _log.debug("BoardWorker: Pin %s PWM set via worker.", pin_id)
+             else: _log.warning("BoardWorker: Pin %s has no PWM instance. Skipping.", pin_id)
+        else:
+            _log.warning("BoardWorker: Unknown action type '%s'. Skipping.", action_type)
+
+    async def _apply_batch_locked(self, actions):
+        """
+        Applies a validated batch in order. ASSUMES hw_lock HELD.
+        Runs of value writes to GPIO OUT pins are merged and driven by one
+        SIO register write (or back-to-back machine.Pin writes without
+        yielding when SIO is unavailable); any other action flushes the run first.
+        """
+        sio = self.sio
+        mask = 0
+        bits = 0
+        for action_type, pin_id, *args in actions:
+            pin = self.pin_table[pin_id] # Validated before queueing
+            if action_type == 'value' and pin.is_gpio_out:
+                bit = 1 << pin_id
+                if sio.available and bit & sio.safe_mask:
+                    mask |= bit
+                    if args[0]: bits |= bit
+                    else: bits &= ~bit
+                    pin._note_value_locked(args[0])
+                else:
+                    pin._write_value_locked(args[0])
+            else:
+                if mask:
+                    sio.write_out(mask, bits)
+                    mask = bits = 0
+                await self._apply_action_locked(pin, action_type, args)
+            self._stamp_pin(pin)
+        if mask:
+            sio.write_out(mask, bits)
+        __debug__ and _log.debug("BoardWorker: Batch of %s action(s) applied.", len(actions))
+
+    def _apply_effect_locked(self, effect):
+        """ Stops effects on the effect's pins, then builds and starts it. ASSUMES hw_lock HELD. """
+        self.pwm_effects.stop_pins(effect.pin_ids)
+        if effect.kind == 'stop': return
+        channels = []
+        for pin_id in effect.pin_ids:
+            pwm = self.pin_table[pin_id].pwm_instance # Ids validated before queueing
+            if not pwm:
+                _log.warning("BoardWorker: Pin %s is not in PWM mode. Skipping '%s' effect.", pin_id, effect.kind)
+                return
+            channels.append(pwm)
+        effect.build(channels)
+        self.pwm_effects.start(effect)
+
+    def _note_pin_layout(self, pin, layout_before):
+        """ Bumps pin_layout_version if the pin's mode or controller actually changed. """
+        if (pin.mode, pin.controlled_by) != layout_before:
+            self.pin_layout_version += 1
+            __debug__ and _log.debug("Board: Pin %s layout %s -> (%s, %s). Layout version %s.", pin._id, layout_before, pin.mode, pin.controlled_by, self.pin_layout_version)
+
     # --- Methods that queue pin actions (Synchronous) ---
     def set_pin_mode(self, pin_id, mode_str, pull_str=None):
         """ Sync Action: Queue request to set pin mode/pull. """
-        DPRINT(f"Board.set_pin_mode: Queuing pin {pin_id} -> Mode={mode_str}, Pull={pull_str}")
+        __debug__ and _log.debug("Board.set_pin_mode: Queuing pin %s -> Mode=%s, Pull=%s", pin_id, mode_str, pull_str)
         try:
             # Queue tuple: (action_type, pin_id, mode_str, pull_str)
-            self.pin_action_queue.put_nowait(('mode', pin_id, mode_str, pull_str))
-            return True, "Mode change queued."
-        except uasyncio.QueueFull: DPRINT("Queue full!"); return False, "Queue full."
-        except Exception as e: DPRINT(f"Error queueing: {e}"); return False, f"Error: {e}"
+            merged = self.pin_action_queue.put_nowait(('mode', pin_id, mode_str, pull_str))
+            return True, "Mode change merged with pending one." if merged else "Mode change queued."
+        except QueueFull: _log.warning("Queue full!"); return False, "Queue full."
+        except Exception as e: _log.error("Error queueing: %s", e); return False, f"Error: {e}"
 
     def set_pin_value(self, pin_id, value):
         """ Sync Action: Queue request to set pin value. """
-        DPRINT(f"Board.set_pin_value: Queuing pin {pin_id} -> Value={value}")
+        __debug__ and _log.debug("Board.set_pin_value: Queuing pin %s -> Value=%s", pin_id, value)
         try:
-            self.pin_action_queue.put_nowait(('value', pin_id, value))
-            return True, "Value change queued."
-        except uasyncio.QueueFull: DPRINT("Queue full!"); return False, "Queue full."
-        except Exception as e: DPRINT(f"Error queueing: {e}"); return False, f"Error: {e}"
+            merged = self.pin_action_queue.put_nowait(('value', pin_id, value))
+            return True, "Value change merged with pending one." if merged else "Value change queued."
+        except QueueFull: _log.warning("Queue full!"); return False, "Queue full."
+        except Exception as e: _log.error("Error queueing: %s", e); return False, f"Error: {e}"
 
     def set_pwm_params(self, pin_id, freq=None, duty_pc=None):
         """ Sync Action: Queue request to set PWM params. """
-        DPRINT(f"Board.set_pwm_params: Queuing pin {pin_id} -> Freq={freq}, DutyPC={duty_pc}")
+        __debug__ and _log.debug("Board.set_pwm_params: Queuing pin %s -> Freq=%s, DutyPC=%s", pin_id, freq, duty_pc)
         try:
             freq_int = int(freq) if freq is not None else None
             duty_float = float(duty_pc) if duty_pc is not None else None
-            self.pin_action_queue.put_nowait(('pwm', pin_id, freq_int, duty_float))
-            return True, "PWM change queued."
-        except uasyncio.QueueFull: DPRINT("Queue full!"); return False, "Queue full."
-        except (ValueError, TypeError) as e: DPRINT(f"Invalid value: {e}"); return False, "Invalid value"
-        except Exception as e: DPRINT(f"Error queueing: {e}"); return False, f"Error: {e}"
+            merged = self.pin_action_queue.put_nowait(('pwm', pin_id, freq_int, duty_float))
+            return True, "PWM change merged with pending one." if merged else "PWM change queued."
+        except QueueFull: _log.warning("Queue full!"); return False, "Queue full."
+        except (ValueError, TypeError) as e: __debug__ and _log.debug("Invalid value: %s", e); return False, "Invalid value"
+        except Exception as e: _log.error("Error queueing: %s", e); return False, f"Error: {e}"
+
+    def queue_pin_batch(self, actions):
+        """ Sync Action: Queue a validated list of ('mode'|'value'|'pwm', pin_id, ...) actions as one unit. """
+        __debug__ and _log.debug("Board.queue_pin_batch: Queuing batch of %s action(s)", len(actions))
+        try:
+            self.pin_action_queue.put_nowait(('batch', None, actions))
+            return True, f"Batch of {len(actions)} action(s) queued."
+        except QueueFull: _log.warning("Queue full!"); return False, "Queue full."
+        except Exception as e: _log.error("Error queueing: %s", e); return False, f"Error: {e}"
+
+    def queue_pwm_effect(self, effect):
+        """ Sync Action: Queue a Pwm_effect start (or 'stop') for the worker. """
+        __debug__ and _log.debug("Board.queue_pwm_effect: Queuing '%s' on pins %s", effect.kind, effect.pin_ids)
+        try:
+            self.pin_action_queue.put_nowait(('effect', None, effect))
+            return True, "Effects stop queued." if effect.kind == 'stop' else f"'{effect.kind}' effect queued."
+        except QueueFull: _log.warning("Queue full!"); return False, "Queue full."
+        except Exception as e: _log.error("Error queueing: %s", e); return False, f"Error: {e}"
+
+    def _add_history_channels(self):
+        """ Registers HISTORY_CHANNELS with their raw readers and unit conversions. """
+        adc = self.adc
+        for name in self.HISTORY_CHANNELS:
+            if name in ("adc0", "adc1", "adc2"):
+                ch = int(name[3])
+                self.history.add(name, 'H', lambda ch=ch: adc.read_u16(ch), adc.CONVERSION_FACTOR)
+            elif name == "temp":
+                self.history.add(name, 'H', adc.read_temp_u16, adc.TEMP_SCALE, adc.TEMP_OFFSET)
+            elif name.startswith("gp") and self.get_pin_by_id(name[2:]):
+                pin = self.get_pin_by_id(name[2:])
+                self.history.add(name, 'B', lambda pin=pin: 255 if pin.value == 1 else 0, 1 / 255) # Averages give the fraction of time high
+            else:
+                _log.warning("Board: Unknown history channel '%s'. Skipping.", name)
 
     # --- Other methods ---
+    # --- PWM Effect Reaper Task ---
+    async def _process_pwm_effects(self):
+        """ Waits for the effect timer to flag finished effects, then stamps their pins (final duty) and notifies. """
+        __debug__ and _log.debug("Board._process_pwm_effects: Task started.")
+        effects = self.pwm_effects
+        while True:
+            await effects.flag.wait()
+            for effect in effects.reap():
+                __debug__ and _log.debug("Board: '%s' effect on pins %s finished.", effect.kind, effect.pin_ids)
+                for pin_id in effect.pin_ids: self._stamp_pin(self.pin_table[pin_id])
+                self.notify_state_changed()
+
+    # --- Input Edge Consumer Task ---
+    async def _process_input_edges(self):
+        """
+        Waits on the edge ring's ThreadSafeFlag and applies the queued
+        transitions under one hw_lock acquisition per wake-up, stamping and
+        notifying only pins whose level changed. Idle cost is zero (no polling).
+        """
+        ring = self.edge_ring
+        if ring is None:
+            __debug__ and _log.debug("Board Edges: Edge tracking disabled, consumer not running.")
+            return
+        __debug__ and _log.debug("Board Edges: Edge consumer task started.")
+        while True:
+            await ring.flag.wait()
+            changed = 0
+            try:
+                async with self.hw_lock:
+                    if not self._in_snapshot_valid:
+                        self._rebuild_input_snapshot()
+                    word = self._in_word
+                    while ring.pending():
+                        i = ring.tail
+                        pin_id, level, ticks = ring.pins[i], ring.levels[i], ring.ticks[i]
+                        ring.advance()
+                        pin = self.pin_table[pin_id]
+                        if not pin.is_gpio_in: continue # Mode changed after the edge
+                        pin._note_edge_locked(level, ticks)
+                        self.metrics.observe(self._edge_latency, utime.ticks_diff(utime.ticks_us(), ticks))
+                        bit = 1 << pin_id
+                        if level: word |= bit
+                        else: word &= ~bit
+                    changed = (word ^ self._in_word) & self._in_mask
+                    if changed:
+                        self._in_word = word & self._in_mask
+                        pin_id = 0
+                        bits = changed
+                        while bits:
+                            if bits & 1: self._stamp_pin(self.pin_table[pin_id])
+                            bits >>= 1
+                            pin_id += 1
+                if changed:
+                    __debug__ and _log.debug("Board Edges: Input levels changed (mask %#x).", changed)
+                    self.notify_state_changed()
+                if ring.dropped != self._edges_dropped: # Ring overflowed, re-read the real levels
+                    __debug__ and _log.debug("Board Edges: %s edge(s) dropped, rescanning inputs.", ring.dropped - self._edges_dropped)
+                    self._edges_dropped = ring.dropped
+                    await self.update_inputs()
+            except Exception as e:
+                _log.error("Board Edges: Error applying edges: %s", e)
+
     async def update_inputs(self): # Keep async
-        DPRINT("Board.update_inputs (async): Scanning hardware inputs...")
-        # Use simple loop instead of gather for less overhead?
+        """
+        Samples every GPIO input under one hw_lock acquisition: one SIO
+        GPIO_IN read where available (machine.Pin reads otherwise, without
+        yielding), then updates and stamps only the pins whose level changed.
+        """
+        changed = 0
+        async with self.hw_lock:
+            if not self._in_snapshot_valid:
+                self._rebuild_input_snapshot()
+            mask = self._in_mask
+            if mask:
+                word = self.sio.read_in() if self._sio_in_mask else 0
+                slow = mask & ~self._sio_in_mask
+                pin_id = 0
+                while slow:
+                    if slow & 1 and self.pin_table[pin_id]._read_level_locked() == 1:
+                        word |= 1 << pin_id
+                    slow >>= 1
+                    pin_id += 1
+                changed = (word ^ self._in_word) & mask
+                if changed:
+                    self._in_word = word & mask
+                    bits = changed
+                    pin_id = 0
+                    while bits:
+                        if bits & 1:
+                            pin = self.pin_table[pin_id]
+                            pin._note_input_locked((word >> pin_id) & 1)
+                            self._stamp_pin(pin)
+                        bits >>= 1
+                        pin_id += 1
+        if changed:
+            __debug__ and _log.debug("Board.update_inputs: Input levels changed (mask %#x).", changed)
+            self.notify_state_changed()
+
+    def _rebuild_input_snapshot(self):
+        """ Recomputes which pins are GPIO inputs and seeds the snapshot from their cached levels. ASSUMES LOCK HELD. """
+        mask = 0
+        word = 0
         for pin in self.all_gpio_pins:
-             if pin.mode == "IN":
-                  await pin.read_input_value() # This method acquires the lock internally
-        DPRINT("Board.update_inputs (async): Scan complete.")
+            if pin.is_gpio_in:
+                bit = 1 << pin._id
+                mask |= bit
+                if pin.value == 1: word |= bit
+        self._in_mask = mask
+        self._sio_in_mask = mask & self.sio.safe_mask if self.sio.available else 0
+        self._in_word = word
+        self._in_snapshot_valid = True
+        __debug__ and _log.debug("Board: Input snapshot rebuilt (inputs %#x, via SIO %#x).", mask, self._sio_in_mask)
 
 
     def export_state_dict(self): # Keep sync
         # (Implementation remains the same - reads cached state)
-        DPRINT("Board.export_state: Exporting board state...")
-        pin_states = []
-        for pin in self.all_gpio_pins:
-            state = { "id": pin._id, "name": pin.name, "mode": pin.mode, "value": pin.value, "pull": pin.pull_str, "controller": pin.controlled_by }
-            if pin.pwm_instance: state["pwm_freq"] = pin.pwm_instance.freq; state["pwm_duty"] = pin.pwm_instance.duty_percent
-            pin_states.append(state)
-        temp_c = self.get_internal_temp()
-        wifi_info = ('0.0.0.0',) * 4 # Default
-        if hasattr(self, 'nic') and self.nic and self.nic.isconnected(): # Add checks
-            wifi_info = self.nic.ifconfig()
+        __debug__ and _log.debug("Board.export_state: Exporting board state...")
+        self.sample_adc() # Stamp ADC first so 'rev' covers the values exported
+        state = {
+            "rev": self.state_rev,
+            "epoch": self.state_epoch,
+            "full": True,
+            "pins": [self.pin_state_dict(pin) for pin in self.all_gpio_pins],
+            "status": self.status_dict(),
+            "adc_volts": self.adc_volts_dict()
+        }
+        __debug__ and _log.debug("Board.export_state: State export complete.")
+        return state
 
-        time_tuple = self.get_time_tuple(); time_str = "{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(*time_tuple[0:6])
+    def export_state_since(self, since): # Sync
+        """ Like export_state_dict, but pins and ADC channels only if stamped after revision 'since'. """
+        self.sample_adc()
+        pin_revs = self.pin_revs
+        adc_revs = self.adc_revs
         state = {
-            "pins": pin_states,
-            "status": { "ip": wifi_info[0], "netmask": wifi_info[1], "gateway": wifi_info[2], "dns": wifi_info[3], "temp_c": f"{temp_c:.2f}", "time": time_str, "ble_status": "Advertising" if self.ble_is_advertising else "Inactive", "ble_name": self.ble_name, "wifi_ssid": self.ssid },
-            "adc_volts": { "adc0": f"{self.adc.read_volts(0):.3f}", "adc1": f"{self.adc.read_volts(1):.3f}", "adc2": f"{self.adc.read_volts(2):.3f}" }
+            "rev": self.state_rev,
+            "epoch": self.state_epoch,
+            "full": False,
+            "pins": [self.pin_state_dict(pin) for pin in self.all_gpio_pins if pin_revs[pin._id] > since],
+            "status": self.status_dict(),
+            "adc_volts": {f"adc{ch}": self.adc_stamped_volts(ch) for ch in range(3) if adc_revs[ch] > since}
         }
-        DPRINT("Board.export_state: State export complete.")
+        __debug__ and _log.debug("Board.export_state_since: rev %s -> %s, %s pin(s), %s ADC channel(s).", since, self.state_rev, len(state['pins']), len(state['adc_volts']))
         return state
 
+    def pin_state_dict(self, pin): # Sync, shared by full exports and event deltas
+        state = { "id": pin._id, "name": pin.name, "mode": pin.mode, "value": pin.value, "pull": pin.pull_str, "controller": pin.controlled_by }
+        pwm = pin.pwm_instance
+        if pwm:
+            state["pwm_freq"] = pwm.freq; state["pwm_duty"] = pwm.duty_percent
+            if pwm.effect: state["pwm_effect"] = pwm.effect.kind
+        return state
+
+    def status_dict(self): # Sync
+        temp_c = self.get_internal_temp()
+        wifi_info = self.wifi.ifconfig # Cached by Wifi_manager while up, zeros otherwise
+        return { "ip": wifi_info[0], "netmask": wifi_info[1], "gateway": wifi_info[2], "dns": wifi_info[3], "temp_c": f"{temp_c:.2f}", "time": self.get_time_str(), "ble_status": "Advertising" if self.ble_is_advertising else "Inactive", "ble_name": self.ble_name, "wifi_ssid": self.wifi.ssid }
+
+    def adc_volts_dict(self): # Sync
+        return { "adc0": f"{self.adc.read_volts(0):.3f}", "adc1": f"{self.adc.read_volts(1):.3f}", "adc2": f"{self.adc.read_volts(2):.3f}" }
+
+    # --- Revision stamps ---
+    def next_rev(self):
+        """ Sync: Returns a new, strictly increasing revision number. """
+        self.state_rev += 1
+        return self.state_rev
+
+    def _stamp_pin(self, pin):
+        self.pin_revs[pin._id] = self.next_rev()
+
+    def sample_adc(self):
+        """ Sync: Reads ADC channels, stamping any that moved by ADC_DELTA_U16 or more since their last stamp. """
+        if not hasattr(self, 'adc') or not self.adc: return
+        for ch in range(3):
+            raw = self.adc.read_u16(ch)
+            if abs(raw - self._adc_raw[ch]) >= self.ADC_DELTA_U16:
+                self._adc_raw[ch] = raw
+                self.adc_revs[ch] = self.next_rev()
+
+    def adc_stamped_volts(self, ch): # Sync, channel value as of its last revision stamp
+        return f"{self._adc_raw[ch] * self.adc.CONVERSION_FACTOR:.3f}"
+
+    # --- State change notification (wakes /api/events subscribers) ---
+    def subscribe_state(self):
+        """ Sync: Returns an Event set by every notify_state_changed() until unsubscribe_state(); the subscriber clears it. """
+        event = uasyncio.Event()
+        self._state_events.append(event)
+        return event
+
+    def unsubscribe_state(self, event):
+        if event in self._state_events: self._state_events.remove(event)
+
+    def notify_state_changed(self):
+        """ Sync: Signals that pins, status or log changed. Safe to call from any task. """
+        for event in self._state_events:
+            event.set() # Stays set until its subscriber clears it, so a change while it isn't waiting isn't lost
+
     @property
     def ble_is_advertising(self): return self._ble_adv_active # Sync property read ok
 
-    def get_pin_by_id(self, pin_id): # Sync ok
-        # Ensure pin_id is int
-        try: pin_id_int = int(pin_id)
-        except: return None
-        for pin in self.all_gpio_pins:
-            if hasattr(pin, '_id') and pin._id == pin_id_int: return pin
-        DPRINT(f"Board.get_pin_by_id: Pin ID {pin_id_int} not found!"); return None
+    def get_pin_by_id(self, pin_id): # Sync ok, O(1) via pin_table
+        # Ensure pin_id is int (only converts when it isn't one already)
+        if type(pin_id) is not int:
+            try: pin_id = int(pin_id)
+            except (ValueError, TypeError): return None
+        if 0 <= pin_id < PIN_TABLE_SIZE:
+            pin = self.pin_table[pin_id]
+            if pin is not None: return pin
+        _log.warning("Board.get_pin_by_id: Pin ID %s not found!", pin_id); return None
 
     def get_internal_temp(self): # Sync ok
         if hasattr(self, 'adc') and self.adc: return self.adc.read_temp_c()
@@ -257,115 +604,96 @@ class Pico_board:
 
     def get_time_tuple(self): return utime.localtime() # Sync ok
 
-    async def connect_wifi(self, ssid, password): # Keep async, use lock
-        DPRINT(f"Board.connect_wifi (async): Reconnect to '{ssid}'...")
-        self.ssid = ssid; self.password = password
-        if not hasattr(self, 'nic') or self.nic is None: DPRINT("WLAN obj missing."); return False
+    def get_time_str(self): # Sync ok
+        return "{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(*self.get_time_tuple()[0:6])
 
-        connected = False
-        async with self.hw_lock: # Lock during network state change
-            DPRINT("Board.connect_wifi: Acquired lock.");
-            try:
-                if self.nic.isconnected(): DPRINT("Disconnecting..."); self.nic.disconnect(); await uasyncio.sleep_ms(1000)
-                self.nic.active(True); self.nic.connect(self.ssid, self.password)
-                DPRINT("Board.connect_wifi: Connect initiated.")
-            except Exception as e:
-                DPRINT(f"Board.connect_wifi: Error during disconnect/connect: {e}")
-                return False # Exit if error occurs under lock
-        # Release lock before waiting loop
-
-        start_time = utime.ticks_ms(); timeout = 15000
-        while not self.nic.isconnected():
-            if utime.ticks_diff(utime.ticks_ms(), start_time) > timeout: DPRINT("Timeout."); break
-            DPRINT("Waiting..."); await uasyncio.sleep_ms(500) # Yield control
-
-        connected = self.nic.isconnected(); DPRINT(f"Connected={connected}")
-        if not connected:
-            DPRINT(f"FAILED connect to {ssid}.")
-            # Consider deactivating radio again? Needs lock.
-            # async with self.hw_lock: self.nic.active(False)
+    async def connect_wifi(self, ssid, password):
+        """ Async: Switches Wi-Fi to new credentials (Wifi_manager rejoins), True once connected. """
+        __debug__ and _log.debug("Board.connect_wifi (async): Reconnect to '%s'...", ssid)
+        connected = await self.wifi.connect(ssid, password)
+        if not connected: _log.error("FAILED connect to %s.", ssid)
         return connected
 
     # --- Internal Sync BLE Init (for constructor) ---
     def _sync_init_ble_internal(self):
-        DPRINT("Board._sync_init_ble...")
+        __debug__ and _log.debug("Board._sync_init_ble...")
         try:
             self.ble = ubluetooth.BLE(); self.ble.active(True); self._ble_adv_active = False
-            DPRINT("BLE radio activated (sync).")
+            __debug__ and _log.debug("BLE radio activated (sync).")
         except Exception as e:
             self.ble = None; self._ble_adv_active = False
-            DPRINT(f"FAILED BLE init (sync): {e}")
+            _log.error("FAILED BLE init (sync): %s", e)
 
     # --- Async BLE Methods (use lock) ---
     async def init_ble(self): # Public async version
-        DPRINT("Board.init_ble (async)...")
-        if self.ble: DPRINT("Already init."); return True
+        __debug__ and _log.debug("Board.init_ble (async)...")
+        if self.ble: __debug__ and _log.debug("Already init."); return True
         async with self.hw_lock: # Lock during BLE init
             # Re-check inside lock
             if self.ble: return True
             try:
                 self.ble = ubluetooth.BLE(); self.ble.active(True); self._ble_adv_active = False
-                DPRINT("BLE radio activated.")
+                __debug__ and _log.debug("BLE radio activated.")
                 return True
             except Exception as e:
                 self.ble = None; self._ble_adv_active = False
-                DPRINT(f"FAILED BLE init: {e}"); return False
+                _log.error("FAILED BLE init: %s", e); return False
 
     def _adv_encode(self, adv_type, value): return bytes([len(value) + 1, adv_type]) + value
 
     async def start_ble_advertising(self): # Async, uses lock
-        DPRINT(f"Board.start_ble_adv (async) as '{self.ble_name}'...")
+        __debug__ and _log.debug("Board.start_ble_adv (async) as '%s'...", self.ble_name)
         if not self.ble:
             if not await self.init_ble(): return False # Await init
 
         is_active = False
         try: is_active = self.ble.active()
         except: pass
-        if not is_active: DPRINT("BLE radio inactive, cannot start adv."); return False
+        if not is_active: __debug__ and _log.debug("BLE radio inactive, cannot start adv."); return False
 
         # Check flag outside lock for quick exit
-        if self._ble_adv_active: DPRINT("Already advertising."); return True
+        if self._ble_adv_active: __debug__ and _log.debug("Already advertising."); return True
 
         async with self.hw_lock: # Lock before advertising
-            if self._ble_adv_active: DPRINT("Already adv (checked under lock)."); return True # Re-check
+            if self._ble_adv_active: __debug__ and _log.debug("Already adv (checked under lock)."); return True # Re-check
             try:
                 name_bytes = self.ble_name.encode('utf-8')[:27]
                 adv_data = bytes([0x02, 0x01, ADV_FLAG_LE_GENERAL_DISCOVERABLE]) + self._adv_encode(ADV_TYPE_NAME_COMPLETE, name_bytes)
-                DPRINT(f"Board.start_ble_adv: Payload (len {len(adv_data)}): {adv_data}")
+                __debug__ and _log.debug("Board.start_ble_adv: Payload (len %s): %s", len(adv_data), adv_data)
                 self.ble.gap_advertise(100_000, adv_data=adv_data, connectable=False)
                 await uasyncio.sleep_ms(10) # Small delay after starting
                 self._ble_adv_active = True # Update flag under lock
-                DPRINT("Advertising started."); return True
+                __debug__ and _log.debug("Advertising started."); return True
             except Exception as e:
                 self._ble_adv_active = False # Update flag under lock
-                DPRINT(f"ERROR starting advertising: {e}")
+                _log.error("ERROR starting advertising: %s", e)
                 # Try cycling radio state (still under lock) - might deadlock if active() blocks? Risky.
                 # try: self.ble.active(False); await uasyncio.sleep_ms(100); self.ble.active(True); DPRINT("Cycled BLE radio state.")
                 # except: DPRINT("Error cycling BLE radio state.")
                 return False
 
     async def stop_ble_advertising(self): # Async, uses lock
-        DPRINT("Board.stop_ble_adv (async)...")
+        __debug__ and _log.debug("Board.stop_ble_adv (async)...")
         is_active = False
         try: is_active = self.ble and self.ble.active()
         except: pass
-        if not is_active: DPRINT("BLE inactive/init."); self._ble_adv_active = False; return
-        if not self._ble_adv_active: DPRINT("Already stopped (per flag)."); return
+        if not is_active: __debug__ and _log.debug("BLE inactive/init."); self._ble_adv_active = False; return
+        if not self._ble_adv_active: __debug__ and _log.debug("Already stopped (per flag)."); return
 
         async with self.hw_lock: # Lock before stopping
-            if not self._ble_adv_active: DPRINT("Already stopped (checked lock)."); return # Re-check
+            if not self._ble_adv_active: __debug__ and _log.debug("Already stopped (checked lock)."); return # Re-check
             try:
                 self.ble.gap_advertise(None)
                 await uasyncio.sleep_ms(10) # Small delay after stopping
                 self._ble_adv_active = False # Update flag under lock
-                DPRINT("Advertising stopped.")
+                __debug__ and _log.debug("Advertising stopped.")
             except Exception as e:
                 self._ble_adv_active = False # Update flag under lock
-                DPRINT(f"ERROR stopping advertising: {e}")
+                _log.error("ERROR stopping advertising: %s", e)
 
     async def set_ble_name(self, new_name): # Async, calls other async methods
         new_name = new_name[:27]
-        DPRINT(f"Board.set_ble_name (async) to '{new_name}'")
+        __debug__ and _log.debug("Board.set_ble_name (async) to '%s'", new_name)
         was_advertising = self.ble_is_advertising # Read property (sync ok)
         if was_advertising:
             await self.stop_ble_advertising() # Call async stop (uses lock)
@@ -374,10 +702,10 @@ class Pico_board:
         self.ble_name = new_name # Setting string sync ok
 
         if was_advertising:
-            DPRINT("Board.set_ble_name: Restarting advertising...")
+            __debug__ and _log.debug("Board.set_ble_name: Restarting advertising...")
             return await self.start_ble_advertising() # Call async start (uses lock)
         else:
-            DPRINT("Board.set_ble_name: Name set, advertising remains off.")
+            __debug__ and _log.debug("Board.set_ble_name: Name set, advertising remains off.")
             return True
 
     # --- Add log message method ---
@@ -388,10 +716,3 @@ class Pico_board:
     #      # This method needs access to the html_out function from the controller
     #      # It's currently added dynamically in html_controler.__init__
     #      pass
-
-# --- Add Pin helper functions if needed ---
-# These need to be defined *inside* the Pico_pin class or passed self
-# Pico_pin.str_to_mode = lambda s: Pico_pin.MODE_OUT if s=='OUT' else Pico_pin.MODE_IN # Example
-# Pico_pin.str_to_pull = lambda s: Pico_pin.PULL_UP if s=='UP' else Pico_pin.PULL_DOWN if s=='DOWN' else Pico_pin.PULL_NONE
-# Pico_pin.mode_str_to_controller = lambda s, adc: Pico_pin.CTRL_ADC if s=='ADC' and adc else Pico_pin.CTRL_PWM if s=='PWM' else Pico_pin.CTRL_GPIO
-
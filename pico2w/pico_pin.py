@@ -1,5 +1,5 @@
 import machine
-import config
+import log
 import uasyncio # Added asyncio import
 
 try:
@@ -9,9 +9,7 @@ except ImportError:
     print("Pico_pin: Failed to import Pico_pwm. PWM functions will fail.")
     Pico_pwm = None # Define as None so checks don't crash
 
-def DPRINT(s):
-    if config.DEBUG:
-        print(s)
+_log = log.Logger("pico_pin")
 
 class Pico_pin:
     """
@@ -31,6 +29,8 @@ class Pico_pin:
     CTRL_PWM = "PWM"
     CTRL_NONE = "N/A" # For non-GPIO pins
 
+    IRQ_EDGES = machine.Pin.IRQ_RISING | machine.Pin.IRQ_FALLING
+
     def __init__(self, pin_id, name, board_lock, is_adc=False): # Pass the board's lock
         self._id = pin_id
         self.name = name
@@ -38,7 +38,11 @@ class Pico_pin:
         self.pwm_instance = None
         self._pull = self.PULL_NONE
         self._lock = board_lock # Store the shared lock
-        DPRINT(f"Pin: Initializing {self.name} (ID: {self._id})")
+        self.edge_ring = None # Input_edge_ring set by the board to track IN edges with Pin.irq
+        self._edge_handler = None # This pin's IRQ handler (created once, reused on re-register)
+        self._irq_on = False
+        self.last_edge_us = 0 # ticks_us() of the last edge applied to the cache
+        __debug__ and _log.debug("Pin: Initializing %s (ID: %s)", self.name, self._id)
 
         try:
             self._pin = machine.Pin(self._id)
@@ -48,7 +52,7 @@ class Pico_pin:
             self.controlled_by = self.CTRL_NONE
             self._mode = "N/A"
             self._value_cache = "N/A" # Use cache for non-GPIO
-            DPRINT(f"Pin: {self.name} is not a machine.Pin.")
+            __debug__ and _log.debug("Pin: %s is not a machine.Pin.", self.name)
             return
 
         # Initialize internal state defaults
@@ -58,7 +62,7 @@ class Pico_pin:
 
         # Perform initial setup synchronously without lock (only called once at startup)
         self._sync_init_internal(mode=self.MODE_IN, pull=self.PULL_NONE)
-        DPRINT(f"Pin: {self.name} sync init complete. Mode=IN, Pull=None")
+        __debug__ and _log.debug("Pin: %s sync init complete. Mode=IN, Pull=None", self.name)
 
     def _sync_init_internal(self, mode=None, pull=None, controller=CTRL_GPIO):
         """ Internal synchronous init ONLY for use in constructor. """
@@ -73,14 +77,14 @@ class Pico_pin:
                 try:
                     self._pin.init(mode=self.MODE_OUT)
                     self._pin.value(self._last_out_value)
-                except Exception as e: DPRINT(f"Pin _sync_init: Error setting OUT {self.name}: {e}")
+                except Exception as e: _log.error("Pin _sync_init: Error setting OUT %s: %s", self.name, e)
             else: # Default to IN
                 self._mode = "IN"
                 try:
                     self._pin.init(mode=self.MODE_IN, pull=self._pull)
                     self._value_cache = self._pin.value()
                 except Exception as e:
-                    DPRINT(f"Pin _sync_init: Error setting IN {self.name}: {e}")
+                    _log.error("Pin _sync_init: Error setting IN %s: %s", self.name, e)
                     self._value_cache = -1 # Indicate error
         elif controller == self.CTRL_ADC:
              self._mode = "ADC"
@@ -95,81 +99,87 @@ class Pico_pin:
                 self._pin.init(mode=self.MODE_IN, pull=self._pull)
                 self._value_cache = self._pin.value()
             except: self._value_cache = -1
+        self._update_edge_irq()
 
     async def init(self, mode=None, pull=None, controller=CTRL_GPIO):
         """ Initializes the pin mode, pull resistor, and controller asynchronously using lock. """
         if not self._pin: return
 
         async with self._lock: # Acquire lock before modifying pin state
-            DPRINT(f"Pin.init (async): {self.name} | Mode={mode}, Pull={pull}, Controller={controller}")
+            await self._init_locked(mode=mode, pull=pull, controller=controller)
+        # Lock released automatically here
 
-            # --- Release PWM if changing away ---
-            is_currently_pwm = (self.controlled_by == self.CTRL_PWM)
-            new_controller = controller
+    async def _init_locked(self, mode=None, pull=None, controller=CTRL_GPIO):
+        """ Internal: Same as init() but ASSUMES LOCK HELD (used by the board's pin worker). """
+        if not self._pin: return
+        __debug__ and _log.debug("Pin.init (async): %s | Mode=%s, Pull=%s, Controller=%s", self.name, mode, pull, controller)
 
-            if is_currently_pwm and new_controller != self.CTRL_PWM:
-                DPRINT(f"Pin.init: Releasing PWM from {self.name}")
-                if self.pwm_instance:
-                    try: self.pwm_instance.deinit()
-                    except Exception as e: DPRINT(f"Pin.init: Error deinit PWM: {e}")
-                    self.pwm_instance = None
+        # --- Release PWM if changing away ---
+        is_currently_pwm = (self.controlled_by == self.CTRL_PWM)
+        new_controller = controller
 
-            # --- Update internal state ---
-            self.controlled_by = new_controller
-            self._pull = pull if (mode == self.MODE_IN and self.controlled_by == self.CTRL_GPIO) else self.PULL_NONE
+        if is_currently_pwm and new_controller != self.CTRL_PWM:
+            __debug__ and _log.debug("Pin.init: Releasing PWM from %s", self.name)
+            if self.pwm_instance:
+                try: self.pwm_instance.deinit()
+                except Exception as e: _log.error("Pin.init: Error deinit PWM: %s", e)
+                self.pwm_instance = None
 
-            # --- Apply hardware changes based on new controller ---
-            try:
-                if self.controlled_by == self.CTRL_GPIO:
-                    if mode == self.MODE_OUT:
-                        self._mode = "OUT"
-                        self._pin.init(mode=self.MODE_OUT)
-                        self._pin.value(self._last_out_value) # Restore last value
-                        DPRINT(f"Pin.init: {self.name} set to GPIO OUT. Value={self._last_out_value}")
-                    else: # Default to IN
-                        self._mode = "IN"
-                        self._pin.init(mode=self.MODE_IN, pull=self._pull)
-                        await self._read_input_value_internal() # Read initial value async
-                        pull_str = self.pull_str # Use property
-                        DPRINT(f"Pin.init: {self.name} set to GPIO IN. Pull={pull_str}. Value={self._value_cache}")
-
-                elif self.controlled_by == self.CTRL_ADC:
-                    self._mode = "ADC"
-                    # We might need to ensure pin is input for ADC?
-                    # self._pin.init(mode=self.MODE_IN, pull=self.PULL_NONE)
-                    DPRINT(f"Pin.init: {self.name} set to ADC mode.")
-
-                elif self.controlled_by == self.CTRL_PWM:
-                    self._mode = "PWM"
-                    if Pico_pwm and self.pwm_instance is None:
-                        try:
-                            DPRINT(f"Pin.init: Creating PWM instance for {self.name}")
-                            # Pico_pwm.__init__ handles setting pin OUT
-                            self.pwm_instance = Pico_pwm(self._pin)
-                            DPRINT(f"Pin.init: {self.name} set to PWM mode.")
-                        except Exception as e:
-                            DPRINT(f"Pin.init: FAILED create PWM for {self.name}: {e}")
-                            # Fallback needed *within* lock
-                            self._mode = "IN"; self.controlled_by = self.CTRL_GPIO; self._pull = self.PULL_NONE
-                            self._pin.init(mode=self.MODE_IN, pull=self._pull); await self._read_input_value_internal()
-                            DPRINT(f"Pin.init: {self.name} fallback to GPIO IN after PWM fail.")
-                    elif not Pico_pwm:
-                         DPRINT(f"Pin.init: PWM class missing, cannot set {self.name} to PWM.")
-                         self._mode = "IN"; self.controlled_by = self.CTRL_GPIO; self._pull = self.PULL_NONE
-                         self._pin.init(mode=self.MODE_IN, pull=self._pull); await self._read_input_value_internal()
-                         DPRINT(f"Pin.init: {self.name} fallback to GPIO IN.")
-
-                else: # Fallback (shouldn't happen with proper controller strings)
-                    self._mode = "IN"; self.controlled_by = self.CTRL_GPIO; self._pull = self.PULL_NONE
-                    self._pin.init(mode=self.MODE_IN, pull=self._pull); await self._read_input_value_internal()
-                    DPRINT(f"Pin.init: {self.name} fallback to GPIO IN.")
+        # --- Update internal state ---
+        self.controlled_by = new_controller
+        self._pull = pull if (mode == self.MODE_IN and self.controlled_by == self.CTRL_GPIO) else self.PULL_NONE
 
-            except Exception as e:
-                 DPRINT(f"Pin.init: ERROR during hardware init for {self.name}: {e}")
-                 # Revert state? Or just log? Log for now.
-                 self._mode = "Error"; self.controlled_by = self.CTRL_NONE
+        # --- Apply hardware changes based on new controller ---
+        try:
+            if self.controlled_by == self.CTRL_GPIO:
+                if mode == self.MODE_OUT:
+                    self._mode = "OUT"
+                    self._pin.init(mode=self.MODE_OUT)
+                    self._pin.value(self._last_out_value) # Restore last value
+                    __debug__ and _log.debug("Pin.init: %s set to GPIO OUT. Value=%s", self.name, self._last_out_value)
+                else: # Default to IN
+                    self._mode = "IN"
+                    self._pin.init(mode=self.MODE_IN, pull=self._pull)
+                    await self._read_input_value_internal() # Read initial value async
+                    pull_str = self.pull_str # Use property
+                    __debug__ and _log.debug("Pin.init: %s set to GPIO IN. Pull=%s. Value=%s", self.name, pull_str, self._value_cache)
 
-        # Lock released automatically here
+            elif self.controlled_by == self.CTRL_ADC:
+                self._mode = "ADC"
+                # We might need to ensure pin is input for ADC?
+                # self._pin.init(mode=self.MODE_IN, pull=self.PULL_NONE)
+                __debug__ and _log.debug("Pin.init: %s set to ADC mode.", self.name)
+
+            elif self.controlled_by == self.CTRL_PWM:
+                self._mode = "PWM"
+                if Pico_pwm and self.pwm_instance is None:
+                    try:
+                        __debug__ and _log.debug("Pin.init: Creating PWM instance for %s", self.name)
+                        # Pico_pwm.__init__ handles setting pin OUT
+                        self.pwm_instance = Pico_pwm(self._pin)
+                        __debug__ and _log.debug("Pin.init: %s set to PWM mode.", self.name)
+                    except Exception as e:
+                        _log.error("Pin.init: FAILED create PWM for %s: %s", self.name, e)
+                        # Fallback needed *within* lock
+                        self._mode = "IN"; self.controlled_by = self.CTRL_GPIO; self._pull = self.PULL_NONE
+                        self._pin.init(mode=self.MODE_IN, pull=self._pull); await self._read_input_value_internal()
+                        __debug__ and _log.debug("Pin.init: %s fallback to GPIO IN after PWM fail.", self.name)
+                elif not Pico_pwm:
+                     _log.warning("Pin.init: PWM class missing, cannot set %s to PWM.", self.name)
+                     self._mode = "IN"; self.controlled_by = self.CTRL_GPIO; self._pull = self.PULL_NONE
+                     self._pin.init(mode=self.MODE_IN, pull=self._pull); await self._read_input_value_internal()
+                     __debug__ and _log.debug("Pin.init: %s fallback to GPIO IN.", self.name)
+
+            else: # Fallback (shouldn't happen with proper controller strings)
+                self._mode = "IN"; self.controlled_by = self.CTRL_GPIO; self._pull = self.PULL_NONE
+                self._pin.init(mode=self.MODE_IN, pull=self._pull); await self._read_input_value_internal()
+                __debug__ and _log.debug("Pin.init: %s fallback to GPIO IN.", self.name)
+
+        except Exception as e:
+             _log.error("Pin.init: ERROR during hardware init for %s: %s", self.name, e)
+             # Revert state? Or just log? Log for now.
+             self._mode = "Error"; self.controlled_by = self.CTRL_NONE
+        self._update_edge_irq()
 
     # --- Internal async read method (assumes lock is held) ---
     async def _read_input_value_internal(self):
@@ -179,7 +189,7 @@ class Pico_pin:
                 await uasyncio.sleep_ms(0) # Yield first
                 self._value_cache = self._pin.value()
             except Exception as e:
-                DPRINT(f"Pin._read_internal: Error reading {self.name}: {e}")
+                _log.error("Pin._read_internal: Error reading %s: %s", self.name, e)
                 self._value_cache = -1 # Indicate error
 
     # --- Public async read method (acquires lock) ---
@@ -188,6 +198,23 @@ class Pico_pin:
         async with self._lock:
             await self._read_input_value_internal()
 
+    # --- String helpers (used by the board's pin worker to decode queued actions) ---
+    @staticmethod
+    def str_to_mode(mode_str):
+        return Pico_pin.MODE_OUT if mode_str == 'OUT' else Pico_pin.MODE_IN
+
+    @staticmethod
+    def str_to_pull(pull_str):
+        if pull_str == 'UP': return Pico_pin.PULL_UP
+        if pull_str == 'DOWN': return Pico_pin.PULL_DOWN
+        return Pico_pin.PULL_NONE
+
+    @staticmethod
+    def mode_str_to_controller(mode_str, is_adc_capable):
+        if mode_str == 'ADC' and is_adc_capable: return Pico_pin.CTRL_ADC
+        if mode_str == 'PWM': return Pico_pin.CTRL_PWM
+        return Pico_pin.CTRL_GPIO
+
     # --- Properties (remain synchronous, read cached state) ---
     @property
     def mode(self): return self._mode
@@ -215,17 +242,77 @@ class Pico_pin:
         """ Async: Sets the pin's value (only if in GPIO OUT mode). Uses lock. """
         # Check mode synchronously before acquiring lock
         if not self._pin or self.controlled_by != self.CTRL_GPIO or self._mode != "OUT":
-            DPRINT(f"Pin.set_value_async: {self.name} | IGNORED (Not GPIO OUT)")
+            __debug__ and _log.debug("Pin.set_value_async: %s | IGNORED (Not GPIO OUT)", self.name)
             return
 
         async with self._lock: # Acquire lock before setting value
-            self._last_out_value = 1 if int(new_val) else 0
-            try:
-                await uasyncio.sleep_ms(0) # Yield first
-                self._pin.value(self._last_out_value)
-                DPRINT(f"Pin.set_value_async: {self.name} (OUT) -> {self._last_out_value}")
-            except Exception as e:
-                DPRINT(f"Pin.set_value_async: ERROR setting {self.name} value: {e}")
+            await self._set_value_locked(new_val)
+
+    @property
+    def is_gpio_in(self): return self._pin is not None and self.controlled_by == self.CTRL_GPIO and self._mode == "IN"
+
+    def _read_level_locked(self):
+        """ Internal: Sync hardware read for bulk scans (no yield, cache untouched). ASSUMES LOCK HELD. """
+        try: return self._pin.value()
+        except Exception as e:
+            _log.error("Pin._read_level_locked: Error reading %s: %s", self.name, e)
+            return -1
+
+    def _note_input_locked(self, level):
+        """ Internal: Records a level sampled by a bulk scan. ASSUMES LOCK HELD. """
+        self._value_cache = level
+
+    def _note_edge_locked(self, level, ticks):
+        """ Internal: Records a level reported by the edge IRQ at ticks_us() ticks. ASSUMES LOCK HELD. """
+        self._value_cache = level
+        self.last_edge_us = ticks
+
+    def _update_edge_irq(self):
+        """ Internal: Registers the edge IRQ while GPIO IN (and edge_ring is set), removes it otherwise. Sync. """
+        want = self.edge_ring is not None and self.is_gpio_in
+        if want == self._irq_on: return
+        try:
+            if want:
+                if self._edge_handler is None:
+                    self._edge_handler = self.edge_ring.handler(self._id)
+                self._pin.irq(handler=self._edge_handler, trigger=self.IRQ_EDGES, hard=True)
+            else:
+                self._pin.irq(handler=None)
+            self._irq_on = want
+            __debug__ and _log.debug("Pin: %s edge IRQ %s.", self.name, 'on' if want else 'off')
+        except Exception as e:
+            __debug__ and _log.debug("Pin._update_edge_irq: %s edge IRQ unavailable, left to scans: %s", self.name, e)
+
+    @property
+    def has_edge_irq(self): return self._irq_on
+
+    @property
+    def is_gpio_out(self): return self._pin is not None and self.controlled_by == self.CTRL_GPIO and self._mode == "OUT"
+
+    def _write_value_locked(self, new_val):
+        """ Internal: Sync, non-yielding value write for batches. ASSUMES LOCK HELD. False if not GPIO OUT. """
+        if not self.is_gpio_out: return False
+        self._last_out_value = 1 if int(new_val) else 0
+        try: self._pin.value(self._last_out_value)
+        except Exception as e: _log.error("Pin._write_value_locked: ERROR setting %s value: %s", self.name, e)
+        return True
+
+    def _note_value_locked(self, new_val):
+        """ Internal: Records a value already driven by a bulk SIO write. ASSUMES LOCK HELD. """
+        self._last_out_value = 1 if new_val else 0
+
+    async def _set_value_locked(self, new_val):
+        """ Internal: Same as set_value_async() but ASSUMES LOCK HELD (used by the board's pin worker). """
+        if not self._pin or self.controlled_by != self.CTRL_GPIO or self._mode != "OUT":
+            __debug__ and _log.debug("Pin._set_value_locked: %s | IGNORED (Not GPIO OUT)", self.name)
+            return
+        self._last_out_value = 1 if int(new_val) else 0
+        try:
+            await uasyncio.sleep_ms(0) # Yield first
+            self._pin.value(self._last_out_value)
+            __debug__ and _log.debug("Pin.set_value_async: %s (OUT) -> %s", self.name, self._last_out_value)
+        except Exception as e:
+            _log.error("Pin.set_value_async: ERROR setting %s value: %s", self.name, e)
 
     # --- Helpers become async ---
     async def on(self): await self.set_value_async(1)
@@ -1,9 +1,7 @@
 import machine
-import config
+import log
 
-def DPRINT(s):
-    if config.DEBUG:
-        print(s)
+_log = log.Logger("pico_pwm")
 
 class Pico_pwm:
     """
@@ -12,7 +10,7 @@ class Pico_pwm:
     """
 
     def __init__(self, machine_pin):
-        DPRINT(f"PWM: Initializing for Pin {machine_pin}")
+        __debug__ and _log.debug("PWM: Initializing for Pin %s", machine_pin)
         if not machine_pin:
             raise ValueError("Invalid machine.Pin object")
 
@@ -21,7 +19,7 @@ class Pico_pwm:
         try:
              self._pin_obj.init(mode=machine.Pin.OUT)
         except Exception as e:
-             DPRINT(f"PWM Init: Error setting pin {machine_pin} to OUT: {e}")
+             _log.error("PWM Init: Error setting pin %s to OUT: %s", machine_pin, e)
              # Decide how to handle this - raise error or try proceeding?
              # Raising error is safer.
              raise ValueError(f"Could not set pin {machine_pin} to OUT for PWM") from e
@@ -30,18 +28,19 @@ class Pico_pwm:
             self._pwm = machine.PWM(self._pin_obj)
         except ValueError as e:
             # Handle cases where PWM might not be available on the pin (shouldn't happen on Pico RP2040 GPIOs)
-            DPRINT(f"PWM Init: Error creating PWM on {machine_pin}: {e}")
+            _log.error("PWM Init: Error creating PWM on %s: %s", machine_pin, e)
             raise ValueError(f"Could not create PWM on pin {machine_pin}") from e
 
         self._freq = 1000 # Default 1 KHz
         self._duty_u16 = 0 # Default 0% duty cycle
+        self.effect = None # Pwm_effect driving this channel, set by Pwm_effects
 
         try:
             self._pwm.freq(self._freq)
             self._pwm.duty_u16(self._duty_u16)
-            DPRINT(f"PWM: Init OK. Freq={self._freq}, Duty={self._duty_u16}")
+            __debug__ and _log.debug("PWM: Init OK. Freq=%s, Duty=%s", self._freq, self._duty_u16)
         except Exception as e:
-             DPRINT(f"PWM Init: Error setting initial freq/duty: {e}")
+             _log.error("PWM Init: Error setting initial freq/duty: %s", e)
              # Clean up if init fails partially
              try: self._pwm.deinit()
              except: pass
@@ -63,9 +62,9 @@ class Pico_pwm:
             if val > 60_000_000: val = 60_000_000 # Cap at 60MHz? Datasheet implies higher possible.
             self._freq = val
             self._pwm.freq(self._freq)
-            DPRINT(f"PWM: Set Freq -> {self._freq}")
+            __debug__ and _log.debug("PWM: Set Freq -> %s", self._freq)
         except Exception as e:
-            DPRINT(f"PWM: Freq set error: {e}")
+            _log.warning("PWM: Freq set error: %s", e)
 
     @property
     def duty_u16(self):
@@ -83,7 +82,12 @@ class Pico_pwm:
             self._pwm.duty_u16(self._duty_u16)
             # DPRINT(f"PWM: Set Duty(u16) -> {self._duty_u16}") # Reduce noise
         except Exception as e:
-            DPRINT(f"PWM: Duty(u16) set error: {e}")
+            _log.warning("PWM: Duty(u16) set error: %s", e)
+
+    def write_duty_u16(self, value):
+        """ Fast path for Pwm_effects' timer IRQ: value already 0-65535, no checks, no allocation. """
+        self._duty_u16 = value
+        self._pwm.duty_u16(value)
 
     @property
     def duty_percent(self):
@@ -100,12 +104,12 @@ class Pico_pwm:
             self.duty_u16 = int((p / 100.0) * 65535)
             # DPRINT(f"PWM: Set Duty(%) -> {p}% (raw: {self.duty_u16})") # Reduce noise
         except Exception as e:
-            DPRINT(f"PWM: Duty(%) set error: {e}")
+            _log.warning("PWM: Duty(%%) set error: %s", e)
 
     def deinit(self):
         """De-initializes the PWM, releasing the pin."""
-        DPRINT(f"PWM: De-initializing for Pin {self._pin_obj}")
+        __debug__ and _log.debug("PWM: De-initializing for Pin %s", self._pin_obj)
         try:
             self._pwm.deinit()
         except Exception as e:
-            DPRINT(f"PWM: Error during deinit: {e}")
\ No newline at end of file
+            _log.error("PWM: Error during deinit: %s", e)
\ No newline at end of file
@@ -0,0 +1,93 @@
+# pin_action_queue.py
+import log
+import uasyncio
+
+_log = log.Logger("pin_action_queue")
+
+class QueueFull(Exception):
+    pass
+
+class Pin_action_queue:
+    """
+    Pending pin actions for the board worker, coalesced by (pin, action type).
+    A newer 'value' or 'pwm' request replaces a pending one for the same pin
+    (last writer wins), and a newer 'mode' replaces a pending mode if nothing
+    else was queued for that pin after it. Ordering is otherwise kept: a mode
+    change (or a batch touching the pin) is a barrier, so a write queued after
+    it is never merged into one queued before it. PWM effect starts/stops
+    are barriers for their pins in the same way.
+    """
+    # Index key = pin_id * 4 + code
+    CODES = {'value': 0, 'pwm': 1, 'mode': 2}
+
+    def __init__(self, maxsize=30):
+        self.maxsize = maxsize
+        self._cells = [] # FIFO of [action] cells (a cell is updated in place when coalescing)
+        self._index = {} # key -> pending cell that later requests may merge into
+        self._event = uasyncio.Event()
+        self.coalesced = 0 # Requests merged into a pending action instead of queued
+
+    def __len__(self):
+        return len(self._cells)
+
+    def empty(self):
+        return not self._cells
+
+    def _unlink(self, pin_id, *types):
+        base = pin_id * 4
+        for action_type in types:
+            self._index.pop(base + self.CODES[action_type], None)
+
+    def put_nowait(self, action):
+        """
+        Queues action ('mode'|'value'|'pwm', pin_id, ...), ('batch', None, [actions])
+        or ('effect', None, Pwm_effect).
+        Returns True if it was merged into a pending action. Raises QueueFull.
+        """
+        action_type, pin_id = action[0], action[1]
+        if pin_id is None:
+            self._append(action, None)
+            pin_ids = action[2].pin_ids if action_type == 'effect' else [sub[1] for sub in action[2]]
+            for barrier_pin in pin_ids: # Nothing queued later may merge across it
+                self._unlink(barrier_pin, 'value', 'pwm', 'mode')
+            return False
+
+        key = pin_id * 4 + self.CODES[action_type]
+        cell = self._index.get(key)
+        if cell is not None:
+            if action_type == 'pwm': # Keep the pending freq/duty that this request leaves unset
+                old = cell[0]
+                action = ('pwm', pin_id, old[2] if action[2] is None else action[2], old[3] if action[3] is None else action[3])
+            cell[0] = action
+            self.coalesced += 1
+            __debug__ and _log.debug("PinQueue: Coalesced %s for pin %s (%s total).", action_type, pin_id, self.coalesced)
+            return True
+
+        self._append(action, key)
+        if action_type == 'mode':
+            self._unlink(pin_id, 'value', 'pwm') # Later writes must land after the mode change
+        else:
+            self._unlink(pin_id, 'mode') # A later mode must land after this write
+        return False
+
+    def _append(self, action, key):
+        if self.maxsize and len(self._cells) >= self.maxsize:
+            raise QueueFull()
+        cell = [action]
+        self._cells.append(cell)
+        if key is not None:
+            self._index[key] = cell
+        self._event.set()
+
+    async def get(self):
+        """ Waits for and removes the oldest pending action (its latest coalesced form). """
+        while not self._cells:
+            self._event.clear()
+            await self._event.wait()
+        cell = self._cells.pop(0)
+        action = cell[0]
+        if action[1] is not None: # Not a batch/effect barrier
+            key = action[1] * 4 + self.CODES[action[0]]
+            if self._index.get(key) is cell:
+                del self._index[key] # Being applied now, later requests queue behind it
+        return action
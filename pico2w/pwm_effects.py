@@ -0,0 +1,200 @@
+# pwm_effects.py
+import array
+import math
+import machine
+import log
+import uasyncio
+from micropython import const
+
+_log = log.Logger("pwm_effects")
+
+TICK_MS = const(10) # Effect clock period: every running table advances on this tick (100 Hz)
+MAX_STEPS = const(256) # Longest duty table per channel; longer effects hold each entry for several ticks
+
+# Easing curves t -> 0..1 for t in 0..1 (only used while building tables)
+EASINGS = {
+    "linear": lambda t: t,
+    "in": lambda t: t * t,
+    "out": lambda t: t * (2 - t),
+    "inout": lambda t: t * t * (3 - 2 * t),
+    "sine": lambda t: (1 - math.cos(math.pi * t)) / 2,
+}
+
+def percent_to_u16(percent):
+    """ Duty percent (clamped to 0-100) -> 0-65535. Raises ValueError. """
+    p = float(percent)
+    if p != p: raise ValueError("duty is NaN")
+    return int(min(max(p, 0.0), 100.0) * 65535 / 100)
+
+class Pwm_effect:
+    """
+    One animation over one or more PWM pins, stepped in lockstep:
+      'fade'    each pin from its current duty to its own target over ms, once (eased)
+      'breathe' all pins low -> peak -> low every ms, 'cycles' times (0 = until stopped)
+      'strobe'  all pins peak/low at 1000/ms Hz, 'cycles' flashes (0 = until stopped)
+      'stop'    stops whatever runs on the pins, leaving their current duty
+    Created from request parameters (validated here, raises ValueError), then
+    built by the board worker, which knows the current duties: build() fills
+    one duty table per channel so the timer only indexes and writes.
+    """
+    KINDS = ("fade", "breathe", "strobe", "stop")
+
+    def __init__(self, kind, pin_ids, duties=(), ms=0, easing="linear", low=0, cycles=1):
+        if kind not in self.KINDS: raise ValueError(f"Unknown effect '{kind}'")
+        if easing not in EASINGS: raise ValueError(f"Easing must be one of {', '.join(EASINGS)}")
+        if not pin_ids or len(set(pin_ids)) != len(pin_ids): raise ValueError("Pin list empty or repeated")
+        if kind == "fade" and len(duties) != len(pin_ids): raise ValueError("Fade needs one duty per pin")
+        if not 0 <= ms <= 3_600_000: raise ValueError("Duration out of range")
+        if kind == "strobe" and ms < 2 * TICK_MS: raise ValueError(f"Strobe is limited to {1000 // (2 * TICK_MS)} Hz")
+        if not 0 <= cycles <= 1_000_000: raise ValueError("Cycles out of range")
+        self.kind = kind
+        self.pin_ids = pin_ids
+        self.duties = duties # u16: fade targets (one per pin), breathe/strobe peak (first entry)
+        self.ms = ms
+        self.easing = easing
+        self.low = low # u16 floor for breathe/strobe
+        self.loops = cycles if kind != "fade" else 1 # Table passes left; 0 = forever
+        # Filled by build() / Pwm_effects (read by the timer IRQ)
+        self.channels = ()
+        self.tables = ()
+        self.steps = 1
+        self.hold = 1 # Ticks per table entry
+        self.index = 0
+        self.left = 1 # Ticks until the next entry
+        self.done = False
+
+    def build(self, channels):
+        """ Precomputes the duty tables for channels (Pico_pwm, in pin_ids order). """
+        self.channels = channels
+        ticks = max(1, self.ms // TICK_MS)
+        if self.kind == "strobe":
+            self.hold = max(1, ticks // 2)
+            self.steps = 2
+            table = array.array('H', (self.duties[0], self.low))
+            self.tables = [table] * len(channels) # Shared: same on every pin
+            return
+        hold = (ticks + MAX_STEPS - 1) // MAX_STEPS
+        steps = (ticks + hold - 1) // hold
+        self.hold = hold
+        self.steps = steps
+        if self.kind == "fade":
+            curve = EASINGS[self.easing]
+            tables = []
+            for ch, target in zip(channels, self.duties):
+                start = ch.duty_u16
+                span = target - start
+                tables.append(array.array('H', (start + int(span * curve((i + 1) / steps)) for i in range(steps))))
+            self.tables = tables
+        else: # breathe: raised cosine, ends back at low so passes join seamlessly
+            low = self.low
+            span = self.duties[0] - low
+            table = array.array('H', (low + int(span * (1 - math.cos(2 * math.pi * (i + 1) / steps)) / 2) for i in range(steps)))
+            self.tables = [table] * len(channels)
+
+    def write(self, i):
+        """ Writes entry i of every table. Called from the timer IRQ: no allocation. """
+        tables = self.tables
+        channels = self.channels
+        for k in range(len(channels)):
+            channels[k].write_duty_u16(tables[k][i])
+
+class Pwm_effects:
+    """
+    Steps running Pwm_effect tables from one periodic machine.Timer
+    (hard IRQ where the port allows it), so output timing doesn't depend
+    on the event loop, Wi-Fi or GC. The timer only runs while an effect
+    does. The running set is a tuple that is replaced, never mutated, so
+    the IRQ always sees a consistent one. Finished effects are flagged
+    (ThreadSafeFlag) for the board's async reaper, which updates state.
+    """
+    HARD_IRQ = True
+
+    def __init__(self):
+        self._active = () # Running Pwm_effects
+        self.flag = uasyncio.ThreadSafeFlag() # Set by the IRQ when an effect finishes
+        self._timer = None
+        self._task = None # Fallback ticker when no machine.Timer is available
+        self._tick_cb = self._tick # Bound once, handed to the timer
+        # Counters (for /api/metrics)
+        self.started = 0
+        self.finished = 0
+
+    def __len__(self):
+        return len(self._active)
+
+    def _tick(self, _timer):
+        """ Timer callback: advances every running effect. No allocation (hard IRQ safe). """
+        for fx in self._active:
+            if fx.done: continue
+            fx.left -= 1
+            if fx.left > 0: continue
+            fx.left = fx.hold
+            i = fx.index + 1
+            if i >= fx.steps:
+                if fx.loops == 1:
+                    fx.done = True
+                    self.flag.set()
+                    continue
+                if fx.loops: fx.loops -= 1
+                i = 0
+            fx.index = i
+            fx.write(i)
+
+    def start(self, fx):
+        """ Starts a built effect, replacing any effect on the same pins. ASSUMES hw_lock HELD. """
+        self.stop_pins(fx.pin_ids)
+        fx.index = 0
+        fx.left = fx.hold
+        fx.done = False
+        fx.write(0)
+        for ch in fx.channels: ch.effect = fx
+        self._active = self._active + (fx,)
+        self.started += 1
+        self._start_clock()
+        __debug__ and _log.debug("Effects: '%s' on pins %s, %s step(s) x %s tick(s), loops %s.", fx.kind, fx.pin_ids, fx.steps, fx.hold, fx.loops)
+
+    def stop_pins(self, pin_ids):
+        """ Stops effects driving any of pin_ids (a whole multi-pin effect stops). Returns them. """
+        if not self._active: return ()
+        stopped = [fx for fx in self._active if any(p in fx.pin_ids for p in pin_ids)]
+        if stopped: self._remove(stopped)
+        return stopped
+
+    def reap(self):
+        """ Removes and returns the effects that ran to completion. """
+        finished = [fx for fx in self._active if fx.done]
+        if finished:
+            self._remove(finished)
+            self.finished += len(finished)
+        return finished
+
+    def _remove(self, effects):
+        self._active = tuple(fx for fx in self._active if fx not in effects)
+        for fx in effects:
+            for ch in fx.channels:
+                if ch.effect is fx: ch.effect = None
+        if not self._active: self._stop_clock()
+
+    def _start_clock(self):
+        if self._timer or self._task: return
+        try:
+            try:
+                self._timer = machine.Timer(mode=machine.Timer.PERIODIC, period=TICK_MS, callback=self._tick_cb, hard=self.HARD_IRQ)
+            except TypeError: # Port without hard= (callback is scheduled)
+                self._timer = machine.Timer(mode=machine.Timer.PERIODIC, period=TICK_MS, callback=self._tick_cb)
+        except Exception as e:
+            _log.warning("Effects: No machine.Timer (%s), stepping from a task.", e)
+            self._task = uasyncio.create_task(self._tick_loop())
+
+    def _stop_clock(self):
+        if self._timer:
+            self._timer.deinit()
+            self._timer = None
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _tick_loop(self):
+        while True:
+            await uasyncio.sleep_ms(TICK_MS)
+            self._tick(None)
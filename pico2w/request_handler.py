@@ -1,47 +1,67 @@
 # request_handler.py
-import config
+import log
+import ujson
 import uasyncio # Still need for async BLE/WiFi handlers
+import utime
 
-def DPRINT(s):
-    if config.DEBUG: print(s)
+try:
+    from pwm_effects import Pwm_effect, percent_to_u16
+except ImportError:
+    print("Request_handler: Failed to import Pwm_effect. PWM effects unavailable.")
+    Pwm_effect = None
+
+_log = log.Logger("request_handler")
 
 class Request_handler:
     """ Parses URLs, queues sync pin actions, calls async BLE/WiFi methods. """
+    MAX_BATCH_OPS = 32 # Largest POST /pin/batch accepted
+    BATCH_MODES = ("IN", "OUT", "ADC", "PWM")
+    BATCH_PULLS = ("NONE", "UP", "DOWN")
     def __init__(self, board):
         self.board = board
-        # Map URL components to handler methods
+        # Map URL components to (handler method, is_async); sync/async is fixed here, not checked per request
         self.action_map = {
             # Object: pin (Sync handlers - queue actions)
             "pin": {
-                "mode": self.handle_pin_mode,    # Sync
-                "value": self.handle_pin_value,  # Sync
-                "pull": self.handle_pin_pull     # Sync
+                "mode": (self.handle_pin_mode, False),
+                "value": (self.handle_pin_value, False),
+                "pull": (self.handle_pin_pull, False)
             },
-            # Object: pwm (Sync handler - queue action)
+            # Object: pwm (Sync handlers - queue actions; effects run on the board's timer)
             "pwm": {
-                 "set": self.handle_pwm_set      # Sync
+                 "set": (self.handle_pwm_set, False),
+                 "fade": (self.handle_pwm_fade, False),
+                 "breathe": (self.handle_pwm_breathe, False),
+                 "strobe": (self.handle_pwm_strobe, False),
+                 "stop": (self.handle_pwm_stop, False)
             },
             # Object: ble (Async handlers - await board methods)
             "ble": {
-                "start": self.handle_ble_start,  # Async
-                "stop": self.handle_ble_stop,    # Async
-                "set_name": self.handle_ble_set_name # Async
+                "start": (self.handle_ble_start, True),
+                "stop": (self.handle_ble_stop, True),
+                "set_name": (self.handle_ble_set_name, True)
             },
             # Object: wifi (Async handler - await board method)
             "wifi": {
-                "connect": self.handle_wifi_connect # Async
+                "connect": (self.handle_wifi_connect, True)
             },
             # Object: console (Sync handler - logs via board)
             "console": {
-                 "command": self.handle_console_command # Sync
+                 "command": (self.handle_console_command, False)
             }
             # Add control handlers if needed (e.g., load/free templates)
-            # "control": { "load_templates": self.handle_load_templates ... }
+            # "control": { "load_templates": (self.handle_load_templates, False) ... }
         }
+        # Append each entry's latency histogram slot: (handler method, is_async, metrics slot)
+        metrics = board.metrics
+        for obj_name, methods in self.action_map.items():
+            for method_name, (handler_method, is_async) in methods.items():
+                slot = metrics.histogram(b'pico_handler_duration_seconds', b'Request_handler action time', b'action="%s/%s"' % (obj_name.encode(), method_name.encode()))
+                methods[method_name] = (handler_method, is_async, slot)
 
     async def handle_request(self, path): # Handler itself remains async
         """ Async: Parses path, calls sync or async handler, returns dict. """
-        DPRINT(f"Handler: Processing path '{path}'")
+        __debug__ and _log.debug("Handler: Processing path '%s'", path)
         parts = path.strip('/').split('/')
 
         # Handle different path structures
@@ -65,22 +85,25 @@ class Request_handler:
              return {"status": "error", "message": "Invalid path format"}
 
 
-        if obj_name not in self.action_map or method_name not in self.action_map[obj_name]:
+        methods = self.action_map.get(obj_name)
+        entry = methods.get(method_name) if methods else None
+        if entry is None:
             return {"status": "error", "message": f"Unknown object/method '{obj_name}/{method_name}'"}
 
-        handler_method = self.action_map[obj_name][method_name]
+        handler_method, is_async, metrics_slot = entry
 
+        t0 = utime.ticks_us()
         try:
-            # Check if handler is async or sync using iscoroutinefunction
-            if uasyncio.iscoroutinefunction(handler_method):
-                DPRINT(f"Handler: Awaiting async method {handler_method.__name__}...")
+            if is_async:
+                __debug__ and _log.debug("Handler: Awaiting async method %s...", handler_method.__name__)
                 success, message = await handler_method(args) # Use await for async handlers
             else:
-                DPRINT(f"Handler: Calling sync method {handler_method.__name__}...")
+                __debug__ and _log.debug("Handler: Calling sync method %s...", handler_method.__name__)
                 success, message = handler_method(args) # Call sync handlers directly
+            self.board.metrics.observe(metrics_slot, utime.ticks_diff(utime.ticks_us(), t0))
             return {"status": "success" if success else "error", "message": message}
         except Exception as e:
-            DPRINT(f"Handler: Exception during handling {path}: {e}")
+            _log.error("Handler: Exception during handling %s: %s", path, e)
             import sys; sys.print_exception(e)
             return {"status": "error", "message": f"Internal error: {e}"}
 
@@ -126,6 +149,110 @@ class Request_handler:
             return self.board.set_pwm_params(pin_id, freq=freq, duty_pc=duty_pc)
          except (ValueError, TypeError): return False, "Invalid pin ID, freq, or duty format"
 
+    # --- PWM Effect Handlers (Synchronous - one request per animation, queued like pin actions) ---
+    def _effect_pins(self, text):
+        """ '13,14,15' -> (13, 14, 15). Raises ValueError unless every id is a modelled GPIO. """
+        pin_ids = tuple(int(p) for p in text.split(','))
+        for pin_id in pin_ids:
+            if not self.board.get_pin_by_id(pin_id): raise ValueError(f"Pin {pin_id} not found")
+        return pin_ids
+
+    def _queue_effect(self, kind, usage, args, min_args, max_args, make):
+        """ Validates arg count, builds the Pwm_effect with make(args) and queues it. """
+        if Pwm_effect is None: return False, "PWM effects unavailable."
+        if not min_args <= len(args) <= max_args: return False, usage
+        try:
+            effect = make(args)
+        except (ValueError, TypeError, IndexError) as e:
+            return False, f"Invalid {kind} parameters: {e}"
+        return self.board.queue_pwm_effect(effect)
+
+    def handle_pwm_fade(self, args):
+        """
+        Sync: Fades pins from their current duty, all in step. Several pins
+        make a colour transition (e.g. RGB channels to new duties).
+        Usage: /pwm/fade/<id[,id...]>/<duty_pc[,duty_pc...]>/<ms>[/<easing>]
+        """
+        def make(args):
+            pin_ids = self._effect_pins(args[0])
+            duties = [percent_to_u16(d) for d in args[1].split(',')]
+            if len(duties) == 1: duties = duties * len(pin_ids) # One duty for every pin
+            return Pwm_effect("fade", pin_ids, duties, ms=int(args[2]), easing=args[3] if len(args) > 3 else "linear")
+        return self._queue_effect("fade", "Usage: /pwm/fade/<id[,id...]>/<duty_pc[,duty_pc...]>/<ms>[/<linear|in|out|inout|sine>]", args, 3, 4, make)
+
+    def handle_pwm_breathe(self, args):
+        """ Sync: Breathes pins between min and max duty. Usage: /pwm/breathe/<id[,id...]>/<period_ms>[/<max_pc>[/<min_pc>[/<cycles, 0 = forever>]]] """
+        def make(args):
+            peak = percent_to_u16(args[2]) if len(args) > 2 else 65535
+            low = percent_to_u16(args[3]) if len(args) > 3 else 0
+            return Pwm_effect("breathe", self._effect_pins(args[0]), (peak,), ms=int(args[1]), low=low, cycles=int(args[4]) if len(args) > 4 else 0)
+        return self._queue_effect("breathe", "Usage: /pwm/breathe/<id[,id...]>/<period_ms>[/<max_pc>[/<min_pc>[/<cycles>]]]", args, 2, 5, make)
+
+    def handle_pwm_strobe(self, args):
+        """ Sync: Flashes pins between duty and 0. Usage: /pwm/strobe/<id[,id...]>/<hz>[/<duty_pc>[/<flashes, 0 = forever>]] """
+        def make(args):
+            hz = float(args[1])
+            if not hz > 0: raise ValueError("hz must be > 0")
+            peak = percent_to_u16(args[2]) if len(args) > 2 else 65535
+            return Pwm_effect("strobe", self._effect_pins(args[0]), (peak,), ms=int(1000 / hz), cycles=int(args[3]) if len(args) > 3 else 0)
+        return self._queue_effect("strobe", "Usage: /pwm/strobe/<id[,id...]>/<hz>[/<duty_pc>[/<flashes>]]", args, 2, 4, make)
+
+    def handle_pwm_stop(self, args):
+        """ Sync: Stops effects on pins, leaving their current duty. Usage: /pwm/stop/<id[,id...]> """
+        return self._queue_effect("stop", "Usage: /pwm/stop/<id[,id...]>", args, 1, 1, lambda args: Pwm_effect("stop", self._effect_pins(args[0])))
+
+    # --- Batch pin operations (POST /pin/batch) ---
+    def parse_pin_batch(self, body):
+        """
+        Sync: Validates a JSON list of operations and converts it to board actions.
+        Each item is one of:
+            {"op": "mode", "pin": 13, "mode": "OUT"}       ("pull": "UP" optional with IN)
+            {"op": "value", "pin": 13, "value": 1}
+            {"op": "pwm", "pin": 15, "freq": 1000, "duty": 50}   (freq and/or duty)
+        Returns (actions, None) or (None, error message). Nothing is queued on error.
+        """
+        try: ops = ujson.loads(body)
+        except ValueError: return None, "Body is not valid JSON"
+        if not isinstance(ops, list) or not ops: return None, "Body must be a non-empty JSON list"
+        return self.parse_pin_ops(ops)
+
+    def parse_pin_ops(self, ops):
+        """ Sync: Validates a decoded list of batch operations (also used for rule actions). Returns (actions, None) or (None, error). """
+        if not isinstance(ops, list): return None, "Operations must be a JSON list"
+        if len(ops) > self.MAX_BATCH_OPS: return None, f"Too many operations (max {self.MAX_BATCH_OPS})"
+
+        actions = []
+        for i, op in enumerate(ops):
+            if not isinstance(op, dict): return None, f"Op {i}: must be an object"
+            pin_id = op.get("pin")
+            if type(pin_id) is not int or self.board.get_pin_by_id(pin_id) is None:
+                return None, f"Op {i}: unknown pin {pin_id}"
+            kind = op.get("op")
+            if kind == "mode":
+                mode_str = str(op.get("mode", "")).upper()
+                pull_str = op.get("pull")
+                if mode_str not in self.BATCH_MODES: return None, f"Op {i}: mode must be one of {self.BATCH_MODES}"
+                if mode_str == "ADC" and not self.board.get_pin_by_id(pin_id).is_adc_capable:
+                    return None, f"Op {i}: pin {pin_id} is not ADC capable"
+                if pull_str is not None:
+                    pull_str = str(pull_str).upper()
+                    if pull_str not in self.BATCH_PULLS: return None, f"Op {i}: pull must be one of {self.BATCH_PULLS}"
+                actions.append(('mode', pin_id, mode_str, pull_str))
+            elif kind == "value":
+                value = op.get("value")
+                if value not in (0, 1): return None, f"Op {i}: value must be 0 or 1"
+                actions.append(('value', pin_id, 1 if value else 0))
+            elif kind == "pwm":
+                freq = op.get("freq")
+                duty = op.get("duty")
+                if freq is None and duty is None: return None, f"Op {i}: pwm needs freq and/or duty"
+                if freq is not None and (type(freq) is not int or freq <= 0): return None, f"Op {i}: freq must be a positive integer"
+                if duty is not None and (type(duty) not in (int, float) or not 0 <= duty <= 100): return None, f"Op {i}: duty must be 0-100"
+                actions.append(('pwm', pin_id, freq, None if duty is None else float(duty)))
+            else:
+                return None, f"Op {i}: op must be 'mode', 'value' or 'pwm'"
+        return actions, None
+
     # --- BLE/WiFi Handlers (Asynchronous - Await Board Methods) ---
 
     async def handle_ble_start(self, args):
@@ -150,17 +277,17 @@ class Request_handler:
         # NOTE: Still insecure
         if len(args) != 2: return False, "Usage: /wifi/connect/<ssid>/<password>"
         ssid = args[0]; password = args[1]
-        DPRINT(f"Handler: Wi-Fi connect API call for SSID '{ssid}'")
+        __debug__ and _log.debug("Handler: Wi-Fi connect API call for SSID '%s'", ssid)
         success = await self.board.connect_wifi(ssid, password)
-        # Device resets on success, response might not be seen
-        return success, "Wi-Fi connect initiated (device may reset)." if success else "Wi-Fi connect failed."
+        # The link drops while rejoining, so this response may not reach the client
+        return success, f"Wi-Fi connected to '{ssid}'." if success else "Wi-Fi connect failed (still retrying in the background)."
 
     # --- Console Command Handler (Synchronous) ---
     def handle_console_command(self, args):
          """ Sync: Handles /console/command/<command_text> """
          if not args: return False, "No command provided."
          command_text = args[0] # Command is the first part after /console/command/
-         DPRINT(f"Handler: Received console command '{command_text}'")
+         __debug__ and _log.debug("Handler: Received console command '%s'", command_text)
          # Use the log_message method added to the board instance
          if hasattr(self.board, 'log_message'):
              self.board.log_message(f"> {command_text}", 'input') # Log the command
@@ -181,11 +308,8 @@ class Request_handler:
              elif command_text.lower() == 'led_off':
                   return self.board.set_pin_value(25, 0)
              elif command_text.lower() == 'red':
-                   # Queue multiple actions? Or specific command?
-                   # Simple: queue individual actions
-                   self.board.set_pin_value(13, 1)
-                   self.board.set_pin_value(14, 0)
-                   self.board.set_pin_value(15, 0)
+                   # One batch so all three channels change together
+                   self.board.queue_pin_batch([('value', 13, 1), ('value', 14, 0), ('value', 15, 0)])
                    self.board.log_message("RGB Red requested.", 'status')
              # Add green, blue, rgb_off similarly...
              else:
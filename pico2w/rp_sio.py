@@ -0,0 +1,58 @@
+# rp_sio.py
+import log
+import sys
+import machine
+from micropython import const
+
+_log = log.Logger("rp_sio")
+
+SIO_BASE = const(0xd0000000)
+BANK0_MASK = const(0x3fffffff) # GP0..GP29
+# GP23/24/25/29 are wired to the CYW43 radio on Pico W / Pico 2 W (GP25 is its SPI CS, not the LED).
+# They are never written through SIO; those pins fall back to machine.Pin.
+WIRELESS_PIN_MASK = const(0x23800000)
+
+class Rp_sio:
+    """
+    Direct access to the single-cycle IO (SIO) GPIO registers on RP2040 and
+    RP2350, so several output pins can change in one register write and all
+    input levels can be sampled in one read.
+    available is False on other ports/chips (callers then use machine.Pin).
+    """
+    # Register offsets per chip: (GPIO_IN, GPIO_OUT, GPIO_OUT_XOR)
+    REGS = {
+        "RP2040": (0x004, 0x010, 0x01c),
+        "RP2350": (0x004, 0x010, 0x028),
+    }
+
+    def __init__(self):
+        self.chip = None
+        self.available = False
+        self.safe_mask = BANK0_MASK & ~WIRELESS_PIN_MASK
+        self._mem32 = getattr(machine, 'mem32', None)
+        machine_name = getattr(sys.implementation, '_machine', '')
+        for chip, offsets in self.REGS.items():
+            if chip in machine_name:
+                self.chip = chip
+                self._in_addr = SIO_BASE + offsets[0]
+                self._out_addr = SIO_BASE + offsets[1]
+                self._xor_addr = SIO_BASE + offsets[2]
+                break
+        self.available = self.chip is not None and self._mem32 is not None
+        __debug__ and _log.debug("SIO: chip=%s, direct register access %s.", self.chip, 'enabled' if self.available else 'unavailable')
+
+    def write_out(self, mask, bits):
+        """
+        Drives every GPIO in mask to its bit in bits with one GPIO_OUT_XOR
+        write (only the pins that differ are toggled). Pins outside safe_mask
+        are ignored. Caller holds the board's hw_lock.
+        """
+        mask &= self.safe_mask
+        if not mask: return
+        toggle = (self._mem32[self._out_addr] ^ bits) & mask
+        if toggle:
+            self._mem32[self._xor_addr] = toggle
+
+    def read_in(self):
+        """ Returns the GPIO_IN register (input levels of GP0..GP29) in one read. """
+        return self._mem32[self._in_addr] & BANK0_MASK
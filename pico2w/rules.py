@@ -0,0 +1,256 @@
+# rules.py
+import array
+import ujson
+import utime
+import uasyncio
+import log
+from micropython import const
+
+_log = log.Logger("rules")
+
+# Sample slots: one per source, indexed from the predicate table
+ADC_SLOT = const(30) # 0..29 are GPIO numbers, then adc0..adc2
+TEMP_SLOT = const(33)
+NUM_SLOTS = const(34)
+NOT_A_LEVEL = -1.0 # Sample of a pin that isn't GPIO IN/OUT: no term on it matches
+
+OPS = ("<", "<=", ">", ">=", "==", "!=") # Index = op code in the predicate table
+
+class Rule_engine:
+    """
+    On-board control rules, so sensor reactions don't round-trip through a
+    browser. Uploaded as JSON (POST /api/rules, saved to RULES_FILE and
+    reloaded at boot):
+        {"rate_hz": 20, "rules": [
+          {"name": "fan", "if": [{"src": "adc0", "op": ">", "value": 1.5}],
+           "for_ms": 0, "every_ms": 0,
+           "then": [{"op": "value", "pin": 13, "value": 1}],
+           "else": [{"op": "value", "pin": 13, "value": 0}]}]}
+    Sources: "gp<N>" (level 0/1 of a GPIO IN/OUT pin), "adc0".."adc2"
+    (volts), "temp" (deg C). Terms are ANDed (none: always true). 'then'
+    fires once the terms have held for for_ms, and again every every_ms
+    while they hold (0: once); 'else' fires when they stop holding after
+    'then' fired. Actions are /pin/batch operations, queued as one batch
+    on the board's pin action queue.
+    Uploads are compiled once into flat arrays (one row per term) that
+    run() walks every 1/rate_hz s, sampling each used source once per pass.
+    """
+    RULES_FILE = "rules.json"
+    DEFAULT_RATE_HZ = 20
+    MAX_RATE_HZ = 200
+    MAX_RULES = 16
+    MAX_TERMS = 64 # All rules together
+
+    def __init__(self, board):
+        self.board = board
+        self.rate_hz = self.DEFAULT_RATE_HZ
+        self.names = []
+        self._count = 0 # Rules loaded (0: run() idles)
+        self._loaded = uasyncio.Event() # Set while rules are loaded
+        self._samples = array.array('f', bytes(4 * NUM_SLOTS))
+        self._used = b'' # Slots sampled each pass
+        self._compile([]) # Empty tables
+        # Counters (for /api/metrics)
+        self.passes = 0
+        self.fires = 0
+        self.dropped = 0 # Fires whose actions didn't fit in the pin queue
+        m = board.metrics
+        self._eval_hist = m.histogram(b'pico_rule_eval_duration_seconds', b'Time for one pass over all rules')
+        m.gauge(b'pico_rules_loaded', b'Rules loaded', lambda: self._count)
+        m.gauge(b'pico_rule_passes_total', b'Rule evaluation passes', lambda: self.passes, kind=b'counter')
+        m.gauge(b'pico_rule_fires_total', b'Rule then/else action sets queued', lambda: self.fires, kind=b'counter')
+        m.gauge(b'pico_rule_fires_dropped_total', b'Rule action sets refused by a full pin queue', lambda: self.dropped, kind=b'counter')
+
+    # --- Compile ---
+    def load(self, spec, parse_ops):
+        """
+        Validates and compiles a decoded upload; parse_ops is
+        Request_handler.parse_pin_ops. Returns None, or an error message
+        (the loaded rules are then left as they were).
+        """
+        if not isinstance(spec, dict): return "Body must be a JSON object"
+        rules = spec.get("rules", [])
+        rate = spec.get("rate_hz", self.DEFAULT_RATE_HZ)
+        if not isinstance(rules, list) or len(rules) > self.MAX_RULES: return f"'rules' must be a list of at most {self.MAX_RULES}"
+        if type(rate) is not int or not 1 <= rate <= self.MAX_RATE_HZ: return f"rate_hz must be 1-{self.MAX_RATE_HZ}"
+        rows = [] # Per rule: (name, [(slot, op, value)], for_ms, every_ms, then_actions, else_actions)
+        terms = 0
+        for i, rule in enumerate(rules):
+            if not isinstance(rule, dict): return f"Rule {i}: must be an object"
+            name = str(rule.get("name", f"rule{i}"))
+            conds = rule.get("if", [])
+            if not isinstance(conds, list): return f"Rule {name}: 'if' must be a list"
+            terms += len(conds)
+            if terms > self.MAX_TERMS: return f"Too many conditions (max {self.MAX_TERMS})"
+            compiled = []
+            for cond in conds:
+                term, error = self._compile_term(cond)
+                if error: return f"Rule {name}: {error}"
+                compiled.append(term)
+            for_ms = rule.get("for_ms", 0)
+            every_ms = rule.get("every_ms", 0)
+            if type(for_ms) is not int or type(every_ms) is not int or not 0 <= for_ms <= 86_400_000 or not 0 <= every_ms <= 86_400_000:
+                return f"Rule {name}: for_ms/every_ms must be 0-86400000"
+            actions = []
+            for key in ("then", "else"):
+                ops = rule.get(key, [])
+                parsed, error = parse_ops(ops) if ops else (None, None)
+                if error: return f"Rule {name}: '{key}': {error}"
+                actions.append(parsed)
+            if not actions[0] and not actions[1]: return f"Rule {name}: needs 'then' and/or 'else' operations"
+            rows.append((name, compiled, for_ms, every_ms, actions[0], actions[1]))
+        self.rate_hz = rate
+        self._compile(rows)
+        _log.info("Rules: %s rule(s), %s condition(s) loaded at %s Hz.", len(rows), terms, rate)
+        return None
+
+    def _compile_term(self, cond):
+        """ {"src", "op", "value"} -> ((slot, op code, value), None) or (None, error). """
+        if not isinstance(cond, dict): return None, "condition must be an object"
+        src = cond.get("src")
+        op = cond.get("op")
+        value = cond.get("value")
+        if op not in OPS: return None, f"op must be one of {OPS}"
+        if type(value) not in (int, float): return None, "value must be a number"
+        if src == "temp": slot = TEMP_SLOT
+        elif src in ("adc0", "adc1", "adc2"): slot = ADC_SLOT + int(src[3])
+        elif type(src) is str and src.startswith("gp") and src[2:].isdigit() and self.board.get_pin_by_id(int(src[2:])): slot = int(src[2:])
+        else: return None, f"unknown source {src} (gp<N>, adc0-adc2 or temp)"
+        return (slot, OPS.index(op), value), None
+
+    def _compile(self, rows):
+        """ Builds the predicate table and fresh per-rule state; swapped in as a whole (no await in between). """
+        n = len(rows)
+        t_slot = bytearray()
+        t_op = bytearray()
+        t_val = array.array('f')
+        first = array.array('H', [0])
+        used = []
+        for row in rows:
+            for slot, op, value in row[1]:
+                t_slot.append(slot); t_op.append(op); t_val.append(value)
+                if slot not in used: used.append(slot)
+            first.append(len(t_slot))
+        self._t_slot, self._t_op, self._t_val, self._first = t_slot, t_op, t_val, first
+        self._for = array.array('I', [row[2] for row in rows])
+        self._every = array.array('I', [row[3] for row in rows])
+        self._then = [row[4] for row in rows]
+        self._else = [row[5] for row in rows]
+        self._held = bytearray(n) # Terms true at the last pass
+        self._fired = bytearray(n) # 'then' fired since the terms became true
+        self._since = [0] * n # ticks_ms when the terms became true
+        self._last = [0] * n # ticks_ms of the last 'then'
+        self.hits = array.array('I', bytes(4 * n)) # 'then' fires per rule
+        self.else_hits = array.array('I', bytes(4 * n))
+        self._used = bytes(used)
+        self.names = [row[0] for row in rows]
+        self._count = n
+        if n: self._loaded.set()
+        else: self._loaded.clear()
+
+    # --- Persistence ---
+    def save(self, body):
+        """ Keeps the accepted upload (raw JSON) for load_saved() at boot. """
+        try:
+            with open(self.RULES_FILE, 'wb') as f: f.write(body)
+        except OSError as e:
+            _log.warning("Rules: Could not save %s: %s", self.RULES_FILE, e)
+
+    def load_saved(self, parse_ops):
+        """ Loads RULES_FILE if present (boot). """
+        try:
+            with open(self.RULES_FILE, 'rb') as f: spec = ujson.load(f)
+        except OSError: return # No saved rules
+        except ValueError as e:
+            _log.error("Rules: %s is not valid JSON: %s", self.RULES_FILE, e); return
+        error = self.load(spec, parse_ops)
+        if error: _log.error("Rules: Saved rules rejected: %s", error)
+
+    # --- Evaluate ---
+    def evaluate(self, now):
+        """ One pass: samples each used source, then steps every rule. """
+        board = self.board
+        samples = self._samples
+        for slot in self._used:
+            if slot < ADC_SLOT:
+                level = board.pin_table[slot].value # Cached: edge IRQs/scans keep IN levels current
+                samples[slot] = level if type(level) is int else NOT_A_LEVEL
+            elif slot < TEMP_SLOT: samples[slot] = board.adc.read_volts(slot - ADC_SLOT)
+            else: samples[slot] = board.get_internal_temp()
+        t_slot, t_op, t_val, first = self._t_slot, self._t_op, self._t_val, self._first
+        for r in range(self._count):
+            ok = True
+            for t in range(first[r], first[r + 1]):
+                v = samples[t_slot[t]]
+                ref = t_val[t]
+                op = t_op[t]
+                if op == 0: ok = v < ref
+                elif op == 1: ok = v <= ref
+                elif op == 2: ok = v > ref
+                elif op == 3: ok = v >= ref
+                elif op == 4: ok = v == ref
+                else: ok = v != ref
+                if ok and t_slot[t] < ADC_SLOT and v == NOT_A_LEVEL: ok = False
+                if not ok: break
+            self._step(r, ok, now)
+        self.passes += 1
+
+    def _step(self, r, ok, now):
+        if ok:
+            if not self._held[r]:
+                self._held[r] = 1
+                self._since[r] = now
+            if not self._fired[r]:
+                if utime.ticks_diff(now, self._since[r]) < self._for[r]: return
+                self._fired[r] = 1
+            elif not self._every[r] or utime.ticks_diff(now, self._last[r]) < self._every[r]:
+                return
+            self._last[r] = now
+            self.hits[r] += 1
+            self._fire(r, self._then[r])
+        else:
+            self._held[r] = 0
+            if self._fired[r]:
+                self._fired[r] = 0
+                self.else_hits[r] += 1
+                self._fire(r, self._else[r])
+
+    def _fire(self, r, actions):
+        if not actions: return
+        __debug__ and _log.debug("Rules: '%s' fired (%s action(s)).", self.names[r], len(actions))
+        self.fires += 1
+        success, message = self.board.queue_pin_batch(actions)
+        if not success:
+            self.dropped += 1
+            _log.warning("Rules: '%s' actions dropped: %s", self.names[r], message)
+
+    async def run(self):
+        """ Background task: a pass every 1/rate_hz s on a fixed schedule; idle (no polling) while no rules are loaded. """
+        __debug__ and _log.debug("Rules: Task started.")
+        deadline = utime.ticks_ms()
+        while True:
+            if not self._count:
+                await self._loaded.wait()
+                deadline = utime.ticks_ms()
+            t0 = utime.ticks_us()
+            try:
+                self.evaluate(utime.ticks_ms())
+            except Exception as e:
+                _log.error("Rules: Evaluation error: %s", e)
+            self.board.metrics.observe(self._eval_hist, utime.ticks_diff(utime.ticks_us(), t0))
+            deadline = utime.ticks_add(deadline, 1000 // self.rate_hz)
+            wait = utime.ticks_diff(deadline, utime.ticks_ms())
+            if wait < 0: # Overran: restart the schedule instead of bursting to catch up
+                deadline = utime.ticks_ms()
+                wait = 0
+            await uasyncio.sleep_ms(wait)
+
+    def status_dict(self):
+        """ Loaded rules with their hit counters (GET /api/rules). """
+        return {
+            "rate_hz": self.rate_hz,
+            "passes": self.passes,
+            "dropped": self.dropped,
+            "rules": [{"name": name, "hits": self.hits[r], "else_hits": self.else_hits[r], "active": bool(self._fired[r])}
+                      for r, name in enumerate(self.names)]
+        }
@@ -0,0 +1,129 @@
+# state_bin.py
+import struct
+import utime
+import uasyncio
+import log
+from micropython import const
+
+_log = log.Logger("state_bin")
+
+# Wire format, version 1 (all little-endian; decoder: tools/state_bin.py).
+# Header, then 'pins' records. ADC/temperature are raw u16 counts
+# (volts = raw * 3.3 / 65535; temperature as Pico_adc.read_temp_c).
+STATE_MAGIC = b'PS'
+STATE_VERSION = 1
+HEADER = "<2sBBIIIIHHHH4sB" # magic, version, flags, epoch, rev, log_seq, time (s), temp raw, adc0-2 raw, ip, pins
+PIN_RECORD = "<BBBBHI" # id, mode, controller, pin flags, pwm duty u16, pwm freq
+HEADER_SIZE = const(33)
+PIN_RECORD_SIZE = const(10)
+# Header flags
+F_FULL = const(1) # Every pin is listed (else only pins stamped after 'since')
+F_BLE_ADV = const(2)
+F_WIFI_UP = const(4)
+# Pin flags
+P_LEVEL = const(1) # GPIO level (valid with P_GPIO)
+P_PULL_UP = const(2)
+P_PULL_DOWN = const(4)
+P_GPIO = const(8)
+P_EFFECT = const(16) # A PWM effect is running
+# Codes for the mode/controller strings (index; unknown -> 0)
+MODES = ("N/A", "IN", "OUT", "ADC", "PWM")
+CONTROLLERS = ("N/A", "GPIO", "ADC", "PWM")
+REQUEST = "<II" # Raw port request: epoch, since (full state unless epoch matches and since > 0)
+
+class Board_state_bin:
+    """
+    Board state as one fixed-layout binary frame, for scrapers that don't
+    want /api/board_state's JSON: raw u16 ADC/temperature values and
+    10-byte pin records with no keys or names. Packed with
+    struct.pack_into into one preallocated buffer that is copied out
+    before any await. Served at /api/board_state.bin and on a raw TCP
+    port (serve_client: 8-byte request, u16 length + frame reply, repeat).
+    """
+    MAX_CLIENTS = 2 # Raw port connections served at once
+    IDLE_TIMEOUT_MS = 60000 # Raw port connection closed after this long without a request
+
+    def __init__(self, board, log_seq):
+        self.board = board
+        self.log_seq = log_seq # fn() -> web console seq
+        self.buf = bytearray(2 + HEADER_SIZE + PIN_RECORD_SIZE * len(board.all_gpio_pins)) # 2: raw port length prefix
+        self.mv = memoryview(self.buf)
+        self._ip_str = None
+        self._ip = b'\0\0\0\0'
+        self.clients = 0
+
+    def _ip_bytes(self):
+        ip = self.board.wifi.ip
+        if ip is not self._ip_str: # Re-parse only when Wifi_manager publishes a new address
+            self._ip_str = ip
+            try: self._ip = bytes(int(part) for part in ip.split('.'))
+            except ValueError: self._ip = b'\0\0\0\0'
+        return self._ip
+
+    def encode(self, since, offset=0):
+        """ Packs the frame at buf[offset:]; since <= 0 lists every pin. Returns its length. """
+        board = self.board
+        board.sample_adc() # Stamp ADC first so 'rev' covers the values written
+        full = since <= 0
+        flags = (F_FULL if full else 0) | (F_BLE_ADV if board.ble_is_advertising else 0) | (F_WIFI_UP if board.wifi.up.is_set() else 0)
+        adc_raw = board._adc_raw
+        buf = self.buf
+        pos = offset + HEADER_SIZE
+        pin_revs = board.pin_revs
+        count = 0
+        for pin in board.all_gpio_pins:
+            if not full and pin_revs[pin._id] <= since: continue
+            mode = pin.mode
+            controller = pin.controlled_by
+            pin_flags = 0
+            if controller == "GPIO":
+                pin_flags = P_GPIO | (P_LEVEL if pin.value == 1 else 0)
+            pull = pin.pull_str
+            if pull == "UP": pin_flags |= P_PULL_UP
+            elif pull == "DOWN": pin_flags |= P_PULL_DOWN
+            pwm = pin.pwm_instance
+            if pwm and pwm.effect: pin_flags |= P_EFFECT
+            struct.pack_into(PIN_RECORD, buf, pos, pin._id,
+                             MODES.index(mode) if mode in MODES else 0,
+                             CONTROLLERS.index(controller) if controller in CONTROLLERS else 0,
+                             pin_flags, pwm.duty_u16 if pwm else 0, pwm.freq if pwm else 0)
+            pos += PIN_RECORD_SIZE
+            count += 1
+        struct.pack_into(HEADER, buf, offset, STATE_MAGIC, STATE_VERSION, flags, board.state_epoch, board.state_rev,
+                         self.log_seq(), int(utime.time()), board.adc.read_temp_u16(), adc_raw[0], adc_raw[1], adc_raw[2],
+                         self._ip_bytes(), count)
+        return pos - offset
+
+    async def write(self, out, since):
+        """ HTTP body (Json_stream-like writer): the frame is copied into out before any await. """
+        n = self.encode(since)
+        out.write(self.mv[:n])
+        await out.finish()
+
+    def since_for(self, epoch, since):
+        """ 'since' if it is a revision of this boot, else 0 (full state). """
+        board = self.board
+        return since if 0 < since <= board.state_rev and epoch == board.state_epoch else 0
+
+    async def serve_client(self, reader, writer):
+        """ Raw port: per REQUEST (epoch, since), replies u16 frame length + frame, until the client closes or idles. """
+        if self.clients >= self.MAX_CLIENTS:
+            _log.warning("StateBin: Refusing client, %s already connected.", self.clients)
+            writer.close(); await writer.wait_closed()
+            return
+        self.clients += 1
+        try:
+            while True:
+                request = await uasyncio.wait_for_ms(reader.readexactly(8), self.IDLE_TIMEOUT_MS)
+                epoch, since = struct.unpack(REQUEST, request)
+                n = self.encode(self.since_for(epoch, since), 2)
+                struct.pack_into("<H", self.buf, 0, n)
+                writer.write(self.mv[:n + 2]) # Stream.write copies before returning
+                await writer.drain()
+        except (OSError, EOFError, uasyncio.TimeoutError):
+            pass # Client closed or went idle
+        finally:
+            self.clients -= 1
+            try:
+                writer.close(); await writer.wait_closed()
+            except OSError: pass
@@ -0,0 +1,92 @@
+# static_asset.py
+import log
+import hashlib
+import binascii
+
+try:
+    import deflate # Used only to verify .gz variants against the plain file
+except ImportError:
+    deflate = None
+
+_log = log.Logger("static_asset")
+
+ASSET_DIRS = ('', '/rom/') # Working directory (loose files) first, then the ROMFS image, like sys.path
+
+def read_asset(filename):
+    """
+    Returns a web asset's contents. Files in ROMFS (tools/build_romfs.py)
+    expose their flash directly, so they come back as a memoryview that
+    costs no RAM; loose files are read into bytes. Raises OSError if the
+    file is in neither place.
+    """
+    for directory in ASSET_DIRS:
+        try:
+            f = open(directory + filename, 'rb')
+        except OSError:
+            continue
+        with f:
+            try: return memoryview(f) # ROMFS file: view of the data in flash
+            except TypeError: return f.read()
+    raise OSError(2, filename)
+
+class Static_asset:
+    """
+    An immutable web asset (style.css, app.js) held as bytes, or as a
+    view into flash when deployed in ROMFS, with a content-hash ETag. If a
+    gzip variant '<filename>.gz' was generated at deploy time
+    (tools/gzip_assets.py, or included by tools/build_romfs.py) it is
+    loaded too and served to clients that send 'Accept-Encoding: gzip'.
+    """
+    CHUNK_SIZE = 512
+
+    def __init__(self, filename, content_type):
+        self.filename = filename
+        self.content_type = content_type
+        self.body = read_asset(filename)
+        digest = hashlib.sha256(self.body).digest()
+        self.etag = '"' + binascii.hexlify(digest[:8]).decode() + '"'
+        __debug__ and _log.debug("Asset: Loaded %s (%s bytes, ETag %s)", filename, len(self.body), self.etag)
+
+        self.gzip_body = None
+        self.gzip_etag = None
+        try:
+            gzip_body = read_asset(filename + '.gz')
+        except OSError:
+            __debug__ and _log.debug("Asset: No %s.gz, serving identity only.", filename)
+            return
+        if not self._gzip_matches(gzip_body, digest):
+            __debug__ and _log.debug("Asset: %s.gz is stale (content differs), ignoring it.", filename)
+            return
+        self.gzip_body = gzip_body
+        self.gzip_etag = self.etag[:-1] + '-gz"' # Distinct ETag per encoding
+        __debug__ and _log.debug("Asset: Loaded %s.gz (%s bytes)", filename, len(gzip_body))
+
+    def _gzip_matches(self, gzip_body, digest):
+        """ Decompresses the .gz variant in small chunks and compares its hash to the plain file. """
+        if deflate is None:
+            return True # Can't verify on this build, trust the deploy step
+        try:
+            import io
+            h = hashlib.sha256()
+            buf = bytearray(self.CHUNK_SIZE)
+            with deflate.DeflateIO(io.BytesIO(gzip_body), deflate.GZIP) as d:
+                while True:
+                    n = d.readinto(buf)
+                    if not n: break
+                    h.update(buf[:n])
+            return h.digest() == digest
+        except Exception as e:
+            _log.error("Asset: Error verifying %s.gz: %s", self.filename, e)
+            return False
+
+    def select(self, accept_encoding):
+        """ Returns (body, etag, content_encoding); accept_encoding is 'gzip' if the client accepts it (Http_request.accept_encoding). """
+        if self.gzip_body is not None and accept_encoding == 'gzip':
+            return self.gzip_body, self.gzip_etag, 'gzip'
+        return self.body, self.etag, None
+
+    @staticmethod
+    def etag_matches(if_none_match, etag):
+        """ True if an If-None-Match header value matches etag (or is '*'). """
+        if not if_none_match: return False
+        return if_none_match.strip() == '*' or etag in if_none_match
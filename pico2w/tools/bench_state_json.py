@@ -0,0 +1,75 @@
+# bench_state_json.py
+"""
+On-device benchmark (runs under MicroPython, not CPython) comparing the
+old /api/board_state path (export_state_dict -> ujson.dumps -> encode)
+with the streaming Board_state_json/Json_stream path.
+
+Usage, with the pico2w files already on the board:
+    mpremote run tools/bench_state_json.py
+
+For each path it prints the time per request, the bytes allocated per
+request (GC pressure, measured with the GC disabled) and the peak live
+heap, sampled by collecting garbage each time the path hands bytes to
+the writer.
+"""
+import gc
+import ujson
+import utime
+import uasyncio
+from pico_board import Pico_board
+from wifi_manager import Wifi_manager
+from json_stream import Json_stream, Board_state_json
+
+ROUNDS = 20
+LOG = ["[P] Console line %d with some typical text in it" % i for i in range(20)]
+
+class Null_writer:
+    """ Stands in for a StreamWriter; counts bytes and drops them, optionally sampling live heap. """
+    def __init__(self):
+        self.n = 0
+        self.base = None # Set to sample the live heap (above base) on every write
+        self.peak = 0
+    def write(self, buf):
+        self.n += len(buf)
+        if self.base is not None:
+            gc.collect()
+            self.peak = max(self.peak, gc.mem_alloc() - self.base)
+    async def drain(self): pass
+
+async def old_path(board, state_json, out):
+    state = board.export_state_dict()
+    state['server_log'] = LOG
+    out.write(ujson.dumps(state).encode('utf-8'))
+
+async def new_path(board, state_json, out):
+    await state_json.write(Json_stream(out), 0, len(LOG)) # Console lines now come from /api/log, only log_seq is sent
+
+async def measure(name, fn, board, state_json):
+    out = Null_writer()
+    await fn(board, state_json, out) # Warm up (first ADC stamps, imports)
+    gc.collect()
+    gc.disable()
+    alloc_before = gc.mem_alloc()
+    await fn(board, state_json, out)
+    alloc = gc.mem_alloc() - alloc_before
+    gc.enable()
+    gc.collect()
+    out.base = gc.mem_alloc()
+    await fn(board, state_json, out)
+    out.base = None
+    gc.collect()
+    t0 = utime.ticks_us()
+    for _ in range(ROUNDS):
+        out.n = 0
+        await fn(board, state_json, out)
+    us = utime.ticks_diff(utime.ticks_us(), t0) // ROUNDS
+    print(f"{name:10s} {out.n:6d} bytes out  {alloc:6d} bytes allocated  {out.peak:6d} bytes peak live  {us:7d} us/request")
+
+async def main():
+    board = Pico_board(Wifi_manager("", ""))
+    state_json = Board_state_json(board)
+    print(f"{len(board.all_gpio_pins)} pins, {len(LOG)} log lines, {ROUNDS} rounds")
+    await measure("dict+dumps", old_path, board, state_json)
+    await measure("streaming", new_path, board, state_json)
+
+uasyncio.run(main())
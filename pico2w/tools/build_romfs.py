@@ -0,0 +1,95 @@
+# build_romfs.py
+"""
+Deploy-time helper (runs on the host with CPython, not on the Pico).
+Builds a ROMFS image of the app for firmware with a ROMFS partition
+(deploy/PICO2W_ROMFS): each module listed in deploy/manifest.py compiled
+to .mpy, plus template.html, style.css, app.js and their gzip variants.
+On the board the modules are imported from /rom and their bytecode runs
+in place from flash (nothing compiled at boot), and Static_asset and
+Html_template serve the assets as views into flash instead of RAM copies.
+
+Uses the MicroPython tree next to this project: tools/manifestfile.py to
+read the manifest, mpy-cross to compile and mpremote's ROMFS writer.
+
+Usage: python3 tools/build_romfs.py [-o pico2w.romfs] [-O level] [--mpy-cross path]
+Then, with the PICO2W_ROMFS firmware on the board:
+    mpremote romfs deploy pico2w.romfs
+    mpremote cp boot.py config.py main.py :
+and delete any loose copies of the app modules and assets from the board's
+filesystem: the working directory comes before /rom in sys.path and in
+static_asset.ASSET_DIRS, so they would be used instead.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+MPY_DIR = os.path.abspath(os.path.join(APP_DIR, '..', 'micropython'))
+MANIFEST = os.path.join(APP_DIR, 'deploy', 'manifest.py')
+ASSETS = ('template.html', 'style.css', 'app.js')
+GZIP_ASSETS = ('style.css', 'app.js') # Served with Content-Encoding: gzip when accepted (see Static_asset)
+
+sys.path.insert(0, os.path.join(MPY_DIR, 'tools'))
+sys.path.insert(1, os.path.join(MPY_DIR, 'tools', 'mpremote'))
+sys.path.insert(2, os.path.dirname(os.path.abspath(__file__)))
+import manifestfile
+from mpremote.romfs import VfsRomWriter
+from gzip_assets import gzip_bytes
+
+def find_mpy_cross(path):
+    for candidate in (path, os.environ.get('MPY_CROSS'), os.path.join(MPY_DIR, 'mpy-cross', 'build', 'mpy-cross')):
+        if candidate and os.path.isfile(candidate):
+            return candidate
+    return 'mpy-cross' # From PATH; must match the firmware's .mpy version
+
+def manifest_modules(opt):
+    """ Returns [(source path, target name, opt)] from deploy/manifest.py. """
+    manifest = manifestfile.ManifestFile(manifestfile.MODE_COMPILE, {'MPY_DIR': MPY_DIR, 'MPY_LIB_DIR': None, 'PORT_DIR': None, 'BOARD_DIR': None})
+    manifest.include(MANIFEST, opt=opt)
+    return [(f.full_path, f.target_path, f.opt) for f in manifest.files()]
+
+def compile_mpy(mpy_cross, source, target, opt, tmp_dir):
+    out = os.path.join(tmp_dir, target[:-3] + '.mpy')
+    subprocess.run([mpy_cross, '-O%d' % opt, '-s', target, '-o', out, source], check=True)
+    with open(out, 'rb') as f:
+        return f.read()
+
+def build(mpy_cross, opt):
+    """ Returns (image bytes, [(name, size)]). """
+    vfs = VfsRomWriter()
+    listing = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for source, target, module_opt in manifest_modules(opt):
+            data = compile_mpy(mpy_cross, source, target, opt if module_opt is None else module_opt, tmp_dir)
+            name = target[:-3] + '.mpy'
+            vfs.mkfile(name, data)
+            listing.append((name, len(data)))
+    for name in ASSETS:
+        with open(os.path.join(APP_DIR, name), 'rb') as f:
+            data = f.read()
+        vfs.mkfile(name, data)
+        listing.append((name, len(data)))
+        if name in GZIP_ASSETS:
+            packed = gzip_bytes(data)
+            vfs.mkfile(name + '.gz', packed)
+            listing.append((name + '.gz', len(packed)))
+    return vfs.finalise(), listing
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a ROMFS image of the pico2w app.")
+    parser.add_argument('-o', '--output', default='pico2w.romfs')
+    parser.add_argument('-O', '--opt', type=int, default=1, help="mpy-cross optimisation level (0 keeps debug log calls)")
+    parser.add_argument('--mpy-cross', help="mpy-cross binary (default: $MPY_CROSS, then the micropython tree, then PATH)")
+    args = parser.parse_args()
+
+    image, listing = build(find_mpy_cross(args.mpy_cross), args.opt)
+    for name, size in listing:
+        print(f"  {name:24s} {size:7d}")
+    with open(args.output, 'wb') as f:
+        f.write(image)
+    print(f"{args.output}: {len(image)} bytes, {len(listing)} files")
+
+if __name__ == '__main__':
+    main()
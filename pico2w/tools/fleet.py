@@ -0,0 +1,503 @@
+# fleet.py
+"""
+Host-side fleet aggregator (CPython 3.8+, stdlib only, not for the Pico).
+Keeps one persistent state connection per board and serves the merged
+fleet state to any number of dashboards and scripts from one cache, so
+board load stays the same however many clients are watching. Pin
+commands from all clients are coalesced per board into /pin/batch posts.
+
+Per board, state comes from either
+    events  one GET /api/events stream; the board pushes deltas (default)
+    bin     one connection to the raw state port (tools/state_bin.py
+            format), polled every --poll seconds with since=<rev>
+plus one keep-alive HTTP connection for commands, opened on first use.
+Lost connections are retried with backoff; the board shows as offline
+meanwhile.
+
+Board address: [name=]host[:http_port[:bin_port]] (ports default to
+80 and 8081; distinct ports let several tools/sim_server.py boards share
+localhost).
+--scan probes a subnet for raw state ports, at start and every
+--rescan seconds.
+
+Client API (on --listen, default 0.0.0.0:8000):
+    GET  /api/fleet               every board's merged state (cached JSON)
+    GET  /api/fleet/events        SSE: 'fleet' snapshot, then a 'board'
+                                  event per upstream update
+    GET  /api/fleet/stats         upstream/client counters
+    GET  /api/boards/<name>       one board's state
+    POST /api/boards/<name>/batch /pin/batch operations for one board
+    POST /api/batch               {"<name>": [ops], ...} for several
+
+Usage: python3 tools/fleet.py --board lab1=192.168.1.50 --board 192.168.1.51 [--scan 192.168.1.0/24]
+       python3 tools/fleet.py --board a=127.0.0.1:8080:8081 --board b=127.0.0.1:8090:8091 --mode bin
+"""
+import argparse
+import asyncio
+import ipaddress
+import json
+import struct
+import time
+
+from state_bin import REQUEST, decode
+
+STATE_HEADER_SIZE = 33 # state_bin header, read by the --scan probe
+
+class Board_link:
+    """ One board: state connection, merged state and the command batcher. """
+    BACKOFF_S = (1, 2, 5, 10, 30) # Reconnect delays, last one repeats
+    CONNECT_TIMEOUT_S = 5
+    READ_TIMEOUT_S = 30 # The board sends an event heartbeat every 10 s
+    BATCH_WINDOW_S = 0.02 # Commands arriving this close together share one post
+    MAX_BATCH_OPS = 32 # Request_handler.MAX_BATCH_OPS on the board
+    BATCH_MODES = ("IN", "OUT", "ADC", "PWM") # Request_handler.BATCH_MODES / BATCH_PULLS
+    BATCH_PULLS = ("NONE", "UP", "DOWN")
+    ADC_PINS = (26, 27, 28) # Pins Pico_board accepts mode ADC on
+
+    def __init__(self, fleet, name, host, http_port=80, bin_port=8081):
+        self.fleet = fleet
+        self.name = name
+        self.host = host
+        self.http_port = http_port
+        self.bin_port = bin_port
+        self.online = False
+        self.state = {"rev": 0, "epoch": 0, "pins": {}, "status": {}, "adc_volts": {}}
+        self.updated = 0.0 # time.time() of the last update
+        self._pending = [] # (ops, future) waiting for the next post
+        self._flush_task = None
+        self._cmd = None # (reader, writer) of the keep-alive command connection
+        self._cmd_lock = asyncio.Lock()
+        # Counters (GET /api/fleet/stats)
+        self.updates = 0
+        self.bytes_in = 0
+        self.connects = 0
+        self.errors = 0
+        self.posts = 0
+        self.ops = 0
+        self.split_posts = 0 # Merged batches refused with 400, re-posted per client
+
+    def address(self):
+        return f"{self.host}:{self.http_port}:{self.bin_port}"
+
+    # --- State ---
+    async def run(self, mode, poll_s, min_interval_ms):
+        """ Keeps the state connection up for good, reconnecting with backoff. """
+        failures = 0
+        while True:
+            seen = self.updates
+            try:
+                if mode == "bin": await self._poll_bin(poll_s)
+                else: await self._stream_events(min_interval_ms)
+            except (OSError, EOFError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError) as e:
+                self.errors += 1
+                if self.updates != seen: failures = 0 # The connection worked for a while: start the backoff over
+                if not failures: print(f"fleet: {self.name}: no state connection ({e!r}), retrying")
+            if self.online:
+                self.online = False
+                self.fleet.publish(self, {"online": False})
+            await asyncio.sleep(self.BACKOFF_S[min(failures, len(self.BACKOFF_S) - 1)])
+            failures += 1
+
+    async def _open(self, port):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, port), self.CONNECT_TIMEOUT_S)
+        self.connects += 1
+        return reader, writer
+
+    async def _stream_events(self, min_interval_ms):
+        reader, writer = await self._open(self.http_port)
+        try:
+            writer.write(f"GET /api/events?min_interval_ms={min_interval_ms} HTTP/1.1\r\nHost: {self.host}\r\n\r\n".encode())
+            await writer.drain()
+            status, headers = await read_head(reader, self.READ_TIMEOUT_S)
+            if status != 200: raise ValueError(f"/api/events answered {status}")
+            event = b''
+            data = []
+            while True:
+                line = await asyncio.wait_for(reader.readline(), self.READ_TIMEOUT_S)
+                if not line: raise EOFError("event stream closed")
+                self.bytes_in += len(line)
+                line = line.rstrip(b'\r\n')
+                if line.startswith(b'event:'): event = line[6:].strip()
+                elif line.startswith(b'data:'): data.append(line[5:].strip())
+                elif not line and data:
+                    if event in (b'state', b'delta'): self.apply(json.loads(b'\n'.join(data)), event == b'state')
+                    event = b''
+                    data = []
+        finally:
+            writer.close()
+
+    async def _poll_bin(self, poll_s):
+        reader, writer = await self._open(self.bin_port)
+        try:
+            while True:
+                writer.write(REQUEST.pack(self.state["epoch"], self.state["rev"]))
+                await writer.drain()
+                (n,) = struct.unpack("<H", await asyncio.wait_for(reader.readexactly(2), self.READ_TIMEOUT_S))
+                frame = await asyncio.wait_for(reader.readexactly(n), self.READ_TIMEOUT_S)
+                self.bytes_in += n + 2
+                update = decode(frame)
+                if update["full"] or update["rev"] != self.state["rev"] or not self.online:
+                    self.apply(update, update["full"])
+                await asyncio.sleep(poll_s)
+        finally:
+            writer.close()
+
+    def apply(self, update, full):
+        """ Merges a board update (JSON event or decoded frame) and publishes what it changed. """
+        state = self.state
+        if full: state["pins"] = {}
+        for pin in update.get("pins", ()):
+            state["pins"][pin["id"]] = pin # Updates carry whole pins (a mode change drops the PWM keys)
+        for key in ("status", "adc_volts"):
+            if key in update: state[key].update(update[key])
+        for key in ("rev", "epoch", "log_seq"):
+            if key in update: state[key] = update[key]
+        self.updates += 1
+        self.updated = time.time()
+        delta = {key: update[key] for key in ("rev", "epoch", "pins", "status", "adc_volts") if key in update}
+        delta["full"] = bool(full)
+        if not self.online:
+            self.online = True
+            delta["online"] = True
+        self.fleet.publish(self, delta)
+
+    def state_dict(self):
+        state = dict(self.state)
+        state["pins"] = sorted(state["pins"].values(), key=lambda pin: pin["id"])
+        state.update(name=self.name, address=self.address(), online=self.online, updated=self.updated)
+        return state
+
+    # --- Commands ---
+    def queue_ops(self, ops):
+        """ Adds one client's ops to the next post; returns a future for the board's reply. """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((ops, future))
+        if not self._flush_task: self._flush_task = asyncio.ensure_future(self._flush())
+        return future
+
+    async def _flush(self):
+        """ After BATCH_WINDOW_S, posts the queued ops in as few /pin/batch requests as fit MAX_BATCH_OPS. """
+        await asyncio.sleep(self.BATCH_WINDOW_S)
+        pending, self._pending = self._pending, []
+        self._flush_task = None
+        group, size = [], 0
+        for ops, future in pending + [(None, None)]: # Sentinel posts the last group
+            if ops is None or size + len(ops) > self.MAX_BATCH_OPS:
+                if group: await self._post_group(group)
+                group, size = [], 0
+            if ops is not None:
+                group.append((ops, future))
+                size += len(ops)
+
+    async def _post_group(self, group):
+        """
+        Posts several clients' ops as one batch. The board takes or refuses a
+        batch whole, so a 400 (an op parse_ops could not rule out, e.g. a pin
+        not yet seen in the board's state) is retried per client: only the
+        client that sent the bad op gets the error.
+        """
+        result = await self._post_batch([op for ops, _ in group for op in ops])
+        if result[0] == 400 and len(group) > 1:
+            self.split_posts += 1
+            for ops, future in group:
+                client_result = await self._post_batch(ops)
+                if not future.done(): future.set_result(client_result)
+            return
+        for _, future in group:
+            if not future.done(): future.set_result(result)
+
+    async def _post_batch(self, ops):
+        """ POST /pin/batch over the keep-alive command connection (reopened once if it went stale). Returns (code, reply). """
+        body = json.dumps(ops).encode()
+        request = (f"POST /pin/batch HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n"
+                   f"Content-Length: {len(body)}\r\nConnection: keep-alive\r\n\r\n").encode() + body
+        async with self._cmd_lock:
+            for attempt in (0, 1):
+                try:
+                    if not self._cmd: self._cmd = await self._open(self.http_port)
+                    reader, writer = self._cmd
+                    writer.write(request)
+                    await writer.drain()
+                    status, headers = await read_head(reader, self.READ_TIMEOUT_S)
+                    reply = await read_body(reader, headers, self.READ_TIMEOUT_S)
+                    if headers.get("connection") == "close":
+                        writer.close(); self._cmd = None
+                    self.posts += 1
+                    self.ops += len(ops)
+                    try: return status, json.loads(reply)
+                    except ValueError: return status, {"status": "error", "message": reply.decode(errors="replace")}
+                except (OSError, EOFError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError) as e:
+                    self.errors += 1
+                    if self._cmd: self._cmd[1].close()
+                    self._cmd = None
+                    error = e
+            return 502, {"status": "error", "message": f"Board {self.name} unreachable: {error!r}"}
+
+class Fleet:
+    """ The boards, the shared state cache and the SSE subscribers. """
+    SUBSCRIBER_QUEUE = 256 # Events buffered per client before it is dropped as too slow
+
+    def __init__(self, mode, poll_s, min_interval_ms):
+        self.mode = mode
+        self.poll_s = poll_s
+        self.min_interval_ms = min_interval_ms
+        self.boards = {}
+        self.subscribers = {} # SSE client queue -> its writer
+        self._snapshot = None # Cached /api/fleet body, dropped on every update
+        self.started = time.time()
+        # Counters
+        self.snapshots_built = 0
+        self.events_sent = 0
+        self.client_requests = 0
+        self.slow_clients = 0
+
+    def add(self, name, host, http_port=80, bin_port=8081):
+        for board in self.boards.values():
+            if (board.host, board.http_port, board.bin_port) == (host, http_port, bin_port): return board
+        board = Board_link(self, name, host, http_port, bin_port)
+        self.boards[name] = board
+        asyncio.ensure_future(board.run(self.mode, self.poll_s, self.min_interval_ms))
+        print(f"fleet: added {name} ({board.address()}, {self.mode})")
+        return board
+
+    def snapshot(self):
+        if self._snapshot is None:
+            self._snapshot = json.dumps({name: board.state_dict() for name, board in self.boards.items()}).encode()
+            self.snapshots_built += 1
+        return self._snapshot
+
+    def publish(self, board, delta):
+        """ Drops the cached snapshot and queues one encoded 'board' event to every subscriber. """
+        self._snapshot = None
+        if not self.subscribers: return
+        delta["name"] = board.name
+        event = b"event: board\ndata: " + json.dumps(delta).encode() + b"\n\n"
+        for queue, writer in list(self.subscribers.items()):
+            try: queue.put_nowait(event)
+            except asyncio.QueueFull: # Dropped rather than buffering without bound
+                self.slow_clients += 1
+                del self.subscribers[queue]
+                writer.close()
+        self.events_sent += len(self.subscribers)
+
+    def stats_dict(self):
+        return {
+            "uptime_s": round(time.time() - self.started),
+            "mode": self.mode,
+            "subscribers": len(self.subscribers),
+            "client_requests": self.client_requests,
+            "snapshots_built": self.snapshots_built,
+            "events_sent": self.events_sent,
+            "slow_clients_dropped": self.slow_clients,
+            "boards": {name: {"online": b.online, "updates": b.updates, "bytes_in": b.bytes_in, "connects": b.connects,
+                              "errors": b.errors, "batch_posts": b.posts, "batch_ops": b.ops, "split_posts": b.split_posts} for name, b in self.boards.items()},
+        }
+
+    async def scan(self, network, rescan_s, bin_port=8081):
+        """ Adds every host in 'network' that answers on the raw state port with a state frame. """
+        limit = asyncio.Semaphore(64)
+        async def probe(host):
+            async with limit:
+                try:
+                    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, bin_port), 1)
+                except (OSError, asyncio.TimeoutError): return
+                try:
+                    writer.write(REQUEST.pack(0, 0))
+                    await writer.drain()
+                    head = await asyncio.wait_for(reader.readexactly(2 + STATE_HEADER_SIZE), 2)
+                    if head[2:4] == b'PS': self.add(host, host, 80, bin_port)
+                except (OSError, EOFError, asyncio.IncompleteReadError, asyncio.TimeoutError): pass
+                finally: writer.close()
+        while True:
+            await asyncio.gather(*(probe(str(ip)) for ip in ipaddress.ip_network(network, strict=False).hosts()))
+            if not rescan_s: return
+            await asyncio.sleep(rescan_s)
+
+# --- HTTP plumbing (both directions) ---
+async def read_head(reader, timeout):
+    """ Status code (responses) or (method, path) (requests), and lower-cased headers. """
+    line = await asyncio.wait_for(reader.readline(), timeout)
+    if not line: raise EOFError("connection closed")
+    parts = line.decode('latin-1').split()
+    if len(parts) < 2: raise ValueError(f"bad start line {line!r}")
+    first = int(parts[1]) if parts[0].startswith("HTTP/") else (parts[0], parts[1])
+    headers = {}
+    while True:
+        line = await asyncio.wait_for(reader.readline(), timeout)
+        if line in (b'\r\n', b'\n', b''): break
+        key, _, value = line.decode('latin-1').partition(':')
+        headers[key.strip().lower()] = value.strip()
+    return first, headers
+
+async def read_body(reader, headers, timeout):
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        body = b''
+        while True:
+            size = int((await asyncio.wait_for(reader.readline(), timeout)).split(b';')[0], 16)
+            chunk = await asyncio.wait_for(reader.readexactly(size + 2), timeout)
+            if not size: return body
+            body += chunk[:-2]
+    if "content-length" in headers:
+        return await asyncio.wait_for(reader.readexactly(int(headers["content-length"])), timeout)
+    return await asyncio.wait_for(reader.read(), timeout) # Ends when the peer closes
+
+class Fleet_server:
+    """ The client-facing HTTP/1.1 server (keep-alive, SSE). """
+    MAX_BODY = 64 * 1024
+    IDLE_TIMEOUT_S = 120
+    SSE_HEARTBEAT_S = 15
+
+    def __init__(self, fleet):
+        self.fleet = fleet
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                (method, path), headers = await read_head(reader, self.IDLE_TIMEOUT_S)
+                length = int(headers.get("content-length", 0))
+                if length > self.MAX_BODY:
+                    await self._send(writer, 413, {"status": "error", "message": "Body too large"}, False)
+                    return
+                body = await reader.readexactly(length) if length else b''
+                self.fleet.client_requests += 1
+                keep_alive = headers.get("connection", "").lower() != "close"
+                if method == "GET" and path.split('?')[0] == "/api/fleet/events":
+                    await self._events(writer)
+                    return
+                code, reply = await self._route(method, path.split('?')[0], body)
+                await self._send(writer, code, reply, keep_alive)
+                if not keep_alive: return
+        except (OSError, EOFError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, body):
+        fleet = self.fleet
+        parts = path.strip('/').split('/')
+        if method == "GET" and path == "/api/fleet": return 200, fleet.snapshot()
+        if method == "GET" and path == "/api/fleet/stats": return 200, fleet.stats_dict()
+        if parts[:2] == ["api", "boards"] and len(parts) >= 3:
+            board = fleet.boards.get(parts[2])
+            if not board: return 404, {"status": "error", "message": f"Unknown board {parts[2]}"}
+            if method == "GET" and len(parts) == 3: return 200, board.state_dict()
+            if method == "POST" and parts[3:] == ["batch"]:
+                ops, error = parse_ops(body, board)
+                if error: return 400, {"status": "error", "message": error}
+                return await board.queue_ops(ops)
+        if method == "POST" and path == "/api/batch":
+            try: spec = json.loads(body)
+            except ValueError: spec = None
+            if not isinstance(spec, dict): return 400, {"status": "error", "message": "Body must be {\"<board>\": [ops], ...}"}
+            checked = {}
+            for name, ops in spec.items(): # All boards' ops are checked before any is queued
+                if name not in fleet.boards: return 404, {"status": "error", "message": f"Unknown board {name}"}
+                ops, error = parse_ops(ops, fleet.boards[name])
+                if error: return 400, {"status": "error", "message": f"{name}: {error}"}
+                checked[name] = ops
+            futures = {name: fleet.boards[name].queue_ops(ops) for name, ops in checked.items()}
+            results = await asyncio.gather(*futures.values())
+            return 200, {name: {"code": code, "reply": reply} for name, (code, reply) in zip(futures, results)}
+        return 404, {"status": "error", "message": "Not found"}
+
+    async def _send(self, writer, code, reply, keep_alive):
+        body = reply if isinstance(reply, bytes) else json.dumps(reply).encode()
+        writer.write(f"HTTP/1.1 {code} {'OK' if code == 200 else 'Error'}\r\nContent-Type: application/json\r\n"
+                     f"Cache-Control: no-store\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body)
+        await writer.drain()
+
+    async def _events(self, writer):
+        """ SSE: the cached snapshot, then every published board event until the client leaves or falls behind. """
+        fleet = self.fleet
+        queue = asyncio.Queue(fleet.SUBSCRIBER_QUEUE)
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-store\r\nConnection: close\r\n\r\n")
+        writer.write(b"event: fleet\ndata: " + fleet.snapshot() + b"\n\n")
+        await writer.drain()
+        fleet.subscribers[queue] = writer
+        try:
+            while queue in fleet.subscribers:
+                try: event = await asyncio.wait_for(queue.get(), self.SSE_HEARTBEAT_S)
+                except asyncio.TimeoutError: event = b": ping\n\n" # Also finds dead clients
+                writer.write(event)
+                await writer.drain()
+        finally:
+            fleet.subscribers.pop(queue, None)
+
+def parse_ops(ops, board):
+    """
+    Checks one client's /pin/batch operations as Request_handler.parse_pin_ops
+    does on the board, so a bad op is refused here rather than failing a
+    merged post for every client in the window. Pin ids are checked against
+    the pins in the board's state once it has been received.
+    Returns (ops, None) or (None, error).
+    """
+    if isinstance(ops, (bytes, str)):
+        try: ops = json.loads(ops)
+        except ValueError: return None, "Body is not valid JSON"
+    if not isinstance(ops, list) or not ops: return None, "Operations must be a non-empty JSON list"
+    if len(ops) > Board_link.MAX_BATCH_OPS: return None, f"Too many operations (max {Board_link.MAX_BATCH_OPS})"
+    known_pins = board.state["pins"]
+    for i, op in enumerate(ops):
+        if not isinstance(op, dict): return None, f"Op {i}: must be an object"
+        pin_id = op.get("pin")
+        if type(pin_id) is not int or (known_pins and pin_id not in known_pins):
+            return None, f"Op {i}: unknown pin {pin_id}"
+        kind = op.get("op")
+        if kind == "mode":
+            mode = str(op.get("mode", "")).upper()
+            pull = op.get("pull")
+            if mode not in Board_link.BATCH_MODES: return None, f"Op {i}: mode must be one of {Board_link.BATCH_MODES}"
+            if mode == "ADC" and pin_id not in Board_link.ADC_PINS: return None, f"Op {i}: pin {pin_id} is not ADC capable"
+            if pull is not None and str(pull).upper() not in Board_link.BATCH_PULLS:
+                return None, f"Op {i}: pull must be one of {Board_link.BATCH_PULLS}"
+        elif kind == "value":
+            if op.get("value") not in (0, 1): return None, f"Op {i}: value must be 0 or 1"
+        elif kind == "pwm":
+            freq, duty = op.get("freq"), op.get("duty")
+            if freq is None and duty is None: return None, f"Op {i}: pwm needs freq and/or duty"
+            if freq is not None and (type(freq) is not int or freq <= 0): return None, f"Op {i}: freq must be a positive integer"
+            if duty is not None and (type(duty) not in (int, float) or not 0 <= duty <= 100): return None, f"Op {i}: duty must be 0-100"
+        else:
+            return None, f"Op {i}: op must be 'mode', 'value' or 'pwm'"
+    return ops, None
+
+def parse_board(spec):
+    """ '[name=]host[:http_port[:bin_port]]' -> (name, host, http_port, bin_port). """
+    name, _, address = spec.rpartition('=')
+    host, *ports = address.split(':')
+    http_port = int(ports[0]) if ports else 80
+    bin_port = int(ports[1]) if len(ports) > 1 else 8081
+    return name or (host if not ports else address), host, http_port, bin_port
+
+async def serve(args):
+    fleet = Fleet(args.mode, args.poll, args.min_interval)
+    for spec in args.board:
+        fleet.add(*parse_board(spec))
+    if args.boards_file:
+        with open(args.boards_file) as f:
+            for spec in json.load(f): fleet.add(*parse_board(spec))
+    for network in args.scan:
+        asyncio.ensure_future(fleet.scan(network, args.rescan))
+    host, _, port = args.listen.rpartition(':')
+    server = await asyncio.start_server(Fleet_server(fleet).handle, host or None, int(port))
+    print(f"fleet: serving {len(fleet.boards)} board(s) on http://{args.listen}/api/fleet")
+    async with server:
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate many Pico boards behind one cached, fan-out HTTP API.")
+    parser.add_argument('--board', action='append', default=[], metavar='[NAME=]HOST[:HTTP[:BIN]]')
+    parser.add_argument('--boards-file', help="JSON list of board addresses")
+    parser.add_argument('--scan', action='append', default=[], metavar='CIDR', help="probe a subnet for boards")
+    parser.add_argument('--rescan', type=float, default=300, help="seconds between scans (0: once)")
+    parser.add_argument('--mode', choices=('events', 'bin'), default='events', help="state from /api/events pushes or raw port polling")
+    parser.add_argument('--poll', type=float, default=0.5, help="bin mode poll interval (s)")
+    parser.add_argument('--min-interval', type=int, default=200, help="events mode: board min_interval_ms")
+    parser.add_argument('--listen', default='0.0.0.0:8000')
+    args = parser.parse_args()
+    try: asyncio.run(serve(args))
+    except KeyboardInterrupt: pass
+
+if __name__ == '__main__':
+    main()
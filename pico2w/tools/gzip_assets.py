@@ -0,0 +1,37 @@
+# gzip_assets.py
+"""
+Deploy-time helper (runs on the host with CPython, not on the Pico).
+Writes gzip-precompressed copies of the static web assets next to the
+originals, e.g. app.js -> app.js.gz, so Html_controler can serve them to
+browsers that send 'Accept-Encoding: gzip'.
+
+Usage: python3 tools/gzip_assets.py [asset_dir]
+Then copy the .gz files to the board with the other files, e.g.
+    mpremote cp app.js.gz style.css.gz :
+"""
+import gzip
+import os
+import sys
+
+ASSETS = ('style.css', 'app.js')
+
+def gzip_bytes(data):
+    # mtime=0 keeps the output reproducible between deploys
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+def gzip_asset(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    packed = gzip_bytes(data)
+    with open(path + '.gz', 'wb') as f:
+        f.write(packed)
+    return len(data), len(packed)
+
+def main():
+    asset_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    for name in ASSETS:
+        raw, packed = gzip_asset(os.path.join(asset_dir, name))
+        print(f"{name}: {raw} -> {packed} bytes ({100 * packed // raw}%)")
+
+if __name__ == '__main__':
+    main()
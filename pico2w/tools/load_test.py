@@ -0,0 +1,318 @@
+# load_test.py
+"""
+Host load test for the pico2w web server (unix MicroPython port or
+CPython, no board needed). Builds the app on the simulator stand-ins
+(tools/sim) with the background tasks html_server.py starts, then drives
+Html_controler.handle_client directly over in-memory connections: each
+virtual client keeps a keep-alive connection open and sends a weighted
+mix of page, asset, state and API requests back to back, from its own
+client IP (or all from one, --one-ip: a NATed office or one script host
+polling several endpoints). Reports requests per second, p50/p99 latency per kind,
+response codes and the peak live heap (MicroPython: gc.mem_alloc()
+after a gc.collect() every --heap-ms; CPython: the tracemalloc peak).
+
+No sockets are involved, so the numbers cover the server code (parsing,
+routing, templates, JSON streaming, admission control) and not a network
+stack: compare runs on the same host and interpreter. --rate sets
+CLIENT_RATE_PER_S (default 0: the server's default, rate tracking off);
+requests over it are queued behind other clients', not refused.
+MAX_CONNECTIONS still applies, so more clients than that show up as 503s.
+
+Usage (from anywhere; objects take about twice the board's heap on a
+64-bit unix build, so compare heap figures between host runs only):
+    micropython -X heapsize=1M tools/load_test.py [--clients 4] [--seconds 10]
+        [--mix page=1,asset=2,state=6,api=3] [--requests-per-conn 100]
+        [--heap-ms 100] [--seed 1] [--one-ip] [--rate 0] [--debug]
+    python3 tools/load_test.py ...
+"""
+import sys
+TOOLS = sys.argv[0].rpartition('/')[0] or '.'
+sys.path.insert(0, TOOLS + '/sim')
+import sim_env
+sim_env.setup(TOOLS + '/..')
+
+import array
+import gc
+import random
+import config
+
+USAGE = "Usage: load_test.py [--clients N] [--seconds S] [--mix page=1,asset=2,state=6,api=3] [--requests-per-conn N] [--heap-ms MS] [--seed N] [--one-ip] [--rate N] [--debug]"
+OPTIONS = {"clients": 4, "seconds": 10, "mix": "page=1,asset=2,state=6,api=3", "requests-per-conn": 100,
+           "heap-ms": 100, "seed": 1, "one-ip": False, "rate": 0, "debug": False}
+
+def usage():
+    print(USAGE)
+    sys.exit(2)
+
+def parse_args(argv):
+    opts = dict(OPTIONS)
+    i = 1
+    while i < len(argv):
+        key = argv[i][2:]
+        if not argv[i].startswith('--') or key not in opts: usage()
+        if opts[key] is False: opts[key] = True
+        else:
+            i += 1
+            if i == len(argv): usage()
+            opts[key] = argv[i] if isinstance(opts[key], str) else int(argv[i])
+        i += 1
+    return opts
+
+opts = parse_args(sys.argv)
+config.DEBUG = opts["debug"]
+if not config.DEBUG:
+    import micropython
+    micropython.opt_level(1) # As html_server.py does: debug records compiled out of the app
+
+import utime
+import uasyncio
+import network
+from html_controler import Html_controler
+from wifi_manager import Wifi_manager
+
+KINDS = ("page", "asset", "state", "api")
+PAGE, ASSET, STATE, API = 0, 1, 2, 3
+MAX_SAMPLES = 2000 # Latencies kept per kind (reservoir sampled beyond that)
+HEAD = b" HTTP/1.1\r\nHost: pico2w\r\nAccept-Encoding: gzip, deflate\r\n\r\n"
+REQUESTS = ( # Rotated through per kind; state requests are built per client
+    (b"GET /" + HEAD,),
+    (b"GET /style.css" + HEAD, b"GET /app.js" + HEAD, b"GET /favicon.ico" + HEAD),
+    (),
+    (b"GET /pin/mode/13/OUT" + HEAD, b"GET /api/board_state.bin" + HEAD, b"GET /pin/value/13/1" + HEAD,
+     b"GET /api/metrics" + HEAD, b"GET /pin/value/13/0" + HEAD, b"GET /api/log" + HEAD, b"GET /api/history" + HEAD),
+)
+
+class Null_sock:
+    """ Conn.s: the socket calls handle_client makes directly (TCP_NODELAY, non-blocking discard). """
+    def setsockopt(self, level, option, value): pass
+    def readinto(self, buf): return None
+
+class Conn:
+    """
+    One in-memory connection: handle_client's reader and writer on one
+    side (readinto/write/drain/close...), the virtual client on the other
+    (send/response/consume/hang_up).
+    """
+    def __init__(self, ip):
+        self.ip = ip
+        self.s = Null_sock()
+        self.inbox = bytearray() # Client -> server
+        self.in_pos = 0
+        self.outbox = bytearray() # Server -> client
+        self.out_pos = 0
+        self.in_ready = uasyncio.Event()
+        self.out_ready = uasyncio.Event()
+        self.client_closed = False
+        self.server_closed = False
+        self.last_response = False # The latest response said Connection: close
+
+    # --- Server side ---
+    async def readinto(self, buf):
+        while self.in_pos == len(self.inbox):
+            if self.client_closed: return 0
+            self.in_ready.clear()
+            await self.in_ready.wait()
+        n = min(len(buf), len(self.inbox) - self.in_pos)
+        buf[:n] = memoryview(self.inbox)[self.in_pos:self.in_pos + n]
+        self.in_pos += n
+        return n
+
+    def write(self, buf):
+        self.outbox.extend(buf)
+        self.out_ready.set()
+
+    async def awrite(self, buf, off=0, sz=-1):
+        self.write(buf[off:] if sz < 0 else buf[off:off + sz])
+        await self.drain()
+
+    async def drain(self):
+        await uasyncio.sleep_ms(0) # Yield as a socket write would
+
+    def close(self):
+        self.server_closed = True
+        self.out_ready.set()
+
+    async def wait_closed(self): pass
+
+    def is_closing(self):
+        return self.server_closed
+
+    def get_extra_info(self, name):
+        return (self.ip, 50000) if name == 'peername' else None
+
+    # --- Client side ---
+    def send(self, request):
+        if self.in_pos == len(self.inbox): self.inbox, self.in_pos = bytearray(request), 0
+        else: self.inbox.extend(request)
+        self.in_ready.set()
+
+    def hang_up(self):
+        self.client_closed = True
+        self.in_ready.set()
+
+    async def response(self):
+        """ Waits for one whole response; returns (status code, body start, body end) in outbox. Code 0: closed first. """
+        head_end = -1
+        while True:
+            out = self.outbox
+            if head_end < 0:
+                head_end = out.find(b'\r\n\r\n', self.out_pos)
+                if head_end >= 0:
+                    head = bytes(out[self.out_pos:head_end]).lower()
+                    code = int(head[9:12])
+                    body = scan = head_end + 4
+                    i = head.find(b'content-length:')
+                    length = int(head[i + 15:].split(b'\r\n')[0]) if i >= 0 else None
+                    chunked = b'chunked' in head
+                    self.last_response = b'connection: close' in head
+                    if code == 304 or code == 204: length = 0
+            if head_end >= 0:
+                if length is not None:
+                    if len(out) >= body + length: return code, body, body + length
+                elif chunked:
+                    while True: # Walk the chunks that have fully arrived
+                        line_end = out.find(b'\r\n', scan)
+                        if line_end < 0: break
+                        size = int(bytes(out[scan:line_end]), 16)
+                        end = line_end + 2 + size + 2
+                        if len(out) < end: break
+                        if not size: return code, body, end
+                        scan = end
+                elif self.server_closed: return code, body, len(out) # Body ends at close
+            if self.server_closed: return 0, len(out), len(out)
+            self.out_ready.clear()
+            await self.out_ready.wait()
+
+    def consume(self, end):
+        if end >= len(self.outbox): self.outbox, self.out_pos = bytearray(), 0
+        else: self.out_pos = end
+
+class Stats:
+    def __init__(self):
+        self.counts = [0] * len(KINDS)
+        self.samples = [array.array('I', bytes(4 * MAX_SAMPLES)) for _ in KINDS]
+        self.codes = {}
+        self.total = 0
+
+    def record(self, kind, code, us):
+        n = self.counts[kind]
+        self.counts[kind] = n + 1
+        if n < MAX_SAMPLES: self.samples[kind][n] = us
+        else:
+            j = random.getrandbits(30) % (n + 1)
+            if j < MAX_SAMPLES: self.samples[kind][j] = us
+        self.codes[code] = self.codes.get(code, 0) + 1
+        self.total += 1
+
+    def percentile_ms(self, kind, p):
+        n = min(self.counts[kind], MAX_SAMPLES)
+        if not n: return 0.0
+        values = sorted(self.samples[kind][:n])
+        return values[min(n - 1, n * p // 100)] / 1000
+
+def parse_mix(spec):
+    """ 'page=1,asset=2,...' -> table of kind indices, each repeated by its weight. """
+    table = []
+    for item in spec.split(','):
+        name, _, weight = item.partition('=')
+        if name not in KINDS: usage()
+        table.extend([KINDS.index(name)] * int(weight or 1))
+    if not table: usage()
+    return table
+
+def int_after(buf, start, end, key):
+    """ Integer following key in buf[start:end], or None (used for "rev"/"epoch" in state bodies). """
+    i = buf.find(key, start, end)
+    if i < 0: return None
+    i += len(key)
+    j = i
+    while j < end and 48 <= buf[j] <= 57: j += 1
+    return int(bytes(buf[i:j])) if j > i else None
+
+async def client(ctrl, index, stats, mix, deadline, per_conn, one_ip):
+    """ One virtual client: keep-alive connections, one request at a time, until the deadline. """
+    if one_ip: index = 1
+    ip = "10.%d.%d.%d" % (index >> 16 & 255, index >> 8 & 255, index & 255 or 1)
+    rotate = [0] * len(KINDS)
+    rev = epoch = 0
+    while utime.ticks_diff(deadline, utime.ticks_ms()) > 0:
+        conn = Conn(ip)
+        server = uasyncio.create_task(ctrl.handle_client(conn, conn))
+        for _ in range(per_conn):
+            if utime.ticks_diff(deadline, utime.ticks_ms()) <= 0: break
+            kind = mix[random.getrandbits(16) % len(mix)]
+            if kind == STATE: # Polls like app.js: full state first, then deltas since the last rev
+                request = b"GET /api/board_state?since=%d&epoch=%d%s" % (rev, epoch, HEAD)
+            else:
+                options = REQUESTS[kind]
+                request = options[rotate[kind] % len(options)]
+                rotate[kind] += 1
+            t0 = utime.ticks_us()
+            conn.send(request)
+            code, start, end = await conn.response()
+            stats.record(kind, code, utime.ticks_diff(utime.ticks_us(), t0))
+            if kind == STATE and code == 200:
+                rev = int_after(conn.outbox, start, end, b'"rev": ') or rev
+                epoch = int_after(conn.outbox, start, end, b'"epoch": ') or epoch
+            conn.consume(end)
+            if not code or conn.last_response or conn.server_closed: break
+        conn.hang_up()
+        await server
+
+async def heap_sampler(peak, period_ms):
+    """ MicroPython: live heap (after a collection) every period_ms, highest kept in peak[0]. """
+    while True:
+        await uasyncio.sleep_ms(period_ms)
+        gc.collect()
+        alloc = gc.mem_alloc()
+        if alloc > peak[0]: peak[0] = alloc
+
+def live_heap():
+    gc.collect()
+    return gc.mem_alloc()
+
+async def main():
+    mix = parse_mix(opts["mix"])
+    random.seed(opts["seed"])
+    Html_controler.CLIENT_RATE_PER_S = opts["rate"]
+    network.WLAN.JOIN_MS = 0
+    wifi = Wifi_manager(config.WIFI_SSID, config.WIFI_PASSWORD)
+    wifi.begin()
+    tasks = [uasyncio.create_task(wifi.run())]
+    ctrl = Html_controler(wifi)
+    board = ctrl.board
+    for coro in (board._process_pin_actions(), board._process_input_edges(), board._process_pwm_effects(),
+                 board.rules.run(), board.history.run(), ctrl.metrics.run_heap_probe(), ctrl.background_update_task()):
+        tasks.append(uasyncio.create_task(coro))
+    await wifi.up.wait()
+    await uasyncio.sleep_ms(200) # Let the tasks settle (first ADC samples, history)
+
+    stats = Stats()
+    idle = live_heap()
+    peak = [idle]
+    if sim_env.CPYTHON:
+        import tracemalloc
+        tracemalloc.reset_peak()
+    else:
+        tasks.append(uasyncio.create_task(heap_sampler(peak, opts["heap-ms"])))
+    print("pico2w load test: %s, %d client(s)%s, %d s, mix %s, %d request(s) per connection, client rate %s" % (
+        sys.implementation.name, opts["clients"], " on one IP" if opts["one-ip"] else "", opts["seconds"], opts["mix"],
+        opts["requests-per-conn"], "%d/s" % opts["rate"] if opts["rate"] else "off"))
+    t0 = utime.ticks_ms()
+    deadline = utime.ticks_add(t0, opts["seconds"] * 1000)
+    await uasyncio.gather(*[client(ctrl, i + 1, stats, mix, deadline, opts["requests-per-conn"], opts["one-ip"]) for i in range(opts["clients"])])
+    secs = utime.ticks_diff(utime.ticks_ms(), t0) / 1000
+    if sim_env.CPYTHON: peak[0] = tracemalloc.get_traced_memory()[1]
+    for task in tasks: task.cancel()
+
+    print("%-6s %9s %9s %9s" % ("kind", "requests", "p50 ms", "p99 ms"))
+    for kind, name in enumerate(KINDS):
+        if stats.counts[kind]:
+            print("%-6s %9d %9.2f %9.2f" % (name, stats.counts[kind], stats.percentile_ms(kind, 50), stats.percentile_ms(kind, 99)))
+    print("total  %9d requests in %.1f s: %.1f req/s" % (stats.total, secs, stats.total / secs))
+    print("codes  " + " ".join("%s=%d" % (code, n) for code, n in sorted(stats.codes.items())))
+    adm = ctrl.admission
+    print("admit  queued=%d refused=%d over-rate=%d connections-refused=%d" % (adm.queued, adm.refused_requests, adm.over_rate, adm.refused_connections))
+    print("heap   peak %d bytes live (%d idle, +%d under load)" % (peak[0], idle, peak[0] - idle))
+
+uasyncio.run(main())
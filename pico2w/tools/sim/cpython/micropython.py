@@ -0,0 +1,34 @@
+# micropython.py
+""" CPython stand-in for the micropython module (see sim_env.py). """
+import gc
+
+_opt_level = 0
+
+def const(value):
+    return value
+
+def opt_level(level=None):
+    """ Recorded only: CPython's __debug__ follows python -O, not this. """
+    global _opt_level
+    if level is None: return _opt_level
+    _opt_level = level
+
+def mem_info(verbose=None):
+    print("mem: total=%d, current=%d, peak=%d" % (gc.mem_alloc() + gc.mem_free(), gc.mem_alloc(), gc.mem_peak()))
+
+def schedule(fn, arg):
+    fn(arg)
+
+def heap_lock():
+    pass
+
+def heap_unlock():
+    return 0
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+def native(fn):
+    return fn
+
+viper = native
@@ -0,0 +1,92 @@
+# uasyncio.py
+"""
+CPython stand-in for MicroPython's uasyncio (see sim_env.py): asyncio plus
+the MicroPython-only names the app uses. start_server hands the callback
+one Stream object as both reader and writer, as uasyncio does.
+"""
+import asyncio
+from asyncio import * # noqa: F401,F403
+
+def sleep_ms(ms):
+    return asyncio.sleep(ms / 1000)
+
+def wait_for_ms(aw, timeout_ms):
+    return asyncio.wait_for(aw, timeout_ms / 1000)
+
+class ThreadSafeFlag:
+    """ set() wakes one wait(), which clears the flag again. """
+    def __init__(self):
+        self._event = asyncio.Event()
+
+    def set(self):
+        self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self):
+        await self._event.wait()
+        self._event.clear()
+
+class _Sock:
+    """ Stream.s: the socket calls the app makes directly (TCP_NODELAY, a non-blocking discard read). """
+    def __init__(self, sock):
+        self._sock = sock
+
+    def setsockopt(self, level, option, value):
+        if self._sock is not None: self._sock.setsockopt(level, option, value)
+
+    def readinto(self, buf):
+        return None # Nothing buffered for a non-blocking read
+
+class Stream:
+    """ uasyncio.Stream over an asyncio reader/writer pair. """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.s = _Sock(writer.get_extra_info('socket'))
+
+    async def readinto(self, buf):
+        data = await self.reader.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    async def read(self, n=-1):
+        return await self.reader.read(n)
+
+    async def readexactly(self, n):
+        try: return await self.reader.readexactly(n)
+        except asyncio.IncompleteReadError: raise EOFError()
+
+    async def readline(self):
+        return await self.reader.readline()
+
+    def write(self, buf):
+        self.writer.write(bytes(buf)) # Copied: the app reuses its buffers once write() returns
+
+    async def awrite(self, buf, off=0, sz=-1):
+        self.write(buf[off:] if sz < 0 else buf[off:off + sz])
+        await self.drain()
+
+    async def drain(self):
+        try: await self.writer.drain()
+        except ConnectionError as e: raise OSError(*e.args)
+
+    def close(self):
+        self.writer.close()
+
+    async def wait_closed(self):
+        try: await self.writer.wait_closed()
+        except OSError: pass
+
+    def is_closing(self):
+        return self.writer.is_closing()
+
+    def get_extra_info(self, name):
+        return self.writer.get_extra_info(name)
+
+async def start_server(cb, host, port, backlog=5):
+    async def accept(reader, writer):
+        stream = Stream(reader, writer)
+        await cb(stream, stream)
+    return await asyncio.start_server(accept, host, port, backlog=backlog)
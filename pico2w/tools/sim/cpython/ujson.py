@@ -0,0 +1,9 @@
+# ujson.py
+""" CPython stand-in for MicroPython's ujson (see sim_env.py). Decode errors are ValueError subclasses there too. """
+import io
+from json import dumps, load, loads # noqa: F401
+
+def dump(obj, stream):
+    """ As on MicroPython: UTF-8 bytes to byte streams (Json_stream, BytesIO), text only to text files. """
+    text = dumps(obj)
+    stream.write(text if isinstance(stream, io.TextIOBase) else text.encode('utf-8'))
@@ -0,0 +1,32 @@
+# utime.py
+""" CPython stand-in for MicroPython's utime (see sim_env.py): ticks wrap at TICKS_PERIOD as on the board. """
+import time as _time
+from time import gmtime, localtime, mktime, sleep, time_ns
+
+TICKS_PERIOD = 1 << 30
+_TICKS_MAX = TICKS_PERIOD - 1
+_TICKS_HALF = TICKS_PERIOD // 2
+
+def time():
+    return int(_time.time()) # Integer seconds, as on the rp2 port
+
+def ticks_ms():
+    return int(_time.monotonic() * 1000) & _TICKS_MAX
+
+def ticks_us():
+    return (_time.monotonic_ns() // 1000) & _TICKS_MAX
+
+def ticks_cpu():
+    return ticks_us()
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & _TICKS_MAX
+
+def ticks_diff(end, start):
+    return ((end - start + _TICKS_HALF) & _TICKS_MAX) - _TICKS_HALF
+
+def sleep_ms(ms):
+    sleep(ms / 1000)
+
+def sleep_us(us):
+    sleep(us / 1_000_000)
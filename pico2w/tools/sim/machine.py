@@ -0,0 +1,123 @@
+# machine.py
+"""
+Stand-in for MicroPython's machine module on the host (unix MicroPython
+port or CPython), with just enough of Pin, ADC, PWM and Timer for
+Pico_board, Pico_pin, Pico_adc and Pico_pwm to run unmodified. Put
+tools/sim first on sys.path (see sim_env.py).
+
+Simulation hooks: Pin.drive(id, level) sets an input level as the
+outside world would (firing the pin's irq handler on an edge);
+ADC.levels and ADC.noise set the raw counts read_u16() returns.
+"""
+import random
+import utime
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    ALT = 3
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+    _levels = [0] * 30 # Level per GPIO, shared by every Pin object for it
+    _irqs = [None] * 30 # (handler, trigger, pin) per GPIO
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        if type(id) is not int or not 0 <= id < 30: raise ValueError("invalid pin")
+        self._id = id
+        self._mode = self.IN
+        self._pull = None
+        self.init(mode, pull, value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        if mode != -1: self._mode = mode
+        if pull != -1: self._pull = pull
+        if value is not None: Pin._levels[self._id] = 1 if value else 0
+        elif self._mode == self.IN and self._pull in (self.PULL_UP, self.PULL_DOWN):
+            Pin._levels[self._id] = 1 if self._pull == self.PULL_UP else 0
+
+    def value(self, v=None):
+        if v is None: return Pin._levels[self._id]
+        if self._mode == self.OUT: Pin._levels[self._id] = 1 if v else 0
+
+    def on(self): self.value(1)
+    def off(self): self.value(0)
+    def toggle(self): self.value(1 - Pin._levels[self._id])
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+        Pin._irqs[self._id] = (handler, trigger, self) if handler else None
+
+    @staticmethod
+    def drive(id, level):
+        """ Sim: the outside world drives GPIO 'id' to level, calling its irq handler on a matching edge. """
+        level = 1 if level else 0
+        old = Pin._levels[id]
+        Pin._levels[id] = level
+        irq = Pin._irqs[id]
+        if irq and level != old and irq[1] & (Pin.IRQ_RISING if level else Pin.IRQ_FALLING):
+            irq[0](irq[2])
+
+    def __repr__(self):
+        return "Pin(GPIO%d)" % self._id
+
+class ADC:
+    CORE_TEMP = 4
+    levels = {0: 20000, 1: 30000, 2: 40000, 4: 14000} # Raw counts by channel (4: ~27 C)
+    noise = 64 # +/- counts added to each read, like a real ADC's LSB jitter
+
+    def __init__(self, channel):
+        """ channel: ADC channel 0-4, a GPIO number 26-29 or a Pin on one (as rp2 takes them). """
+        if isinstance(channel, Pin): channel = channel._id
+        if 26 <= channel <= 29: channel -= 26
+        elif not 0 <= channel <= 4: raise ValueError("invalid ADC channel")
+        self.channel = channel
+
+    def read_u16(self):
+        raw = ADC.levels.get(self.channel, 0)
+        if ADC.noise: raw += random.getrandbits(8) * ADC.noise // 128 - ADC.noise
+        return 0 if raw < 0 else 65535 if raw > 65535 else raw
+
+class PWM:
+    def __init__(self, pin, freq=None, duty_u16=None):
+        self.pin = pin
+        self._freq = 1000
+        self._duty = 0
+        if freq is not None: self.freq(freq)
+        if duty_u16 is not None: self.duty_u16(duty_u16)
+
+    def freq(self, f=None):
+        if f is None: return self._freq
+        if not 8 <= f <= 62_500_000: raise ValueError("freq too large" if f > 8 else "freq too small")
+        self._freq = f
+
+    def duty_u16(self, d=None):
+        if d is None: return self._duty
+        self._duty = d & 0xffff
+
+    def deinit(self):
+        self._duty = 0
+
+class Timer:
+    """ No hardware timer on the host: like a port without one, construction fails and Pwm_effects steps from its async fallback. """
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, *args, **kwargs):
+        raise ValueError("no hardware timer in the simulator")
+
+def reset():
+    raise SystemExit("machine.reset()")
+
+def soft_reset():
+    raise SystemExit("machine.soft_reset()")
+
+def idle():
+    utime.sleep_ms(1)
+
+def freq():
+    return 150_000_000
+
+def unique_id():
+    return b'\xe6\x61\x4c\x31\x23\x47\x5e\x2b'
@@ -0,0 +1,63 @@
+# network.py
+"""
+Stand-in for MicroPython's network module on the host (see machine.py).
+WLAN joins any SSID after JOIN_MS and reports the loopback address, so
+the app serves on 127.0.0.1.
+
+Simulation hooks (class attributes of WLAN): JOIN_MS, BAD_SSIDS (joins
+to these fail with STAT_CONNECT_FAIL), link_lost (True drops a joined
+link until set back to False).
+"""
+import utime
+
+STA_IF = 0
+AP_IF = 1
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_WRONG_PASSWORD = -3
+STAT_NO_AP_FOUND = -2
+STAT_CONNECT_FAIL = -1
+STAT_GOT_IP = 3
+
+class WLAN:
+    JOIN_MS = 1500
+    BAD_SSIDS = ("bad",)
+    link_lost = False
+    IFCONFIG = ('127.0.0.1', '255.0.0.0', '127.0.0.1', '127.0.0.1')
+
+    def __init__(self, interface=STA_IF):
+        self.interface = interface
+        self._active = False
+        self._ssid = None
+        self._since = None # ticks_ms of connect(), None while disconnected
+
+    def active(self, is_active=None):
+        if is_active is None: return self._active
+        self._active = bool(is_active)
+        if not self._active: self._since = None
+
+    def connect(self, ssid=None, key=None, **kwargs):
+        self._active = True
+        self._ssid = ssid
+        self._since = utime.ticks_ms()
+
+    def disconnect(self):
+        self._since = None
+
+    def status(self, param=None):
+        if param == 'rssi': return -50
+        if self._since is None: return STAT_IDLE
+        if self._ssid in WLAN.BAD_SSIDS: return STAT_CONNECT_FAIL
+        if WLAN.link_lost or utime.ticks_diff(utime.ticks_ms(), self._since) < WLAN.JOIN_MS: return STAT_CONNECTING
+        return STAT_GOT_IP
+
+    def isconnected(self):
+        return self.status() == STAT_GOT_IP
+
+    def ifconfig(self, config=None):
+        return WLAN.IFCONFIG if self.isconnected() else ('0.0.0.0', '0.0.0.0', '0.0.0.0', '0.0.0.0')
+
+    def config(self, *args, **kwargs):
+        if args == ('ssid',) or args == ('essid',): return self._ssid or ''
+        if args == ('mac',): return b'\x28\xcd\xc1\x00\x00\x01'
+        return None
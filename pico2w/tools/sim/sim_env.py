@@ -0,0 +1,79 @@
+# sim_env.py
+"""
+Host environment for running the pico2w app off the board, under the
+unix MicroPython port or CPython 3.8+. Puts the stand-in machine,
+network and ubluetooth modules (this directory) ahead of the app on
+sys.path; under CPython also the stand-ins in cpython/ (micropython,
+utime, uasyncio, ujson), gc.mem_alloc/mem_free/mem_peak backed by
+tracemalloc, sys.print_exception and io.BytesIO(size); under MicroPython
+an Event-based ThreadSafeFlag (see _patch_micropython). The app itself
+runs unmodified.
+
+    sys.path.insert(0, "<pico2w>/tools/sim")
+    import sim_env
+    sim_env.setup("<pico2w>")
+"""
+import sys
+
+CPYTHON = sys.implementation.name != 'micropython'
+HEAP_BYTES = 256 * 1024 # Heap size gc.mem_free() reports against under CPython
+
+def setup(app_dir, trace_heap=True):
+    """
+    Call before importing any app module. Changes into app_dir (the app
+    opens its templates and assets by relative name). trace_heap=False
+    skips tracemalloc under CPython (faster; gc.mem_alloc() then reads 0).
+    """
+    import os
+    cwd = os.getcwd()
+    absolute = lambda path: path if path.startswith('/') else cwd + '/' + path
+    sim_dir = absolute(__file__.rpartition('/')[0] or '.')
+    app_dir = absolute(app_dir)
+    os.chdir(app_dir)
+    for path in (sim_dir, sim_dir + '/cpython', app_dir):
+        while path in sys.path: sys.path.remove(path)
+    # App before the script's own directory: tools/state_bin.py must not shadow the app's state_bin.py
+    sys.path[0:0] = [sim_dir + '/cpython', sim_dir, app_dir] if CPYTHON else [sim_dir, app_dir]
+    if CPYTHON: _patch_cpython(trace_heap)
+    else: _patch_micropython()
+
+def _patch_micropython():
+    # The unix port can't block in poll() on a ThreadSafeFlag: while any task
+    # waits on one, every scheduler pass sleeps ~1 ms. Nothing here sets a
+    # flag from a real interrupt, so an Event-based flag behaves the same.
+    import uasyncio
+    uasyncio.ThreadSafeFlag = Task_flag
+
+class Task_flag:
+    """ ThreadSafeFlag semantics (set() wakes wait(), which clears the flag) on a uasyncio.Event. """
+    def __init__(self):
+        import uasyncio
+        self._event = uasyncio.Event()
+
+    def set(self):
+        self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self):
+        await self._event.wait()
+        self._event.clear()
+
+def _patch_cpython(trace_heap):
+    import gc
+    import traceback
+    import tracemalloc
+    if trace_heap and not tracemalloc.is_tracing(): tracemalloc.start()
+    gc.mem_alloc = lambda: tracemalloc.get_traced_memory()[0]
+    gc.mem_free = lambda: max(0, HEAP_BYTES - gc.mem_alloc())
+    gc.mem_peak = lambda: tracemalloc.get_traced_memory()[1]
+    sys.print_exception = lambda e, file=None: traceback.print_exception(type(e), e, e.__traceback__, file=file)
+    io.BytesIO = _Bytes_io
+
+import io
+
+class _Bytes_io(io.BytesIO):
+    """ io.BytesIO that also takes MicroPython's BytesIO(size) (preallocated, initially empty). """
+    def __init__(self, initial=b''):
+        super().__init__(b'' if isinstance(initial, int) else initial)
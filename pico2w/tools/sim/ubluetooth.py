@@ -0,0 +1,22 @@
+# ubluetooth.py
+""" Stand-in for MicroPython's ubluetooth module on the host (see machine.py): a BLE radio that accepts advertising and records it. """
+
+class BLE:
+    def __init__(self):
+        self._active = False
+        self.advertising = None # (interval_us, adv_data) while advertising
+
+    def active(self, is_active=None):
+        if is_active is None: return self._active
+        self._active = bool(is_active)
+        if not self._active: self.advertising = None
+
+    def gap_advertise(self, interval_us, adv_data=None, resp_data=None, connectable=True):
+        if not self._active: raise OSError(19) # ENODEV, as on a board with the radio off
+        self.advertising = None if interval_us is None else (interval_us, adv_data)
+
+    def config(self, *args, **kwargs):
+        return None
+
+    def irq(self, handler):
+        pass
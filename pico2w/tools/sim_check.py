@@ -0,0 +1,50 @@
+# sim_check.py
+"""
+Quick check that the simulator stand-ins (tools/sim) drive the app the
+way the board does: builds Pico_board on them and reads the ADC channels
+and temperature through the app's own classes. Prints each check and
+exits 1 if any fails; run it after changing tools/sim or the hardware
+wrappers (pico_pin.py, pico_adc.py).
+
+Usage: micropython tools/sim_check.py [--debug]
+       python3 tools/sim_check.py [--debug]
+"""
+import sys
+TOOLS = sys.argv[0].rpartition('/')[0] or '.'
+sys.path.insert(0, TOOLS + '/sim')
+import sim_env
+sim_env.setup(TOOLS + '/..', trace_heap=False)
+
+import config
+config.DEBUG = '--debug' in sys.argv
+
+import machine
+from pico_board import Pico_board
+from wifi_manager import Wifi_manager
+
+failures = 0
+
+def check(name, ok, detail=""):
+    global failures
+    print("%s %s %s" % ("ok  " if ok else "FAIL", name, detail))
+    if not ok: failures += 1
+
+def adc_channel(arg):
+    """ Channel machine.ADC(arg) opens, or None if it refuses arg. """
+    try: return machine.ADC(arg).channel
+    except ValueError: return None
+
+def main():
+    for arg, channel in ((0, 0), (4, 4), (26, 0), (27, 1), (28, 2), (29, 3), (machine.Pin(26), 0), (5, None)):
+        check("ADC(%r) is channel %s" % (arg, channel), adc_channel(arg) == channel)
+
+    board = Pico_board(Wifi_manager("", ""))
+    for channel in range(3):
+        volts = board.adc.read_volts(channel)
+        check("Pico_board adc.read_volts(%d) non-zero" % channel, volts > 0, "%.3f V" % volts)
+    temp_c = board.adc.read_temp_c()
+    check("Pico_board temperature plausible", -40 < temp_c < 125, "%.1f C" % temp_c)
+
+main()
+print("%d check(s) failed" % failures if failures else "all checks passed")
+sys.exit(1 if failures else 0)
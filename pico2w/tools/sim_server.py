@@ -0,0 +1,37 @@
+# sim_server.py
+"""
+Runs the whole pico2w app (html_server.py, unmodified) on the host
+against the simulator stand-ins in tools/sim, under the unix MicroPython
+port or CPython: the web UI, the API and the raw state port served on
+localhost, for trying changes, scripts and tools/fleet.py without a
+board. Several can run side by side on different ports.
+
+Usage: micropython tools/sim_server.py [--http 8080] [--bin 8081] [--debug]
+       python3 tools/sim_server.py ...
+"""
+import sys
+TOOLS = sys.argv[0].rpartition('/')[0] or '.'
+sys.path.insert(0, TOOLS + '/sim')
+import sim_env
+sim_env.setup(TOOLS + '/..', trace_heap=False)
+
+import config
+
+USAGE = "Usage: sim_server.py [--http PORT] [--bin PORT (0: off)] [--debug]"
+
+def main():
+    http_port, bin_port = 8080, 8081
+    args = sys.argv[1:]
+    config.DEBUG = '--debug' in args
+    try:
+        if '--http' in args: http_port = int(args[args.index('--http') + 1])
+        if '--bin' in args: bin_port = int(args[args.index('--bin') + 1])
+    except (IndexError, ValueError):
+        raise SystemExit(USAGE)
+    import html_server # Applies opt_level and imports the app, as on the board
+    html_server.Html_controler.HTTP_PORT = http_port
+    html_server.Html_controler.STATE_BIN_PORT = bin_port
+    print("Simulated board: http://127.0.0.1:%d/ (state port %s)" % (http_port, bin_port or "off"))
+    html_server.run()
+
+main()
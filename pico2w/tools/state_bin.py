@@ -0,0 +1,136 @@
+# state_bin.py
+"""
+Host-side decoder (CPython, not for the Pico) for the binary board state
+served by the Pico at /api/board_state.bin and on the raw TCP port
+(Html_controler.STATE_BIN_PORT, default 8081). The format is described
+in the board's state_bin.py; the struct layouts below must match it.
+
+decode() turns a frame into a dict shaped like /api/board_state's JSON
+(numbers instead of formatted strings, no pin names).
+
+Usage: python3 tools/state_bin.py <pico-host> [--tcp [--port 8081]] [--watch SECONDS] [--compare]
+    --watch polls deltas (since=<rev>) and prints each changed pin
+    --compare fetches /api/board_state too and prints both sizes
+"""
+import argparse
+import json
+import socket
+import struct
+import time
+import urllib.request
+
+MAGIC = b'PS'
+VERSION = 1
+HEADER = struct.Struct("<2sBBIIIIHHHH4sB")
+PIN_RECORD = struct.Struct("<BBBBHI")
+REQUEST = struct.Struct("<II")
+F_FULL, F_BLE_ADV, F_WIFI_UP = 1, 2, 4
+P_LEVEL, P_PULL_UP, P_PULL_DOWN, P_GPIO, P_EFFECT = 1, 2, 4, 8, 16
+MODES = ("N/A", "IN", "OUT", "ADC", "PWM")
+CONTROLLERS = ("N/A", "GPIO", "ADC", "PWM")
+ADC_VOLTS_PER_COUNT = 3.3 / 65535
+
+def temp_c(raw):
+    """ RP2 internal sensor, as Pico_adc.read_temp_c. """
+    return 27.0 - (raw * ADC_VOLTS_PER_COUNT - 0.706) / 0.001721
+
+def decode(frame):
+    """ Decodes one state frame. Raises ValueError on a bad magic, version or length. """
+    if len(frame) < HEADER.size:
+        raise ValueError(f"Frame too short ({len(frame)} bytes)")
+    (magic, version, flags, epoch, rev, log_seq, secs, temp_raw,
+     adc0, adc1, adc2, ip, count) = HEADER.unpack_from(frame)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Not a version {VERSION} state frame (magic {magic!r}, version {version})")
+    if len(frame) != HEADER.size + count * PIN_RECORD.size:
+        raise ValueError(f"Frame is {len(frame)} bytes, header says {count} pin(s)")
+    pins = []
+    for pin_id, mode, controller, pin_flags, duty, freq in PIN_RECORD.iter_unpack(frame[HEADER.size:]):
+        pin = {
+            "id": pin_id,
+            "mode": MODES[mode] if mode < len(MODES) else "N/A",
+            "controller": CONTROLLERS[controller] if controller < len(CONTROLLERS) else "N/A",
+            "pull": "UP" if pin_flags & P_PULL_UP else "DOWN" if pin_flags & P_PULL_DOWN else "NONE",
+        }
+        pin["value"] = (1 if pin_flags & P_LEVEL else 0) if pin_flags & P_GPIO else pin["controller"]
+        if pin["controller"] == "PWM":
+            pin["pwm_freq"] = freq
+            pin["pwm_duty"] = duty / 65535 * 100
+            pin["pwm_effect"] = bool(pin_flags & P_EFFECT)
+        pins.append(pin)
+    return {
+        "rev": rev,
+        "epoch": epoch,
+        "full": bool(flags & F_FULL),
+        "log_seq": log_seq,
+        "pins": pins,
+        "status": {
+            "ip": ".".join(str(b) for b in ip),
+            "temp_c": temp_c(temp_raw),
+            "time": secs,
+            "ble_advertising": bool(flags & F_BLE_ADV),
+            "wifi_up": bool(flags & F_WIFI_UP),
+        },
+        "adc_volts": {"adc0": adc0 * ADC_VOLTS_PER_COUNT, "adc1": adc1 * ADC_VOLTS_PER_COUNT, "adc2": adc2 * ADC_VOLTS_PER_COUNT},
+    }
+
+def fetch(host, since=0, epoch=0, timeout=5):
+    """ GET /api/board_state.bin; returns the raw frame. """
+    with urllib.request.urlopen(f"http://{host}/api/board_state.bin?since={since}&epoch={epoch}", timeout=timeout) as resp:
+        return resp.read()
+
+class State_bin_client:
+    """ Raw TCP port client: one connection, request() per frame. """
+    def __init__(self, host, port=8081, timeout=5):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+
+    def _read(self, n):
+        data = b''
+        while len(data) < n:
+            got = self.sock.recv(n - len(data))
+            if not got: raise ConnectionError("Connection closed by the Pico")
+            data += got
+        return data
+
+    def request(self, since=0, epoch=0):
+        self.sock.sendall(REQUEST.pack(epoch, since))
+        (n,) = struct.unpack("<H", self._read(2))
+        return self._read(n)
+
+    def close(self):
+        self.sock.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch and decode the Pico's binary board state.")
+    parser.add_argument('host')
+    parser.add_argument('--tcp', action='store_true', help="use the raw TCP port instead of HTTP")
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--watch', type=float, metavar='SECONDS', help="poll deltas at this interval")
+    parser.add_argument('--compare', action='store_true', help="also fetch the JSON state and compare sizes")
+    args = parser.parse_args()
+
+    client = State_bin_client(args.host, args.port) if args.tcp else None
+    get = client.request if client else (lambda since, epoch: fetch(args.host, since, epoch))
+    frame = get(0, 0)
+    state = decode(frame)
+    print(json.dumps(state, indent=1))
+    if args.compare:
+        with urllib.request.urlopen(f"http://{args.host}/api/board_state", timeout=5) as resp:
+            size = len(resp.read())
+        print(f"binary {len(frame)} bytes, JSON {size} bytes ({size / len(frame):.1f}x)")
+    try:
+        while args.watch:
+            time.sleep(args.watch)
+            delta = decode(get(state["rev"], state["epoch"]))
+            if delta["full"] or delta["epoch"] != state["epoch"]:
+                print("-- full state (board reset?)")
+            for pin in delta["pins"]:
+                print(f"rev {delta['rev']}: {pin}")
+            state = delta
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if client: client.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+# wifi_manager.py
+import log
+import network
+import utime
+import uasyncio
+
+_log = log.Logger("wifi_manager")
+
+# Link states
+WIFI_DOWN = 0
+WIFI_CONNECTING = 1
+WIFI_UP = 2
+
+NO_IFCONFIG = ('0.0.0.0',) * 4
+
+class Wifi_manager:
+    """
+    Owns the station interface and keeps it connected from a background
+    task (run()): joins, waits for an IP without blocking the event loop,
+    retries failures with exponential backoff and rejoins after a drop.
+    Link changes are published to listeners (fn(state, ip), called from the
+    task) and through the 'up' Event, so the server can start as soon as an
+    address exists while the rest of startup carries on.
+    """
+    CONNECT_TIMEOUT_MS = 15000 # Per attempt, join + DHCP
+    POLL_MS = 250              # Link status poll while joining
+    CHECK_MS = 2000            # Link check period while up
+    BACKOFF_MIN_MS = 1000
+    BACKOFF_MAX_MS = 60000
+
+    def __init__(self, ssid, password, nic=None):
+        self.ssid = ssid
+        self.password = password
+        self.nic = nic if nic is not None else network.WLAN(network.STA_IF)
+        self.state = WIFI_DOWN
+        self.ifconfig = NO_IFCONFIG # (ip, netmask, gateway, dns) while up
+        self.up = uasyncio.Event() # Set while an IP is held
+        self._listeners = []
+        self._kick = uasyncio.Event() # Set to abandon the current wait/backoff and (re)join now
+        self._rejoin = False # Drop the current link first (credentials changed)
+        # Counters (for /api/metrics)
+        self.connects = 0
+        self.drops = 0
+        self.failures = 0
+
+    @property
+    def ip(self):
+        return self.ifconfig[0]
+
+    def add_listener(self, fn):
+        """ fn(state, ip) is called on every link state change. """
+        self._listeners.append(fn)
+
+    def _set_state(self, state):
+        if state == self.state: return
+        self.state = state
+        if state == WIFI_UP:
+            self.ifconfig = self.nic.ifconfig()
+            self.up.set()
+        else:
+            self.ifconfig = NO_IFCONFIG
+            self.up.clear()
+        for fn in self._listeners:
+            try: fn(state, self.ip)
+            except Exception as e: _log.error("Wifi: Listener error: %s", e)
+
+    def begin(self):
+        """ Sync: Starts joining right away (association then proceeds in the radio while the app initialises). """
+        if self.nic.isconnected():
+            self._set_state(WIFI_UP)
+            return
+        self._join()
+
+    def _join(self):
+        __debug__ and _log.debug("Wifi: Joining '%s'...", self.ssid)
+        try:
+            self.nic.active(True)
+            joining = network.STAT_CONNECTING <= self.nic.status() < network.STAT_GOT_IP # Joined, waiting for DHCP counts too
+            if self._rejoin or not joining: # boot.py may have started joining already
+                self.nic.connect(self.ssid, self.password)
+            self._rejoin = False
+        except Exception as e:
+            _log.error("Wifi: Error starting join: %s", e)
+        self._set_state(WIFI_CONNECTING)
+
+    async def _wait_kick(self, ms):
+        """ Sleeps up to ms; returns True early if kicked. """
+        try:
+            await uasyncio.wait_for_ms(self._kick.wait(), ms)
+        except uasyncio.TimeoutError:
+            return False
+        self._kick.clear()
+        return True
+
+    async def _wait_joined(self):
+        """ Polls the link until it has an IP, fails or times out. Returns True if up. """
+        start = utime.ticks_ms()
+        while utime.ticks_diff(utime.ticks_ms(), start) < self.CONNECT_TIMEOUT_MS:
+            if self.nic.isconnected(): return True
+            if self.nic.status() < 0: # STAT_WRONG_PASSWORD, STAT_NO_AP_FOUND, STAT_CONNECT_FAIL
+                _log.warning("Wifi: Join failed, status %s.", self.nic.status())
+                return False
+            if await self._wait_kick(self.POLL_MS): return False # Credentials changed, start over
+        _log.warning("Wifi: Join timed out.")
+        return False
+
+    async def run(self):
+        """ Background task: keeps the link up. Never returns (cancel to stop). """
+        backoff = self.BACKOFF_MIN_MS
+        while True:
+            if self.state == WIFI_UP:
+                await self._wait_kick(self.CHECK_MS)
+                if self._rejoin:
+                    try: self.nic.disconnect()
+                    except Exception as e: _log.error("Wifi: Error disconnecting: %s", e)
+                elif self.nic.isconnected():
+                    continue
+                else:
+                    self.drops += 1
+                    _log.warning("Wifi: Link lost, rejoining.")
+                self._set_state(WIFI_DOWN)
+                backoff = self.BACKOFF_MIN_MS
+            if self.state == WIFI_DOWN:
+                self._join()
+            if await self._wait_joined():
+                self.connects += 1
+                backoff = self.BACKOFF_MIN_MS
+                self._set_state(WIFI_UP)
+                _log.info("Wifi: Connected to '%s', IP %s.", self.ssid, self.ip)
+                continue
+            if not self._rejoin: self.failures += 1
+            try: self.nic.disconnect() # Stop the driver retrying on its own while backing off
+            except Exception: pass
+            self._set_state(WIFI_DOWN)
+            if not self._rejoin:
+                __debug__ and _log.debug("Wifi: Retrying in %s ms.", backoff)
+                await self._wait_kick(backoff)
+                backoff = min(backoff * 2, self.BACKOFF_MAX_MS)
+
+    async def connect(self, ssid, password, timeout_ms=None):
+        """ Switches to new credentials and waits for the link (up to CONNECT_TIMEOUT_MS). Returns True if up. """
+        self.ssid = ssid
+        self.password = password
+        self._rejoin = True
+        self.up.clear()
+        self._kick.set()
+        try:
+            await uasyncio.wait_for_ms(self.up.wait(), timeout_ms or self.CONNECT_TIMEOUT_MS)
+            return True
+        except uasyncio.TimeoutError:
+            return False